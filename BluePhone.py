@@ -7,11 +7,42 @@ Auto-installs all required dependencies
 """
 
 import subprocess
+import tempfile
+import argparse
+import atexit
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import csv
 import os
+import plistlib
+import posixpath
+import re
 import sys
 import time
 import socket
+import sqlite3
+import stat
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import shlex
+import shutil
+import signal
+import ssl
+import struct
+import threading
+import zlib
 from pathlib import Path
+from xml.parsers.expat import ExpatError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Colors:
     HEADER = '\033[95m'
@@ -23,16 +54,191 @@ class Colors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
 
-def run_command(cmd, check=False, capture=True, shell=False):
+class CommandTracer:
+    """Records every run_command / async_run_command call in a ring buffer
+
+    Each record has the argv, start time, wall time, exit code (None when the
+    command could not be started or timed out), stdout/stderr sizes and the
+    method that ran it. Streams started with Popen are recorded when closed. Recording is a deque append, so it stays on by
+    default; export_chrome() writes a file chrome://tracing or Perfetto open.
+    """
+    def __init__(self, capacity=4096):
+        self.records = collections.deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.dropped = 0
+
+    @staticmethod
+    def caller(skip=2):
+        """Qualified name of the first frame outside the command helpers"""
+        frame = sys._getframe(skip)
+        while frame and frame.f_code.co_name in ('run_command', 'async_run_command'):
+            frame = frame.f_back
+        if frame is None:
+            return None
+        if frame.f_globals.get('__name__', '').startswith('asyncio'):
+            # A coroutine wrapped in its own task (gather, create_task) is resumed by
+            # the event loop; its creator is only known with origin tracking on
+            task = asyncio.current_task()
+            origin = getattr(task.get_coro(), 'cr_origin', None) if task else None
+            for _, _, name in origin or ():
+                if not name.startswith('<') and name not in ('run_command', 'async_run_command'):
+                    return name
+        code = frame.f_code
+        # Comprehensions and lambdas are reported as the function containing them
+        return getattr(code, 'co_qualname', code.co_name).split('.<locals>.<', 1)[0]
+
+    @staticmethod
+    def command_key(cmd):
+        """Tool plus subcommand, e.g. 'adb shell' or 'sudo apt-get update', for grouping"""
+        argv = shlex.split(cmd) if isinstance(cmd, str) else [str(arg) for arg in cmd]
+        if not argv:
+            return ''
+        words = []
+        if argv[0] == 'sudo' and len(argv) > 1:
+            words.append('sudo')
+            argv = argv[1:]
+        words.append(os.path.basename(argv[0]))
+        rest = argv[1:]
+        index = 0
+        while index < len(rest):
+            if rest[index] in ('-s', '-u'):
+                index += 2
+                continue
+            if not rest[index].startswith('-'):
+                words.append(rest[index])
+                break
+            index += 1
+        return ' '.join(words)
+
+    def record(self, cmd, start, duration, returncode, stdout=None, stderr=None, caller=None, mode='sync'):
+        if not self.enabled:
+            return
+        entry = {
+            'argv': cmd if isinstance(cmd, str) else [str(arg) for arg in cmd],
+            'start': start,
+            'duration': duration,
+            'returncode': returncode,
+            'stdout_bytes': self._size(stdout),
+            'stderr_bytes': self._size(stderr),
+            'caller': caller,
+            'mode': mode,
+            'thread': threading.get_ident(),
+        }
+        with self.lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(entry)
+
+    @staticmethod
+    def _size(output):
+        if output is None or isinstance(output, int):
+            return output
+        return len(output.encode('utf-8', 'replace')) if isinstance(output, str) else len(output)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.dropped = 0
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'dropped': self.dropped, 'commands': self.snapshot()}, f, indent=2)
+
+    def export_chrome(self, path):
+        """Chrome trace event format, one complete ('X') event per command"""
+        pid = os.getpid()
+        events = []
+        for entry in self.snapshot():
+            argv = entry['argv'] if isinstance(entry['argv'], str) else ' '.join(entry['argv'])
+            events.append({
+                'name': self.command_key(entry['argv']),
+                'cat': 'subprocess',
+                'ph': 'X',
+                'ts': entry['start'] * 1e6,
+                'dur': entry['duration'] * 1e6,
+                'pid': pid,
+                'tid': entry['thread'],
+                'args': {'argv': argv, 'returncode': entry['returncode'], 'caller': entry['caller'],
+                         'stdout_bytes': entry['stdout_bytes'], 'stderr_bytes': entry['stderr_bytes']},
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self, top=10):
+        """Slowest individual commands and per-command totals, most time first"""
+        records = self.snapshot()
+        groups = {}
+        for entry in records:
+            group = groups.setdefault(self.command_key(entry['argv']),
+                                      {'count': 0, 'total': 0.0, 'max': 0.0, 'failed': 0, 'callers': set()})
+            group['count'] += 1
+            group['total'] += entry['duration']
+            group['max'] = max(group['max'], entry['duration'])
+            group['failed'] += entry['returncode'] != 0
+            group['callers'].add(entry['caller'])
+        return {
+            'commands': len(records),
+            'total': sum(entry['duration'] for entry in records),
+            'slowest': sorted(records, key=lambda entry: entry['duration'], reverse=True)[:top],
+            'frequent': sorted(groups.items(), key=lambda item: (item[1]['count'], item[1]['total']), reverse=True)[:top],
+        }
+
+    def print_summary(self, top=10):
+        summary = self.summary(top)
+        print(f"\n{Colors.OKBLUE}Subprocess trace: {summary['commands']} commands, "
+              f"{summary['total']:.2f}s total{Colors.ENDC}")
+        if self.dropped:
+            print(f"{Colors.WARNING}⚠ {self.dropped} older commands were dropped from the ring buffer{Colors.ENDC}")
+        if not summary['commands']:
+            return summary
+        print(f"\n{Colors.OKCYAN}Slowest commands:{Colors.ENDC}")
+        for entry in summary['slowest']:
+            argv = entry['argv'] if isinstance(entry['argv'], str) else ' '.join(entry['argv'])
+            argv = argv if len(argv) <= 50 else argv[:47] + '...'
+            print(f"  {entry['duration'] * 1000:9.1f} ms  exit {str(entry['returncode']):4}  {argv:50}  {entry['caller']}")
+        print(f"\n{Colors.OKCYAN}Most frequent commands:{Colors.ENDC}")
+        for key, group in summary['frequent']:
+            callers = ', '.join(sorted(str(caller) for caller in group['callers']))
+            print(f"  {group['count']:5}x  {group['total']:7.2f}s total  {group['total'] / group['count'] * 1000:8.1f} ms avg  "
+                  f"{group['failed']:3} failed  {key:28}  {callers}")
+        return summary
+
+    def finish(self, path, fmt='chrome'):
+        """Write the trace and print the summary, registered with atexit by --trace"""
+        try:
+            if fmt == 'json':
+                self.export_json(path)
+            else:
+                self.export_chrome(path)
+            print(f"\n{Colors.OKGREEN}✓ Trace written to {path}{Colors.ENDC}")
+        except OSError as e:
+            print(f"{Colors.FAIL}✗ Could not write trace: {e}{Colors.ENDC}")
+        self.print_summary()
+
+command_tracer = CommandTracer()
+
+def run_command(cmd, check=False, capture=True, shell=False, text=True, cwd=None, input=None):
     """Helper function to run commands with better error handling"""
+    caller = command_tracer.caller() if command_tracer.enabled else None
+    start = time.time()
+    began = time.perf_counter()
+    returncode = stdout = stderr = None
     try:
         if capture:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=check, shell=shell)
-            return result
+            result = subprocess.run(cmd, capture_output=True, text=text, check=check, shell=shell, cwd=cwd,
+                                    input=input)
+            stdout, stderr = result.stdout, result.stderr
         else:
-            result = subprocess.run(cmd, check=check, shell=shell)
-            return result
+            result = subprocess.run(cmd, check=check, shell=shell, cwd=cwd, input=input)
+        returncode = result.returncode
+        return result
     except subprocess.CalledProcessError as e:
+        returncode, stdout, stderr = e.returncode, e.stdout, e.stderr
         print(f"{Colors.FAIL}Command failed: {' '.join(cmd) if isinstance(cmd, list) else cmd}{Colors.ENDC}")
         if capture and e.stderr:
             print(f"{Colors.FAIL}Error: {e.stderr}{Colors.ENDC}")
@@ -40,17 +246,2353 @@ def run_command(cmd, check=False, capture=True, shell=False):
     except Exception as e:
         print(f"{Colors.FAIL}Unexpected error: {e}{Colors.ENDC}")
         return None
+    finally:
+        command_tracer.record(cmd, start, time.perf_counter() - began, returncode, stdout, stderr, caller)
 
-class AndroidAccess:
-    def __init__(self):
-        self.adb_path = self.check_and_install_adb()
+class ToolProbe:
+    """In-process tool lookups with an on-disk cache
+
+    The cache is only trusted for the PATH it was built with. A found tool is
+    revalidated by its mtime, a missing one by the mtimes of the PATH directories,
+    so installing or upgrading a package invalidates the entry.
+    """
+    def __init__(self, cache_file=None):
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        self.cache_file = cache_file or os.path.join(cache_home, 'bluephone', 'tools.json')
+        self.path_env = os.environ.get('PATH', os.defpath)
+        self.entries = None
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        self.entries = {}
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+            if data.get('path') == self.path_env:
+                self.entries = data.get('tools', {})
+        except (OSError, ValueError):
+            pass
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _path_dirs(self):
+        return [d for d in self.path_env.split(os.pathsep) if d]
+
+    def _valid(self, entry):
+        if entry.get('path'):
+            return self._mtime(entry['path']) == entry.get('mtime')
+        return all(self._mtime(d) == m for d, m in entry.get('dirs', {}).items())
+
+    def which(self, tool):
+        """Return the full path of tool, or None if it is not on PATH"""
+        if self.entries is None:
+            self._load()
+        entry = self.entries.get(tool)
+        if entry is not None and self._valid(entry):
+            self.hits += 1
+            return entry.get('path')
         
-    def check_and_install_adb(self):
-        """Check if ADB is installed, install if not"""
-        result = run_command(['which', 'adb'])
-        if result and result.returncode == 0:
+        self.misses += 1
+        path = shutil.which(tool, path=self.path_env)
+        if path:
+            entry = {'path': path, 'mtime': self._mtime(path)}
+        else:
+            entry = {'path': None, 'dirs': {d: self._mtime(d) for d in self._path_dirs()}}
+        self.entries[tool] = entry
+        self.dirty = True
+        return path
+
+    def forget(self, tool=None):
+        """Drop one tool (or everything) from the cache"""
+        if self.entries is None:
+            self._load()
+        if tool is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(tool, None)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump({'path': self.path_env, 'tools': self.entries}, f)
+            os.replace(tmp, self.cache_file)
+            self.dirty = False
+        except OSError:
+            pass
+
+tool_probe = ToolProbe()
+
+def find_tool(tool):
+    """Cached replacement for `which tool`"""
+    path = tool_probe.which(tool)
+    tool_probe.save()
+    return path
+
+def service_active(name):
+    """Check a systemd unit with `systemctl is-active`"""
+    result = run_command(['systemctl', 'is-active', name])
+    return bool(result) and result.stdout.strip() == 'active'
+
+class InstallPlanner:
+    """Collects everything missing for a set of features, then installs it in one apt transaction
+
+    Tools are looked up through the probe cache. Packages without a binary
+    (libraries, daemons, plugins, headers) are checked with one dpkg-query,
+    and only when something is being installed anyway or thorough=True, so a
+    host that is already set up spawns nothing. At most one `apt-get update`
+    runs, and it is skipped when the package lists are newer than
+    update_max_age. At most one `apt-get install` runs. runner takes an argv
+    and returns a CompletedProcess or None, like run_command.
+    """
+    # Tool -> package providing it
+    TOOL_PACKAGES = {
+        'adb': 'adb',
+        'scrcpy': 'scrcpy',
+        'idevice_id': 'libimobiledevice-utils',
+        'ideviceinfo': 'libimobiledevice-utils',
+        'idevicescreenshot': 'libimobiledevice-utils',
+        'idevicepair': 'libimobiledevice-utils',
+        'idevicebackup2': 'libimobiledevice-utils',
+        'idevicesyslog': 'libimobiledevice-utils',
+        'iproxy': 'libusbmuxd-tools',
+        'ifuse': 'ifuse',
+        'avahi-browse': 'avahi-utils',
+        'gst-launch-1.0': 'gstreamer1.0-tools',
+        'cmake': 'cmake',
+        'pkg-config': 'pkg-config',
+        'git': 'git',
+    }
+    FEATURES = {
+        'android': {'tools': ['adb'], 'packages': []},
+        'scrcpy': {'tools': ['scrcpy'], 'packages': []},
+        'ios': {
+            'tools': ['idevice_id', 'ideviceinfo', 'idevicescreenshot', 'idevicepair', 'idevicebackup2',
+                      'idevicesyslog', 'iproxy', 'ifuse', 'gst-launch-1.0'],
+            'packages': ['libimobiledevice6', 'usbmuxd', 'avahi-daemon', 'gstreamer1.0-plugins-base',
+                         'gstreamer1.0-plugins-good', 'gstreamer1.0-plugins-bad'],
+        },
+        'uxplay': {
+            'tools': ['cmake', 'pkg-config', 'git'],
+            'packages': ['libavahi-compat-libdnssd-dev', 'libplist-dev', 'libssl-dev',
+                         'libgstreamer1.0-dev', 'libgstreamer-plugins-base1.0-dev'],
+        },
+    }
+    # Features whose packages live in Ubuntu's universe component
+    UNIVERSE = {'ios'}
+    APT_STAMPS = ['/var/lib/apt/periodic/update-success-stamp', '/var/lib/apt/lists']
+    # Rough costs for the dry-run estimate
+    UPDATE_SECONDS = 20.0
+    PACKAGE_SECONDS = 3.0
+    DOWNLOAD_RATE = 5 * 1024 * 1024
+
+    def __init__(self, runner=None, probe=None, update_max_age=3600):
+        self.runner = runner or run_command
+        self.probe = probe
+        self.update_max_age = update_max_age
+
+    def _which(self, tool):
+        return (self.probe or tool_probe).which(tool)
+
+    def missing_tools(self, features):
+        missing = [tool for feature in features for tool in self.FEATURES[feature]['tools']
+                   if not self._which(tool)]
+        (self.probe or tool_probe).save()
+        return list(dict.fromkeys(missing))
+
+    def installed_packages(self, packages):
+        """Subset of packages dpkg reports as installed, one dpkg-query for all of them"""
+        if not packages:
+            return set()
+        result = self.runner(['dpkg-query', '-W', '-f', '${Package} ${db:Status-Status}\n'] + list(packages))
+        if not result or not result.stdout:
+            return set()
+        installed = set()
+        for line in result.stdout.splitlines():
+            name, _, status = line.partition(' ')
+            if status.strip() == 'installed':
+                installed.add(name.split(':')[0])
+        return installed
+
+    def lists_age(self):
+        """Seconds since the apt package lists were refreshed, None if unknown"""
+        ages = []
+        for path in self.APT_STAMPS:
+            try:
+                ages.append(time.time() - os.stat(path).st_mtime)
+            except OSError:
+                pass
+        return min(ages) if ages else None
+
+    def download_sizes(self, packages):
+        """Package -> download size in bytes from one apt-cache call, missing entries unknown"""
+        result = self.runner(['apt-cache', 'show', '--no-all-versions'] + list(packages))
+        sizes = {}
+        if result and result.stdout:
+            package = None
+            for line in result.stdout.splitlines():
+                if line.startswith('Package:'):
+                    package = line.split(':', 1)[1].strip()
+                elif line.startswith('Size:') and package and package not in sizes:
+                    sizes[package] = int(line.split(':', 1)[1].strip())
+        return sizes
+
+    def plan(self, features, packages=(), thorough=False, estimate=False):
+        """Work out what to install; nothing is run except read-only queries"""
+        missing_tools = self.missing_tools(features)
+        wanted = [self.TOOL_PACKAGES[tool] for tool in missing_tools] + list(packages)
+        extra = [package for feature in features for package in self.FEATURES[feature]['packages']]
+        if extra and (wanted or thorough):
+            installed = self.installed_packages(extra)
+            wanted += [package for package in extra if package not in installed]
+        wanted = list(dict.fromkeys(wanted))
+        
+        age = self.lists_age()
+        update = bool(wanted) and (age is None or age > self.update_max_age)
+        universe = bool(wanted) and bool(self.UNIVERSE & set(features)) and bool(self._which('add-apt-repository'))
+        commands = []
+        if universe:
+            # -n: the single update below refreshes the lists
+            commands.append(['sudo', 'add-apt-repository', '-y', '-n', 'universe'])
+        if update or universe:
+            commands.append(['sudo', 'apt-get', 'update', '-y'])
+        if wanted:
+            commands.append(['sudo', 'apt-get', 'install', '-y'] + wanted)
+        
+        plan = {'features': list(features), 'missing_tools': missing_tools, 'packages': wanted,
+                'update': update or universe, 'commands': commands, 'download_bytes': None,
+                'estimated_seconds': 0.0}
+        if estimate and wanted:
+            sizes = self.download_sizes(wanted)
+            plan['download_bytes'] = sum(sizes.values()) if sizes else None
+            plan['estimated_seconds'] = ((self.UPDATE_SECONDS if plan['update'] else 0.0)
+                                         + self.PACKAGE_SECONDS * len(wanted)
+                                         + (plan['download_bytes'] or 0) / self.DOWNLOAD_RATE)
+        return plan
+
+    def execute(self, plan):
+        """Run a plan's commands, returns True when the install step succeeded"""
+        for cmd in plan['commands']:
+            print(f"{Colors.OKCYAN}$ {' '.join(cmd)}{Colors.ENDC}")
+            result = self.runner(cmd)
+            if cmd[1:3] == ['apt-get', 'install']:
+                if not result or result.returncode != 0:
+                    return False
+            elif not result or result.returncode != 0:
+                print(f"{Colors.WARNING}⚠ {' '.join(cmd)} failed, continuing{Colors.ENDC}")
+        probe = self.probe or tool_probe
+        for tool in plan['missing_tools']:
+            probe.forget(tool)
+        probe.save()
+        return True
+
+    @staticmethod
+    def print_plan(plan):
+        if not plan['packages']:
+            print(f"{Colors.OKGREEN}✓ Nothing to install for {', '.join(plan['features'])}{Colors.ENDC}")
+            return
+        print(f"\n{Colors.OKBLUE}Install plan for {', '.join(plan['features'])}:{Colors.ENDC}")
+        if plan['missing_tools']:
+            print(f"  missing tools: {', '.join(plan['missing_tools'])}")
+        print(f"  packages: {', '.join(plan['packages'])}")
+        for cmd in plan['commands']:
+            print(f"  $ {' '.join(cmd)}")
+        if plan['estimated_seconds']:
+            size = format_bytes(plan['download_bytes']) if plan['download_bytes'] is not None else 'unknown size'
+            print(f"  estimated: ~{plan['estimated_seconds']:.0f}s, {size} to download (excluding dependencies)")
+
+    def ensure(self, features, packages=(), dry_run=False, thorough=False):
+        """Plan and install in one go; returns True if everything needed is (or would be) present"""
+        plan = self.plan(features, packages, thorough=thorough, estimate=dry_run)
+        if not plan['packages']:
+            if dry_run:
+                self.print_plan(plan)
+            return True
+        self.print_plan(plan)
+        if dry_run:
+            return True
+        return self.execute(plan)
+
+def kill_process_group(proc, grace=2.0):
+    """Terminate a child started with start_new_session=True and everything it spawned"""
+    for sig, wait in ((signal.SIGTERM, grace), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        if wait is None:
+            return
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            if proc.returncode is not None:
+                return
+            time.sleep(0.05)
+
+LINE_BREAK = re.compile(rb'\r\n|\r|\n')
+
+async def async_run_command(cmd, timeout=None, on_stdout=None, on_stderr=None, text=True):
+    """Asyncio counterpart of run_command
+
+    The child runs in its own process group, which is killed on timeout or
+    cancellation. on_stdout / on_stderr receive each output line as it arrives;
+    carriage returns also end a line so progress bars stream too.
+    Returns a CompletedProcess, or None on timeout or launch failure.
+    """
+    caller = command_tracer.caller() if command_tracer.enabled else None
+    start = time.time()
+    began = time.perf_counter()
+    result = None
+    try:
+        result = await _async_run_command(cmd, timeout, on_stdout, on_stderr, text)
+        return result
+    finally:
+        command_tracer.record(cmd, start, time.perf_counter() - began, result.returncode if result else None,
+                              result.stdout if result else None, result.stderr if result else None,
+                              caller, mode='async')
+
+async def _async_run_command(cmd, timeout, on_stdout, on_stderr, text):
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            start_new_session=True)
+    except OSError as e:
+        print(f"{Colors.FAIL}Unexpected error: {e}{Colors.ENDC}")
+        return None
+    
+    async def pump(stream, chunks, callback):
+        pending = b''
+        while True:
+            data = await stream.read(65536)
+            if not data:
+                break
+            chunks.append(data)
+            if callback:
+                pending += data
+                *lines, pending = LINE_BREAK.split(pending)
+                for line in lines:
+                    if line:
+                        callback(line.decode('utf-8', 'replace') if text else line)
+        if callback and pending:
+            callback(pending.decode('utf-8', 'replace') if text else pending)
+    
+    stdout, stderr = [], []
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(pump(proc.stdout, stdout, on_stdout),
+                           pump(proc.stderr, stderr, on_stderr),
+                           proc.wait()),
+            timeout)
+    except asyncio.TimeoutError:
+        await asyncio.get_running_loop().run_in_executor(None, kill_process_group, proc)
+        await proc.wait()
+        print(f"{Colors.FAIL}Command timed out after {timeout}s: {' '.join(cmd)}{Colors.ENDC}")
+        return None
+    except asyncio.CancelledError:
+        kill_process_group(proc, grace=0)
+        # Reap the child before giving up, it would otherwise outlive the event loop
+        await proc.wait()
+        raise
+    
+    out, err = b''.join(stdout), b''.join(stderr)
+    if text:
+        out, err = out.decode('utf-8', 'replace'), err.decode('utf-8', 'replace')
+    return subprocess.CompletedProcess(list(cmd), proc.returncode, out, err)
+
+class ADBError(Exception):
+    """Raised when the adb server rejects a request or the connection breaks"""
+
+class ADBStreamError(ADBError):
+    """Raised when the connection breaks after the device accepted a command
+
+    The command may already have run, so it must not be retried elsewhere.
+    """
+
+class ADBSyncFailed(ADBError):
+    """Raised when the device answers a sync request with FAIL
+
+    adbd closes the sync connection afterwards, so the session is unusable and
+    any other pipelined replies are lost.
+    """
+    def __init__(self, message, path):
+        super().__init__(message)
+        self.path = path
+
+class ADBSyncSession:
+    """A sync: service connection bound to one device, reusable across transfers"""
+    MAX_DATA = 64 * 1024
+    def __init__(self, sock, serial=None):
+        self.sock = sock
+        self.serial = serial
+        self.lock = threading.Lock()
+
+    def _request(self, command, path):
+        data = path.encode('utf-8')
+        self.sock.sendall(command + struct.pack('<I', len(data)) + data)
+
+    def stat(self, path):
+        """Return (mode, size, mtime) of a remote path; mode is 0 if it does not exist"""
+        self._request(b'STAT', path)
+        header = ADBClient.recv_exact(self.sock, 16)
+        if header[:4] != b'STAT':
+            raise ADBError(f"Unexpected sync reply: {header[:4]!r}")
+        return struct.unpack('<III', header[4:])
+
+    def pull(self, remote_path, local_path):
+        """Copy a remote file to local_path, returns the number of bytes written"""
+        self._request(b'RECV', remote_path)
+        return self._receive(remote_path, local_path)
+
+    def _receive(self, remote_path, local_path):
+        # Written next to the target and renamed on DONE, so a failed pull leaves no partial file
+        temp_path = local_path + '.part'
+        total = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    header = ADBClient.recv_exact(self.sock, 8)
+                    tag, length = header[:4], struct.unpack('<I', header[4:])[0]
+                    if tag == b'DATA':
+                        f.write(ADBClient.recv_exact(self.sock, length))
+                        total += length
+                    elif tag == b'DONE':
+                        break
+                    elif tag == b'FAIL':
+                        message = ADBClient.recv_exact(self.sock, length).decode('utf-8', 'replace').rstrip('\0')
+                        raise ADBSyncFailed(f"Pull of {remote_path} failed: {message}", remote_path)
+                    else:
+                        raise ADBError(f"Unexpected sync reply: {tag!r}")
+            os.replace(temp_path, local_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            raise
+        return total
+
+    def pull_many(self, transfers, window=32):
+        """Pull (remote, local) pairs with up to window RECV requests in flight
+
+        Yields (remote, local, bytes) as each file completes. A FAIL raises
+        ADBSyncFailed and ends the session; the caller opens a new one for
+        the transfers after it.
+        """
+        queue = collections.deque(transfers)
+        in_flight = collections.deque()
+        send_error = None
+        while queue or in_flight:
+            while queue and len(in_flight) < window and not send_error:
+                try:
+                    self._request(b'RECV', queue[0][0])
+                except OSError as e:
+                    # The device may have closed after a FAIL, read what was answered before that
+                    send_error = e
+                    break
+                in_flight.append(queue.popleft())
+            if not in_flight:
+                raise send_error
+            remote, local = in_flight.popleft()
+            yield remote, local, self._receive(remote, local)
+
+    def list(self, path):
+        """Return [(name, mode, size, mtime)] for a remote directory"""
+        self._request(b'LIST', path)
+        entries = []
+        while True:
+            header = ADBClient.recv_exact(self.sock, 20)
+            tag = header[:4]
+            mode, size, mtime, name_length = struct.unpack('<IIII', header[4:])
+            if tag == b'DONE':
+                return entries
+            if tag != b'DENT':
+                raise ADBError(f"Unexpected sync reply: {tag!r}")
+            name = ADBClient.recv_exact(self.sock, name_length).decode('utf-8', 'replace')
+            if name not in ('.', '..'):
+                entries.append((name, mode, size, mtime))
+
+    def _send_file(self, local_path, remote_path, mode, mtime):
+        self._request(b'SEND', f"{remote_path},{mode}")
+        total = 0
+        with open(local_path, 'rb') as f:
+            while True:
+                data = f.read(self.MAX_DATA)
+                if not data:
+                    break
+                self.sock.sendall(b'DATA' + struct.pack('<I', len(data)) + data)
+                total += len(data)
+        self.sock.sendall(b'DONE' + struct.pack('<I', int(mtime)))
+        return total
+
+    def _read_ack(self, remote_path):
+        header = ADBClient.recv_exact(self.sock, 8)
+        tag, length = header[:4], struct.unpack('<I', header[4:])[0]
+        if tag == b'OKAY':
+            return
+        if tag == b'FAIL':
+            message = ADBClient.recv_exact(self.sock, length).decode('utf-8', 'replace')
+            raise ADBError(f"Push of {remote_path} failed: {message}")
+        raise ADBError(f"Unexpected sync reply: {tag!r}")
+
+    def push(self, local_path, remote_path):
+        """Copy a local file to remote_path keeping its mode and mtime"""
+        st = os.stat(local_path)
+        total = self._send_file(local_path, remote_path, st.st_mode & 0o777 | 0o100000, st.st_mtime)
+        self._read_ack(remote_path)
+        return total
+
+    def push_many(self, transfers, window=32):
+        """Push (local, remote) pairs without waiting for each OKAY
+
+        Up to window acknowledgements may be outstanding. Yields
+        (local, remote, bytes) once a file is acknowledged.
+        """
+        in_flight = collections.deque()
+        for local, remote in transfers:
+            st = os.stat(local)
+            size = self._send_file(local, remote, st.st_mode & 0o777 | 0o100000, st.st_mtime)
+            in_flight.append((local, remote, size))
+            if len(in_flight) >= window:
+                done = in_flight.popleft()
+                self._read_ack(done[1])
+                yield done
+        while in_flight:
+            done = in_flight.popleft()
+            self._read_ack(done[1])
+            yield done
+
+    def close(self):
+        try:
+            self.sock.sendall(b'QUIT' + struct.pack('<I', 0))
+        except OSError:
+            pass
+        self.sock.close()
+
+class ADBClient:
+    """Talks the adb host protocol directly to the local adb server (TCP 5037)
+
+    Every request is a 4-digit hex length followed by the payload, answered by
+    OKAY or FAIL. host: requests and shell: commands consume their connection,
+    sync: sessions are kept open per serial and reused.
+    """
+    # Shell v2 packet ids: one byte id and a little-endian 32-bit length, then the data
+    SHELL_STDOUT, SHELL_STDERR, SHELL_EXIT = 1, 2, 3
+    # Printed after the command on devices without shell v2 to recover its exit status
+    EXIT_MARKER = '__BLUEPHONE_EXIT__'
+
+    def __init__(self, host='127.0.0.1', port=5037, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sync_sessions = {}
+        self.feature_cache = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def recv_exact(sock, size):
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = sock.recv(size - len(buf))
+            if not chunk:
+                raise ADBError("Connection closed by adb server")
+            buf.extend(chunk)
+        return bytes(buf)
+
+    @staticmethod
+    def recv_all(sock):
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def _connect(self):
+        try:
+            return socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise ADBError(f"adb server not reachable on {self.host}:{self.port}: {e}")
+
+    def _send(self, sock, request):
+        data = request.encode('utf-8')
+        sock.sendall(b'%04x' % len(data) + data)
+        status = self.recv_exact(sock, 4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise ADBError(self._read_string(sock))
+        raise ADBError(f"Unexpected reply from adb server: {status!r}")
+
+    def _read_string(self, sock):
+        length = int(self.recv_exact(sock, 4), 16)
+        return self.recv_exact(sock, length).decode('utf-8', 'replace')
+
+    def _transport(self, serial=None):
+        sock = self._connect()
+        try:
+            self._send(sock, f'host:transport:{serial}' if serial else 'host:transport-any')
+        except ADBError:
+            sock.close()
+            raise
+        except OSError as e:
+            sock.close()
+            raise ADBError(str(e))
+        return sock
+
+    def _host_query(self, request):
+        sock = self._connect()
+        try:
+            self._send(sock, request)
+            return self._read_string(sock)
+        except OSError as e:
+            raise ADBError(str(e))
+        finally:
+            sock.close()
+
+    def is_available(self):
+        """Check that an adb server is listening"""
+        try:
+            self._host_query('host:version')
+            return True
+        except ADBError:
+            return False
+
+    def devices(self):
+        """Return a list of (serial, state) tuples"""
+        devices = []
+        for line in self._host_query('host:devices').splitlines():
+            parts = line.split('\t')
+            if len(parts) >= 2:
+                devices.append((parts[0], parts[1]))
+        return devices
+
+    @staticmethod
+    def _quote(command):
+        if isinstance(command, (list, tuple)):
+            return ' '.join(shlex.quote(str(arg)) for arg in command)
+        return command
+
+    def _service(self, request, serial=None):
+        """Open a device service; the socket has no timeout since commands may stay silent"""
+        sock = self._transport(serial)
+        try:
+            self._send(sock, request)
+        except ADBError:
+            sock.close()
+            raise
+        except OSError as e:
+            sock.close()
+            raise ADBError(str(e))
+        sock.settimeout(None)
+        return sock
+
+    def features(self, serial=None):
+        """Feature names advertised by the device's adbd, cached per serial"""
+        with self.lock:
+            features = self.feature_cache.get(serial)
+        if features is None:
+            features = set(self._host_query(f'host-serial:{serial}:features' if serial else 'host:features').split(','))
+            with self.lock:
+                self.feature_cache[serial] = features
+        return features
+
+    def tcpip(self, port=5555, serial=None):
+        """Restart adbd on the device listening on a TCP port, like `adb tcpip`"""
+        sock = self._service(f'tcpip:{port}', serial)
+        try:
+            return self.recv_all(sock).decode('utf-8', 'replace')
+        except OSError as e:
+            raise ADBStreamError(str(e))
+        finally:
+            sock.close()
+
+    def shell(self, command, serial=None, service='shell'):
+        """Run a shell command on the device and return its raw output bytes"""
+        sock = self._service(f'{service}:{self._quote(command)}', serial)
+        try:
+            return self.recv_all(sock)
+        except OSError as e:
+            raise ADBStreamError(str(e))
+        finally:
+            sock.close()
+
+    @classmethod
+    def _legacy_command(cls, command):
+        return f"{command}\n__bp_status=$?; echo; echo {cls.EXIT_MARKER}$__bp_status"
+
+    @classmethod
+    def _split_exit(cls, output):
+        """Separate the echoed exit status from legacy shell output, None if it never came"""
+        head, marker, tail = output.rpartition(cls.EXIT_MARKER.encode())
+        if not marker or not tail.strip().isdigit():
+            return None, output
+        for newline in (b'\r\n', b'\n'):
+            if head.endswith(newline):
+                head = head[:-len(newline)]
+                break
+        return int(tail.strip()), head
+
+    def run(self, command, serial=None):
+        """Run a shell command and return (exit status, stdout, stderr)
+
+        Uses the shell v2 protocol when adbd supports it, which reports the exit
+        status and keeps stderr apart. Older devices get the status echoed after
+        the output instead, with stderr mixed into stdout.
+        """
+        command = self._quote(command)
+        if 'shell_v2' not in self.features(serial):
+            status, output = self._split_exit(self.shell(self._legacy_command(command), serial))
+            return status, output, b''
+        sock = self._service(f'shell,v2,raw:{command}', serial)
+        streams = {self.SHELL_STDOUT: [], self.SHELL_STDERR: []}
+        try:
+            while True:
+                kind, length = struct.unpack('<BI', self.recv_exact(sock, 5))
+                data = self.recv_exact(sock, length)
+                if kind == self.SHELL_EXIT:
+                    return data[0], b''.join(streams[self.SHELL_STDOUT]), b''.join(streams[self.SHELL_STDERR])
+                if kind in streams:
+                    streams[kind].append(data)
+        except (OSError, ADBError) as e:
+            raise ADBStreamError(str(e))
+        finally:
+            sock.close()
+
+    def exec_out(self, command, serial=None):
+        """Like shell() but over exec:, so binary output is not mangled by a pty"""
+        return self.shell(command, serial, service='exec')
+
+    def open_stream(self, command, serial=None, service='exec'):
+        """Start a command and return its connected socket for incremental reads"""
+        return self._service(f'{service}:{self._quote(command)}', serial)
+
+    async def _async_send(self, reader, writer, request):
+        data = request.encode('utf-8')
+        writer.write(b'%04x' % len(data) + data)
+        await writer.drain()
+        status = await reader.readexactly(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            length = int(await reader.readexactly(4), 16)
+            raise ADBError((await reader.readexactly(length)).decode('utf-8', 'replace'))
+        raise ADBError(f"Unexpected reply from adb server: {status!r}")
+
+    async def async_host_query(self, request):
+        """Asyncio version of a host: request that answers with one string"""
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            raise ADBError(f"adb server not reachable on {self.host}:{self.port}: {e}")
+        try:
+            await self._async_send(reader, writer, request)
+            length = int(await reader.readexactly(4), 16)
+            return (await reader.readexactly(length)).decode('utf-8', 'replace')
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            raise ADBError(str(e))
+        finally:
+            writer.close()
+
+    async def async_open_stream(self, command, serial=None, service='shell'):
+        """Asyncio version of open_stream(), returns (reader, writer) for a long running command"""
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            raise ADBError(f"adb server not reachable on {self.host}:{self.port}: {e}")
+        try:
+            await self._async_send(reader, writer, f'host:transport:{serial}' if serial else 'host:transport-any')
+            await self._async_send(reader, writer, f'{service}:{self._quote(command)}')
+        except (OSError, asyncio.IncompleteReadError) as e:
+            writer.close()
+            raise ADBError(str(e))
+        except ADBError:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def async_shell(self, command, serial=None, service='shell'):
+        """Asyncio version of shell(), many of these can share one event loop"""
+        reader, writer = await self.async_open_stream(command, serial, service)
+        try:
+            return await reader.read()
+        except OSError as e:
+            raise ADBStreamError(str(e))
+        finally:
+            writer.close()
+
+    async def async_features(self, serial=None):
+        """Asyncio version of features()"""
+        with self.lock:
+            features = self.feature_cache.get(serial)
+        if features is None:
+            reply = await self.async_host_query(f'host-serial:{serial}:features' if serial else 'host:features')
+            features = set(reply.split(','))
+            with self.lock:
+                self.feature_cache[serial] = features
+        return features
+
+    async def async_run(self, command, serial=None):
+        """Asyncio version of run()"""
+        command = self._quote(command)
+        if 'shell_v2' not in await self.async_features(serial):
+            status, output = self._split_exit(await self.async_shell(self._legacy_command(command), serial))
+            return status, output, b''
+        reader, writer = await self.async_open_stream(command, serial, 'shell,v2,raw')
+        streams = {self.SHELL_STDOUT: [], self.SHELL_STDERR: []}
+        try:
+            while True:
+                kind, length = struct.unpack('<BI', await reader.readexactly(5))
+                data = await reader.readexactly(length)
+                if kind == self.SHELL_EXIT:
+                    return data[0], b''.join(streams[self.SHELL_STDOUT]), b''.join(streams[self.SHELL_STDERR])
+                if kind in streams:
+                    streams[kind].append(data)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise ADBStreamError(str(e))
+        finally:
+            writer.close()
+
+    def sync(self, serial=None):
+        """Return the cached sync session for a device, opening one if needed"""
+        with self.lock:
+            return self._sync(serial)
+
+    def _sync(self, serial):
+        session = self.sync_sessions.get(serial)
+        if session is None:
+            sock = self._transport(serial)
+            try:
+                self._send(sock, 'sync:')
+            except ADBError:
+                sock.close()
+                raise
+            except OSError as e:
+                sock.close()
+                raise ADBError(str(e))
+            session = ADBSyncSession(sock, serial)
+            self.sync_sessions[serial] = session
+        return session
+
+    def pull(self, remote_path, local_path, serial=None):
+        """Pull a file over the cached sync session, reconnecting once if it went stale"""
+        try:
+            session = self.sync(serial)
+            with session.lock:
+                return session.pull(remote_path, local_path)
+        except ADBSyncFailed:
+            # The device refused the file, retrying will not help
+            self.close_sync(serial)
+            raise
+        except (ADBError, OSError):
+            self.close_sync(serial)
+            session = self.sync(serial)
+            with session.lock:
+                return session.pull(remote_path, local_path)
+
+    def close_sync(self, serial=None):
+        with self.lock:
+            session = self.sync_sessions.pop(serial, None)
+        if session:
+            session.close()
+
+    def close(self):
+        for serial in list(self.sync_sessions):
+            self.close_sync(serial)
+
+class UsbmuxError(Exception):
+    """Raised when usbmuxd refuses a request or the socket breaks"""
+
+class UsbmuxClient:
+    """Speaks the usbmuxd plist protocol over its Unix socket
+
+    Each message is a 16-byte little-endian header (length, version 1,
+    type 8 = plist, tag) followed by an XML plist.
+    """
+    PLIST_MESSAGE = 8
+
+    def __init__(self, path='/var/run/usbmuxd', timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.tag = 0
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise UsbmuxError(f"usbmuxd not reachable at {self.path}: {e}")
+        return sock
+
+    def send(self, sock, message):
+        self.tag += 1
+        message = dict(message, ClientVersionString='bluephone', ProgName='bluephone')
+        payload = plistlib.dumps(message)
+        sock.sendall(struct.pack('<IIII', 16 + len(payload), 1, self.PLIST_MESSAGE, self.tag) + payload)
+        return self.tag
+
+    def recv(self, sock):
+        try:
+            length, _, _, _ = struct.unpack('<IIII', ADBClient.recv_exact(sock, 16))
+            return plistlib.loads(ADBClient.recv_exact(sock, length - 16))
+        except ADBError as e:
+            raise UsbmuxError(str(e))
+        except (ValueError, plistlib.InvalidFileException) as e:
+            raise UsbmuxError(f"Malformed usbmuxd message: {e}")
+
+    def request(self, sock, message):
+        """Send a message and return the reply, raising on a non-zero Result"""
+        self.send(sock, message)
+        reply = self.recv(sock)
+        if reply.get('MessageType') == 'Result' and reply.get('Number', 0) != 0:
+            raise UsbmuxError(f"{message['MessageType']} failed with usbmuxd error {reply['Number']}")
+        return reply
+
+    def devices(self):
+        """Return the attached devices as (udid, device id, connection type) tuples"""
+        sock = self.connect()
+        try:
+            reply = self.request(sock, {'MessageType': 'ListDevices'})
+        finally:
+            sock.close()
+        devices = []
+        for entry in reply.get('DeviceList', []):
+            properties = entry.get('Properties', {})
+            devices.append((properties.get('SerialNumber'), entry.get('DeviceID', properties.get('DeviceID')),
+                            properties.get('ConnectionType')))
+        return devices
+
+    def udids(self):
+        """UDIDs of the USB attached devices, like `idevice_id -l`"""
+        return list(dict.fromkeys(udid for udid, _, kind in self.devices() if udid and kind == 'USB'))
+
+    def connect_device(self, udid, port):
+        """Return a socket tunnelled to a TCP port on the device, preferring USB over WiFi"""
+        candidates = sorted((kind != 'USB', device_id) for serial, device_id, kind in self.devices() if serial == udid)
+        if not candidates:
+            raise UsbmuxError(f"Device {udid} is not attached")
+        sock = self.connect()
+        try:
+            # usbmuxd wants the port in network byte order
+            self.request(sock, {'MessageType': 'Connect', 'DeviceID': candidates[0][1],
+                                'PortNumber': socket.htons(port)})
+        except UsbmuxError:
+            sock.close()
+            raise
+        return sock
+
+    def read_pair_record(self, udid):
+        """Return the host's pair record for a device as a dict, or None if it has none"""
+        sock = self.connect()
+        try:
+            reply = self.request(sock, {'MessageType': 'ReadPairRecord', 'PairRecordID': udid})
+        finally:
+            sock.close()
+        data = reply.get('PairRecordData')
+        return plistlib.loads(data) if data else None
+
+class LockdownError(Exception):
+    """Raised when lockdownd refuses a request or the session breaks"""
+
+class LockdownClient:
+    """A lockdownd session with one device, tunnelled through usbmuxd
+
+    Messages are XML plists behind a 32-bit big-endian length. The session
+    is started with the host's pair record, read from usbmuxd or else from
+    /var/lib/lockdown, and wrapped in TLS with the record's host certificate
+    when the device asks for it. The connection stays open between requests
+    and is reopened once if it broke.
+    """
+    PORT = 62078
+    PAIR_RECORDS = '/var/lib/lockdown'
+
+    def __init__(self, udid, usbmux=None, label='bluephone'):
+        self.udid = udid
+        self.usbmux = usbmux or UsbmuxClient()
+        self.label = label
+        self.sock = None
+        self.session_id = None
+        self.lock = threading.Lock()
+
+    def pair_record(self):
+        try:
+            record = self.usbmux.read_pair_record(self.udid)
+            if record:
+                return record
+        except UsbmuxError:
+            pass
+        try:
+            with open(os.path.join(self.PAIR_RECORDS, f'{self.udid}.plist'), 'rb') as f:
+                return plistlib.load(f)
+        except (OSError, ValueError, plistlib.InvalidFileException):
+            return None
+
+    def _send(self, message):
+        payload = plistlib.dumps(dict(message, Label=self.label))
+        self.sock.sendall(struct.pack('>I', len(payload)) + payload)
+
+    def _recv(self):
+        try:
+            length = struct.unpack('>I', ADBClient.recv_exact(self.sock, 4))[0]
+            return plistlib.loads(ADBClient.recv_exact(self.sock, length))
+        except ADBError:
+            raise ConnectionError(f"lockdownd on {self.udid} closed the connection")
+        except (ValueError, plistlib.InvalidFileException) as e:
+            raise LockdownError(f"Malformed lockdownd message: {e}")
+
+    def _request(self, message):
+        self._send(message)
+        reply = self._recv()
+        if 'Error' in reply:
+            raise LockdownError(f"{message['Request']} failed: {reply['Error']}")
+        return reply
+
+    def _tls(self, record):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        # Pair record certificates are self-signed and older devices only speak old TLS
+        context.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+        context.set_ciphers('DEFAULT:@SECLEVEL=0')
+        with tempfile.TemporaryDirectory() as tmp:
+            pem = os.path.join(tmp, 'host.pem')
+            with open(pem, 'wb') as f:
+                f.write(record['HostCertificate'] + b'\n' + record['HostPrivateKey'])
+            context.load_cert_chain(pem)
+        return context.wrap_socket(self.sock)
+
+    def open(self):
+        """Connect to lockdownd and start an authenticated session"""
+        record = self.pair_record()
+        if not record:
+            raise LockdownError(f"No pair record for {self.udid}, pair the device first")
+        try:
+            self.sock = self.usbmux.connect_device(self.udid, self.PORT)
+        except UsbmuxError as e:
+            raise LockdownError(str(e))
+        try:
+            if self._request({'Request': 'QueryType'}).get('Type') != 'com.apple.mobile.lockdown':
+                raise LockdownError(f"Port {self.PORT} on {self.udid} is not lockdownd")
+            reply = self._request({'Request': 'StartSession', 'HostID': record['HostID'],
+                                   'SystemBUID': record['SystemBUID']})
+            self.session_id = reply.get('SessionID')
+            if reply.get('EnableSessionSSL'):
+                self.sock = self._tls(record)
+        except (OSError, KeyError) as e:
+            self.close()
+            raise LockdownError(f"Could not start a lockdown session with {self.udid}: {e}")
+        except LockdownError:
+            self.close()
+            raise
+
+    def call(self, message):
+        """Send a request over the open session, starting a new one once if it went stale"""
+        with self.lock:
+            if self.sock is not None:
+                try:
+                    return self._request(message)
+                except OSError:
+                    self.close()
+            self.open()
+            try:
+                return self._request(message)
+            except OSError as e:
+                self.close()
+                raise LockdownError(f"lockdownd on {self.udid}: {e}")
+
+    def get_value(self, key=None, domain=None):
+        """Read one value, or the whole domain as a dict when key is None"""
+        message = {'Request': 'GetValue'}
+        if key:
+            message['Key'] = key
+        if domain:
+            message['Domain'] = domain
+        return self.call(message).get('Value')
+
+    def validate(self):
+        """True if the pair record is accepted, like `idevicepair validate`"""
+        try:
+            self.call({'Request': 'QueryType'})
+            return self.session_id is not None
+        except LockdownError:
+            return False
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            if self.session_id:
+                self._send({'Request': 'StopSession', 'SessionID': self.session_id})
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.sock = None
+        self.session_id = None
+
+class DeviceRegistry:
+    """Live table of attached Android and iOS devices fed by hotplug events
+
+    Android changes come from host:track-devices on the adb server, iOS
+    changes from the usbmuxd Listen protocol. Each runs on a background
+    thread that reconnects if its socket goes away; while its daemon cannot
+    be reached a platform counts as synced with no devices. iOS devices are
+    'attached' while connected over USB and 'network' when only reachable
+    over WiFi. Callbacks registered with subscribe() receive
+    (event, platform, device_id, record) where event is 'attached',
+    'detached' or 'changed'.
+    """
+    def __init__(self, adb_client=None, usbmux=None, reconnect_delay=2.0):
+        self.adb_client = adb_client or ADBClient()
+        self.usbmux = usbmux or UsbmuxClient()
+        self.reconnect_delay = reconnect_delay
+        self.table = {}
+        self.synced = {'android': threading.Event(), 'ios': threading.Event()}
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.sockets = {}
+        self.threads = []
+        self.running = False
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def start(self, platforms=('android', 'ios'), sync_timeout=1.0):
+        """Start watching, waiting up to sync_timeout for the initial device lists"""
+        self.running = True
+        loops = {'android': self._android_loop, 'ios': self._ios_loop}
+        for platform in platforms:
+            thread = threading.Thread(target=loops[platform], name=f"registry-{platform}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        deadline = time.monotonic() + sync_timeout
+        for platform in platforms:
+            self.synced[platform].wait(max(deadline - time.monotonic(), 0))
+        return self
+
+    def stop(self):
+        self.running = False
+        for sock in list(self.sockets.values()):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
+
+    def is_synced(self, platform):
+        return self.synced[platform].is_set()
+
+    def devices(self, platform=None, state=None):
+        """Return device records, optionally filtered by platform and state"""
+        with self.lock:
+            return [dict(record) for record in self.table.values()
+                    if (platform is None or record['platform'] == platform)
+                    and (state is None or record['state'] == state)]
+
+    def ids(self, platform, state=None):
+        return [record['id'] for record in self.devices(platform, state)]
+
+    def get(self, device_id):
+        with self.lock:
+            record = self.table.get(device_id)
+            return dict(record) if record else None
+
+    def _emit(self, event, record):
+        for callback in list(self.callbacks):
+            try:
+                callback(event, record['platform'], record['id'], dict(record))
+            except Exception as e:
+                print(f"{Colors.WARNING}⚠ Registry callback failed: {e}{Colors.ENDC}")
+
+    def _update(self, platform, device_id, state, properties=None):
+        with self.lock:
+            record = self.table.get(device_id)
+            if record is None:
+                record = {'platform': platform, 'id': device_id, 'state': state,
+                          'since': time.time(), 'properties': properties or {}}
+                self.table[device_id] = record
+                event = 'attached'
+            elif properties is not None and record['properties'] != properties:
+                record['properties'] = properties
+                event = 'changed'
+                if record['state'] != state:
+                    record['state'] = state
+                    record['since'] = time.time()
+            elif record['state'] != state:
+                record['state'] = state
+                record['since'] = time.time()
+                event = 'changed'
+            else:
+                return
+            record = dict(record)
+        self._emit(event, record)
+
+    def _remove(self, device_id):
+        with self.lock:
+            record = self.table.pop(device_id, None)
+        if record:
+            self._emit('detached', record)
+
+    def _replace_platform(self, platform, current):
+        """Apply a full device list for a platform, emitting the differences"""
+        for device_id in [r['id'] for r in self.devices(platform) if r['id'] not in current]:
+            self._remove(device_id)
+        for device_id, state in current.items():
+            self._update(platform, device_id, state)
+
+    def _watch(self, platform, connect, read_events):
+        while self.running:
+            try:
+                sock = connect()
+            except (ADBError, UsbmuxError, OSError):
+                # No daemon means no devices; saying so lets start() return right away
+                self._replace_platform(platform, {})
+                self.synced[platform].set()
+                if self.running:
+                    time.sleep(self.reconnect_delay)
+                continue
+            try:
+                self.sockets[platform] = sock
+                read_events(sock)
+            except (ADBError, UsbmuxError, OSError):
+                pass
+            finally:
+                sock = self.sockets.pop(platform, None)
+                if sock:
+                    sock.close()
+            # The device list is stale until the watcher reconnects
+            self.synced[platform].clear()
+            if self.running:
+                self._replace_platform(platform, {})
+                time.sleep(self.reconnect_delay)
+
+    def _android_loop(self):
+        def connect():
+            sock = self.adb_client._connect()
+            sock.settimeout(None)
+            self.adb_client._send(sock, 'host:track-devices')
+            return sock
+        
+        def read_events(sock):
+            while self.running:
+                current = {}
+                for line in self.adb_client._read_string(sock).splitlines():
+                    parts = line.split('\t')
+                    if len(parts) >= 2:
+                        current[parts[0]] = parts[1]
+                self._replace_platform('android', current)
+                self.synced['android'].set()
+        
+        self._watch('android', connect, read_events)
+
+    def _ios_loop(self):
+        # usbmuxd gives a device one DeviceID per connection (USB and Network)
+        device_udids = {}
+        connections = {}
+        
+        def connect():
+            sock = self.usbmux.connect()
+            self.usbmux.request(sock, {'MessageType': 'Listen'})
+            device_udids.clear()
+            connections.clear()
+            return sock
+        
+        def refresh(udid):
+            props = sorted(connections[udid].values(), key=lambda p: p.get('ConnectionType') != 'USB')[0]
+            state = 'attached' if props.get('ConnectionType') == 'USB' else 'network'
+            self._update('ios', udid, state, props)
+        
+        def handle(message):
+            kind = message.get('MessageType')
+            if kind == 'Attached':
+                props = message.get('Properties', {})
+                udid = props.get('SerialNumber')
+                if udid:
+                    device_udids[message.get('DeviceID')] = udid
+                    connections.setdefault(udid, {})[message.get('DeviceID')] = props
+                    refresh(udid)
+            elif kind == 'Detached':
+                udid = device_udids.pop(message.get('DeviceID'), None)
+                if udid:
+                    connections[udid].pop(message.get('DeviceID'), None)
+                    if connections[udid]:
+                        refresh(udid)
+                    else:
+                        del connections[udid]
+                        self._remove(udid)
+        
+        def read_events(sock):
+            # usbmuxd replays every attached device right after Listen; drain that burst first
+            sock.settimeout(0.2)
+            try:
+                while True:
+                    handle(self.usbmux.recv(sock))
+            except socket.timeout:
+                pass
+            self.synced['ios'].set()
+            sock.settimeout(None)
+            while self.running:
+                handle(self.usbmux.recv(sock))
+        
+        self._watch('ios', connect, read_events)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def encode_png(width, height, rgba, compress_level=6):
+    """Encode an RGBA8888 buffer as PNG using only zlib"""
+    stride = width * 4
+    # Every scanline gets filter type 0 (None)
+    raw = bytearray()
+    for row in range(height):
+        raw.append(0)
+        raw.extend(rgba[row * stride:(row + 1) * stride])
+    
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+    
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (PNG_SIGNATURE + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(bytes(raw), compress_level)) + chunk(b'IEND', b''))
+
+class ScreenFrame:
+    """A raw frame as produced by `screencap` without -p, with its pixels converted to RGBA"""
+    RGBA_8888 = 1
+    RGBX_8888 = 2
+    BGRA_8888 = 5
+
+    def __init__(self, width, height, pixel_format, pixels):
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.pixels = pixels
+
+    @classmethod
+    def from_screencap(cls, data):
+        """Parse screencap output: width, height, format, then colorspace on Android 9+"""
+        if len(data) < 12:
+            return None
+        width, height, pixel_format = struct.unpack('<III', data[:12])
+        # The header is 12 bytes on older releases and 16 once colorspace was added
+        header_size = len(data) - width * height * 4
+        if header_size not in (12, 16):
+            return None
+        pixels = cls.to_rgba(pixel_format, data[header_size:])
+        if pixels is None:
+            return None
+        return cls(width, height, cls.RGBA_8888, pixels)
+
+    @classmethod
+    def to_rgba(cls, pixel_format, pixels):
+        """Convert 4-byte pixels to RGBA8888, None for formats that cannot be converted"""
+        if pixel_format == cls.RGBA_8888:
+            return pixels
+        converted = bytearray(pixels)
+        if pixel_format == cls.RGBX_8888:
+            # The fourth byte is padding, not alpha
+            converted[3::4] = b'\xff' * (len(converted) // 4)
+        elif pixel_format == cls.BGRA_8888:
+            converted[0::4], converted[2::4] = pixels[2::4], pixels[0::4]
+        else:
+            return None
+        return bytes(converted)
+
+    def to_png(self, compress_level=6):
+        """PNG bytes of the frame, or None if its pixel format is not supported"""
+        pixels = self.to_rgba(self.pixel_format, self.pixels)
+        if pixels is None:
+            return None
+        return encode_png(self.width, self.height, pixels, compress_level)
+
+class FrameChange:
+    """Outcome of comparing a frame with the last kept one
+
+    rects are (x, y, width, height) pixel rectangles covering the dirty tiles;
+    distance is the Hamming distance between the frames' difference hashes.
+    """
+    def __init__(self, changed, ratio, rects, phash, distance=None, duration=0.0):
+        self.changed = changed
+        self.ratio = ratio
+        self.rects = rects
+        self.phash = phash
+        self.distance = distance
+        self.duration = duration
+
+class FrameDiff:
+    """Change detection between consecutive raw RGBA frames
+
+    The frame is split into bands of tile rows; bands whose bytes are equal
+    are skipped with a memcmp, the rest are compared pixel by pixel with
+    NumPy when it is installed. Without NumPy a tile's score is the fraction
+    of its pixel rows that changed rather than of its pixels, an upper bound.
+    A tile is dirty above tile_threshold, and a frame counts as changed (and
+    becomes the new reference) when the changed fraction of the whole frame
+    exceeds frame_threshold. Dirty tiles are merged into rectangles.
+    """
+    def __init__(self, tile=64, tile_threshold=0.0, frame_threshold=0.0):
+        self.tile = tile
+        self.tile_threshold = tile_threshold
+        self.frame_threshold = frame_threshold
+        self.reference = None
+        self.reference_hash = None
+        self.kept = 0
+        self.skipped = 0
+
+    @staticmethod
+    def dhash(width, height, pixels, samples=4):
+        """64-bit difference hash over a 9x8 grid of sampled luma averages"""
+        cells = []
+        for by in range(8):
+            ys = [((by * samples + sy) * 2 + 1) * height // (16 * samples) for sy in range(samples)]
+            for bx in range(9):
+                total = 0
+                for y in ys:
+                    row = y * width
+                    for sx in range(samples):
+                        i = (row + ((bx * samples + sx) * 2 + 1) * width // (18 * samples)) * 4
+                        total += pixels[i] * 77 + pixels[i + 1] * 150 + pixels[i + 2] * 29
+                cells.append(total)
+        bits = 0
+        for by in range(8):
+            for bx in range(8):
+                bits = bits << 1 | (cells[by * 9 + bx] > cells[by * 9 + bx + 1])
+        return bits
+
+    def _band_scores(self, width, height, current, previous):
+        """Per-tile changed fraction as a list of rows, plus the changed fraction of the frame"""
+        tile = self.tile
+        cols = -(-width // tile)
+        row_bytes = width * 4
+        scores = []
+        changed_pixels = 0
+        for top in range(0, height, tile):
+            bottom = min(top + tile, height)
+            start, end = top * row_bytes, bottom * row_bytes
+            if current[start:end] == previous[start:end]:
+                scores.append([0.0] * cols)
+                continue
+            rows = bottom - top
+            if np is not None:
+                changed = (np.frombuffer(current, np.uint32, rows * width, start).reshape(rows, width)
+                           != np.frombuffer(previous, np.uint32, rows * width, start).reshape(rows, width))
+                counts = np.add.reduceat(np.count_nonzero(changed, axis=0), np.arange(0, width, tile))
+                changed_pixels += int(counts.sum())
+                scores.append([int(count) / (rows * min(tile, width - c * tile)) for c, count in enumerate(counts)])
+            else:
+                counts = [0] * cols
+                for offset in range(start, end, row_bytes):
+                    if current[offset:offset + row_bytes] == previous[offset:offset + row_bytes]:
+                        continue
+                    for c in range(cols):
+                        a = offset + c * tile * 4
+                        b = min(a + tile * 4, offset + row_bytes)
+                        if current[a:b] != previous[a:b]:
+                            counts[c] += 1
+                            changed_pixels += (b - a) // 4
+                scores.append([count / rows for count in counts])
+        return scores, changed_pixels / (width * height)
+
+    def _rects(self, mask, width, height):
+        """Merge dirty tiles into rectangles: runs within a row, extended down while the run repeats"""
+        tile = self.tile
+        rects = []
+        open_runs = {}
+        for r, row in enumerate(mask):
+            runs = []
+            c = 0
+            while c < len(row):
+                if row[c]:
+                    begin = c
+                    while c < len(row) and row[c]:
+                        c += 1
+                    runs.append((begin, c))
+                else:
+                    c += 1
+            still_open = {}
+            for run in runs:
+                rect = open_runs.get(run)
+                if rect:
+                    rect[3] = r + 1
+                else:
+                    rect = [run[0], r, run[1], r + 1]
+                    rects.append(rect)
+                still_open[run] = rect
+            open_runs = still_open
+        return [(x0 * tile, y0 * tile, min(x1 * tile, width) - x0 * tile, min(y1 * tile, height) - y0 * tile)
+                for x0, y0, x1, y1 in rects]
+
+    def compare(self, frame):
+        """Compare a ScreenFrame with the reference, which it replaces when it changed enough"""
+        start = time.perf_counter()
+        width, height, pixels = frame.width, frame.height, frame.pixels
+        phash = self.dhash(width, height, pixels)
+        reference = self.reference
+        if reference is None or reference[:2] != (width, height):
+            change = FrameChange(True, 1.0, [(0, 0, width, height)], phash)
+        elif pixels == reference[2]:
+            change = FrameChange(False, 0.0, [], phash)
+        else:
+            scores, ratio = self._band_scores(width, height, pixels, reference[2])
+            mask = [[score > self.tile_threshold for score in row] for row in scores]
+            change = FrameChange(ratio > self.frame_threshold, ratio, self._rects(mask, width, height), phash)
+        
+        if self.reference_hash is not None:
+            change.distance = bin(phash ^ self.reference_hash).count('1')
+        if change.changed:
+            self.reference = (width, height, pixels)
+            self.reference_hash = phash
+            self.kept += 1
+        else:
+            self.skipped += 1
+        change.duration = time.perf_counter() - start
+        return change
+
+    @classmethod
+    def benchmark(cls, width=1080, height=2400, iterations=20, tile=64):
+        """Time compare() on synthetic frames: identical, a small status-bar change, half and full redraws"""
+        base = bytes(bytearray(os.urandom(width * height * 4)))
+        
+        def modified(top, rows):
+            data = bytearray(base)
+            for y in range(top, min(top + rows, height)):
+                offset = (y * width) * 4
+                data[offset:offset + width * 4] = os.urandom(width * 4)
+            return bytes(data)
+        
+        small = bytearray(base)
+        for y in range(20, 60):
+            offset = (y * width + width - 200) * 4
+            small[offset:offset + 120 * 4] = bytes(120 * 4)
+        cases = [
+            ('identical', bytes(bytearray(base))),
+            ('status bar', bytes(small)),
+            ('half frame', modified(height // 2, height // 2)),
+            ('full frame', os.urandom(width * height * 4)),
+        ]
+        results = {}
+        for name, pixels in cases:
+            samples = []
+            for _ in range(iterations):
+                diff = cls(tile)
+                diff.reference = (width, height, base)
+                change = diff.compare(ScreenFrame(width, height, ScreenFrame.RGBA_8888, pixels))
+                samples.append(change.duration)
+            samples.sort()
+            results[name] = {'p50': samples[len(samples) // 2], 'max': samples[-1],
+                             'changed': change.changed, 'ratio': change.ratio, 'rects': change.rects}
+        return results
+
+    @staticmethod
+    def print_benchmark(results, width=1080, height=2400):
+        backend = 'NumPy' if np is not None else 'pure Python (install numpy for the vectorised path)'
+        print(f"\n{Colors.OKBLUE}Frame diff on {width}x{height} RGBA frames, {backend}:{Colors.ENDC}")
+        for name, stats in results.items():
+            print(f"  {name:12} p50 {stats['p50'] * 1000:7.2f} ms  max {stats['max'] * 1000:7.2f} ms  "
+                  f"changed {stats['ratio'] * 100:5.1f}%  {len(stats['rects'])} rects")
+
+class CommandStream:
+    """Uniform read()/close() over an adb server socket or an adb subprocess
+
+    A subprocess is given to the command tracer when closed, with the
+    number of bytes read from it.
+    """
+    def __init__(self, sock=None, proc=None, caller=None):
+        self.sock = sock
+        self.proc = proc
+        self.caller = caller
+        self.start = time.time()
+        self.began = time.perf_counter()
+        self.received = 0
+        self.traced = False
+
+    def read(self, size=65536):
+        try:
+            if self.sock:
+                return self.sock.recv(size)
+            data = self.proc.stdout.read1(size)
+            self.received += len(data)
+            return data
+        except (OSError, ValueError):
+            return b''
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        elif self.proc:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.stdout.close()
+            self.proc.wait()
+            # A recorder's stop() and its reader thread may both close the stream
+            if not self.traced:
+                self.traced = True
+                command_tracer.record(self.proc.args, self.start, time.perf_counter() - self.began,
+                                      self.proc.returncode, self.received, None, self.caller, mode='stream')
+
+class H264RingBuffer:
+    """Preallocated ring of H.264 NAL units covering the most recent video
+
+    NAL units are written back to back into a fixed bytearray; an index of
+    (offset, length, timestamp, type) tracks what is still in the ring. The
+    latest SPS/PPS are kept aside so a dump can always be decoded.
+    """
+    SLICE, IDR, SPS, PPS = 1, 5, 7, 8
+    START_CODE = b'\x00\x00\x00\x01'
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.index = collections.deque()
+        self.written = 0
+        self.lock = threading.Lock()
+        self.sps = None
+        self.pps = None
+        self.frames = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.seen_keyframe = False
+
+    def append(self, nal, timestamp=None):
+        nal_type = nal[0] & 0x1f if nal else 0
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if nal_type == self.SPS:
+            self.sps = bytes(nal)
+        elif nal_type == self.PPS:
+            self.pps = bytes(nal)
+        if nal_type in (self.SLICE, self.IDR):
+            self.frames += 1
+            if nal_type == self.IDR:
+                self.seen_keyframe = True
+            elif not self.seen_keyframe:
+                # Nothing before the first keyframe can be decoded
+                self.dropped += 1
+                return False
+        
+        data = self.START_CODE + bytes(nal)
+        if len(data) > self.capacity // 4:
+            self.dropped += 1
+            return False
+        with self.lock:
+            while self.index and self.index[0][0] < self.written + len(data) - self.capacity:
+                if self.index.popleft()[3] in (self.SLICE, self.IDR):
+                    self.evicted += 1
+            pos = self.written % self.capacity
+            first = min(len(data), self.capacity - pos)
+            self.buffer[pos:pos + first] = data[:first]
+            if first < len(data):
+                self.buffer[:len(data) - first] = data[first:]
+            self.index.append((self.written, len(data), timestamp, nal_type))
+            self.written += len(data)
+        return True
+
+    def buffered_seconds(self):
+        """Time span between the oldest and newest NAL unit still in the ring"""
+        with self.lock:
+            if len(self.index) < 2:
+                return 0.0
+            return self.index[-1][2] - self.index[0][2]
+
+    def _read(self, offset, length):
+        pos = offset % self.capacity
+        first = min(length, self.capacity - pos)
+        return bytes(self.buffer[pos:pos + first]) + bytes(self.buffer[:length - first])
+
+    def last_seconds(self, seconds, now=None):
+        """Annex-B stream of roughly the last seconds, starting at a keyframe"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            entries = list(self.index)
+            cutoff = now - seconds
+            start = next((i for i, e in enumerate(entries) if e[2] >= cutoff), len(entries))
+            # Back up to the preceding keyframe so the clip decodes from its first frame
+            key = next((i for i in range(min(start, len(entries) - 1), -1, -1)
+                        if entries[i][3] == self.IDR), None)
+            if key is None:
+                key = next((i for i in range(start, len(entries)) if entries[i][3] == self.IDR), None)
+            if key is None or not self.sps or not self.pps:
+                return b'', 0, 0.0
+            selected = entries[key:]
+            chunks = [self.START_CODE + self.sps, self.START_CODE + self.pps]
+            chunks.extend(self._read(offset, length) for offset, length, _, kind in selected
+                          if kind not in (self.SPS, self.PPS))
+        frames = sum(1 for e in selected if e[3] in (self.SLICE, self.IDR))
+        return b''.join(chunks), frames, now - selected[0][2]
+
+class DeviceRecorder:
+    """Feeds one device's screenrecord H.264 stream into an H264RingBuffer"""
+    def __init__(self, android, serial, memory_cap, bit_rate=4000000, size=None):
+        self.android = android
+        self.serial = serial
+        self.ring = H264RingBuffer(memory_cap)
+        self.bit_rate = bit_rate
+        self.size = size
+        self.stream = None
+        self.running = False
+        self.thread = None
+        self.bytes_in = 0
+        self.samples = collections.deque()
+        self.restarts = 0
+
+    def command(self):
+        cmd = ['screenrecord', '--output-format=h264', f'--bit-rate={self.bit_rate}']
+        if self.size:
+            cmd.append(f'--size={self.size}')
+        return cmd + ['-']
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"recorder-{self.serial}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.stream:
+            self.stream.close()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        while self.running:
+            self.stream = self.android.open_stream(self.command(), self.serial)
+            if not self.stream:
+                time.sleep(1)
+                continue
+            pending = b''
+            while self.running:
+                data = self.stream.read(65536)
+                if not data:
+                    break
+                now = time.monotonic()
+                self.bytes_in += len(data)
+                self.samples.append((now, self.bytes_in))
+                while self.samples and now - self.samples[0][0] > 5:
+                    self.samples.popleft()
+                pending = self._split(pending + data, now)
+            self.stream.close()
+            # screenrecord stops at its time limit; restart to keep recording
+            if self.running:
+                self.restarts += 1
+
+    def _split(self, data, now):
+        """Append every complete NAL unit in data, return the unfinished tail"""
+        start = data.find(b'\x00\x00\x01')
+        if start < 0:
+            return data[-3:]
+        while True:
+            nxt = data.find(b'\x00\x00\x01', start + 3)
+            if nxt < 0:
+                return data[start:]
+            # A 4-byte start code leaves a zero at the end of the previous NAL
+            self.ring.append(data[start + 3:nxt].rstrip(b'\x00'), now)
+            start = nxt
+
+    def stats(self):
+        bitrate = 0.0
+        if len(self.samples) > 1:
+            (t0, b0), (t1, b1) = self.samples[0], self.samples[-1]
+            if t1 > t0:
+                bitrate = (b1 - b0) * 8 / (t1 - t0)
+        return {
+            'serial': self.serial,
+            'frames': self.ring.frames,
+            'dropped_frames': self.ring.dropped,
+            'evicted_frames': self.ring.evicted,
+            'bitrate': bitrate,
+            'buffered_seconds': self.ring.buffered_seconds(),
+            'memory_cap': self.ring.capacity,
+            'restarts': self.restarts,
+        }
+
+class ScreenRecorder:
+    """Continuous per-device recording into bounded memory, dumped on demand"""
+    def __init__(self, android, memory_cap=64 * 1024 * 1024, bit_rate=4000000, size=None):
+        self.android = android
+        self.memory_cap = memory_cap
+        self.bit_rate = bit_rate
+        self.size = size
+        self.recorders = {}
+
+    def start(self, serials):
+        for serial in serials:
+            if serial not in self.recorders:
+                recorder = DeviceRecorder(self.android, serial, self.memory_cap, self.bit_rate, self.size)
+                self.recorders[serial] = recorder
+                recorder.start()
+
+    def stop(self):
+        for recorder in self.recorders.values():
+            recorder.stop()
+
+    def dump(self, serial, seconds, output_file):
+        """Write the last seconds of a device to output_file, MP4 via ffmpeg or raw .h264"""
+        recorder = self.recorders.get(serial)
+        if not recorder:
+            print(f"{Colors.FAIL}✗ {serial} is not being recorded{Colors.ENDC}")
+            return False
+        stream, frames, duration = recorder.ring.last_seconds(seconds)
+        if not stream:
+            print(f"{Colors.WARNING}⚠ No decodable video buffered for {serial} yet{Colors.ENDC}")
+            return False
+        
+        fps = max(frames / duration, 1.0) if duration > 0 else 30.0
+        ffmpeg = find_tool('ffmpeg')
+        if ffmpeg and output_file.endswith('.mp4'):
+            proc = run_command([ffmpeg, '-y', '-loglevel', 'error', '-f', 'h264', '-framerate', f"{fps:.3f}",
+                                '-i', 'pipe:0', '-c', 'copy', '-movflags', '+faststart', output_file],
+                               text=False, input=stream)
+            if not proc or proc.returncode != 0:
+                error = proc.stderr.decode('utf-8', 'replace') if proc else 'could not run ffmpeg'
+                print(f"{Colors.FAIL}✗ ffmpeg failed: {error}{Colors.ENDC}")
+                return False
+        else:
+            if output_file.endswith('.mp4'):
+                print(f"{Colors.WARNING}ffmpeg not found, saving raw H.264 instead{Colors.ENDC}")
+                output_file = output_file[:-4] + '.h264'
+            with open(output_file, 'wb') as f:
+                f.write(stream)
+        print(f"{Colors.OKGREEN}✓ Saved {duration:.1f}s ({frames} frames) of {serial} to {output_file}{Colors.ENDC}")
+        return True
+
+    def print_stats(self):
+        for recorder in self.recorders.values():
+            st = recorder.stats()
+            print(f"  {st['serial']}: {st['frames']} frames, {st['buffered_seconds']:.1f}s buffered, "
+                  f"{st['bitrate'] / 1e6:.2f} Mbit/s, {st['dropped_frames']} dropped, "
+                  f"{st['evicted_frames']} evicted, cap {format_bytes(st['memory_cap'])}")
+
+class AndroidSnapshot:
+    """Parsed getprop / dumpsys battery / wm size output for one device"""
+    MARKER = '__BLUEPHONE_SECTION__'
+    SECTIONS = [
+        ('getprop', 'getprop'),
+        ('battery', 'dumpsys battery'),
+        ('display', 'wm size'),
+    ]
+
+    def __init__(self, serial=None):
+        self.serial = serial
+        self.props = {}
+        self.battery = {}
+        self.physical_size = None
+        self.override_size = None
+        self.timestamp = time.time()
+
+    @classmethod
+    def command(cls):
+        """Shell script that prints every section behind a marker line"""
+        return '; '.join(f"echo {cls.MARKER}{name}; {cmd}" for name, cmd in cls.SECTIONS)
+
+    @classmethod
+    def parse(cls, output, serial=None):
+        snapshot = cls(serial)
+        sections = {}
+        current = None
+        for line in output.splitlines():
+            if line.startswith(cls.MARKER):
+                current = line[len(cls.MARKER):].strip()
+                sections[current] = []
+            elif current:
+                sections[current].append(line)
+        
+        for line in sections.get('getprop', []):
+            # Lines look like: [ro.product.model]: [Pixel 7]
+            if line.startswith('[') and ']: [' in line and line.endswith(']'):
+                key, value = line[1:-1].split(']: [', 1)
+                snapshot.props[key] = value
+        
+        for line in sections.get('battery', []):
+            key, sep, value = line.strip().partition(':')
+            if sep and value:
+                snapshot.battery[key.strip()] = value.strip()
+        
+        for line in sections.get('display', []):
+            key, sep, value = line.partition(':')
+            size = cls._parse_size(value) if sep else None
+            if key.strip() == 'Physical size':
+                snapshot.physical_size = size
+            elif key.strip() == 'Override size':
+                snapshot.override_size = size
+        return snapshot
+
+    @staticmethod
+    def _parse_size(value):
+        width, sep, height = value.strip().partition('x')
+        if sep and width.isdigit() and height.isdigit():
+            return (int(width), int(height))
+        return None
+
+    @property
+    def model(self):
+        return self.props.get('ro.product.model')
+
+    @property
+    def version(self):
+        return self.props.get('ro.build.version.release')
+
+    @property
+    def battery_level(self):
+        level = self.battery.get('level')
+        return int(level) if level and level.isdigit() else None
+
+    @property
+    def resolution(self):
+        return self.override_size or self.physical_size
+
+    def to_dict(self):
+        return {
+            'serial': self.serial,
+            'model': self.model,
+            'version': self.version,
+            'battery_level': self.battery_level,
+            'resolution': self.resolution,
+            'battery': dict(self.battery),
+            'props': dict(self.props),
+        }
+
+class InputShell:
+    """One long-lived shell on a device that runs batches of input commands
+
+    Every batch is followed by an echo of a numbered sentinel, so its end and
+    exit status can be read back without reopening the stream. Goes over an
+    exec:sh stream on the adb server, or an `adb shell` subprocess fed
+    through stdin without one.
+    """
+    MARKER = '__BLUEPHONE_DONE__'
+
+    def __init__(self, android, serial=None, timeout=30.0):
+        self.android = android
+        self.serial = serial
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.proc = None
+        self.sequence = 0
+
+    async def open(self):
+        client = self.android.adb_server()
+        if client:
+            try:
+                self.reader, self.writer = await client.async_open_stream('sh', self.serial, service='exec')
+                return self
+            except ADBError as e:
+                self.android._server_failed(e)
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.android.adb_command(['shell'], self.serial), stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+        self.reader, self.writer = self.proc.stdout, self.proc.stdin
+        return self
+
+    async def run(self, commands):
+        """Run shell commands as one batch, returns (exit status, output, seconds)"""
+        self.sequence += 1
+        sentinel = f"{self.MARKER}{self.sequence}"
+        script = '; '.join(commands)
+        start = time.perf_counter()
+        self.writer.write(f"{{ {script}; }} 2>&1; echo {sentinel} $?\n".encode())
+        await self.writer.drain()
+        output = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise ADBError(f"Shell on {self.serial or 'device'} closed")
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            if line.startswith(sentinel + ' '):
+                status = line[len(sentinel) + 1:]
+                return (int(status) if status.isdigit() else -1), '\n'.join(output), time.perf_counter() - start
+            output.append(line)
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(b'exit\n')
+            await self.writer.drain()
+        except (OSError, RuntimeError):
+            pass
+        self.writer.close()
+        if self.proc:
+            try:
+                await asyncio.wait_for(self.proc.wait(), 2)
+            except asyncio.TimeoutError:
+                kill_process_group(self.proc, grace=0)
+                await self.proc.wait()
+        self.writer = None
+
+class InputReplay:
+    """Plays gesture scripts on one or more devices in lockstep
+
+    A script has one event per line, "<seconds> <action> <args>", e.g.
+    "0.5 tap 540 1200", "1.2 swipe 540 1800 540 600 300", "2 key BACK",
+    "2.5 text hello" or "3 longpress 100 200 800"; times are offsets from
+    the start and # starts a comment. Each event is sent to every device at
+    its scheduled time and the next one waits until all devices finished, so
+    a slow device delays the others instead of drifting apart.
+
+    In sendevent mode taps, long presses and swipes are written as raw
+    multitouch events to the touchscreen found by getevent, which costs
+    a few milliseconds; keys and text, and devices without a usable
+    touchscreen, go through `input`, which starts a JVM per command.
+    """
+    ACTIONS = {'tap': (2, 2), 'longpress': (2, 3), 'swipe': (4, 5), 'key': (1, 1), 'text': (1, None)}
+    EV_SYN, EV_KEY, EV_ABS = 0, 1, 3
+    BTN_TOUCH = 330
+    ABS_CODES = {'ABS_MT_SLOT': 47, 'ABS_MT_TOUCH_MAJOR': 48, 'ABS_MT_POSITION_X': 53,
+                 'ABS_MT_POSITION_Y': 54, 'ABS_MT_TRACKING_ID': 57, 'ABS_MT_PRESSURE': 58}
+    # Interval between moves of a sendevent swipe
+    MOVE_INTERVAL = 0.016
+
+    def __init__(self, android, serials=None, mode='sendevent', speed=1.0, timeout=30.0):
+        self.android = android
+        self.serials = list(serials) if serials else [None]
+        self.mode = mode
+        self.speed = speed
+        self.timeout = timeout
+        self.touch = {}
+
+    @classmethod
+    def parse(cls, lines):
+        """Turn script lines into a list of event dicts sorted by time"""
+        events = []
+        for number, line in enumerate(lines, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 2)
+            if len(parts) < 2 or parts[1] not in cls.ACTIONS:
+                raise ValueError(f"line {number}: expected '<seconds> <action> <args>', got {line!r}")
+            at, action = float(parts[0]), parts[1]
+            rest = parts[2] if len(parts) > 2 else ''
+            low, high = cls.ACTIONS[action]
+            args = [rest] if action == 'text' and rest else rest.split()
+            if len(args) < low or high is not None and len(args) > high:
+                expected = low if low == high else f"{low} to {high}" if high else f"at least {low}"
+                raise ValueError(f"line {number}: {action} takes {expected} arguments")
+            if action not in ('key', 'text'):
+                args = [int(float(arg)) for arg in args]
+            events.append({'at': at, 'action': action, 'args': args, 'line': number})
+        events.sort(key=lambda event: event['at'])
+        return events
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.parse(f)
+
+    @classmethod
+    def parse_touchscreen(cls, output):
+        """Pick the multitouch device out of `getevent -pl` and `wm size` output"""
+        devices = []
+        device = None
+        size = None
+        for line in output.splitlines():
+            if line.startswith('add device'):
+                device = {'path': line.split(':', 1)[1].strip(), 'abs': {}, 'btn_touch': False}
+                devices.append(device)
+            elif line.startswith('Physical size:'):
+                size = AndroidSnapshot._parse_size(line.split(':', 1)[1])
+            elif device is not None:
+                if 'BTN_TOUCH' in line:
+                    device['btn_touch'] = True
+                match = re.search(r'(ABS_MT_\w+)\s*: value -?\d+, min (-?\d+), max (-?\d+)', line)
+                if match:
+                    device['abs'][match.group(1)] = (int(match.group(2)), int(match.group(3)))
+        for device in devices:
+            if 'ABS_MT_POSITION_X' in device['abs'] and 'ABS_MT_POSITION_Y' in device['abs'] and size:
+                device['size'] = size
+                return device
+        return None
+
+    def _scale(self, touch, x, y):
+        (x_min, x_max), (y_min, y_max) = touch['abs']['ABS_MT_POSITION_X'], touch['abs']['ABS_MT_POSITION_Y']
+        width, height = touch['size']
+        return (x_min + round(x * (x_max - x_min) / max(width - 1, 1)),
+                y_min + round(y * (y_max - y_min) / max(height - 1, 1)))
+
+    def _sendevent(self, touch, events):
+        return [f"sendevent {touch['path']} {kind} {code} {value}" for kind, code, value in events]
+
+    def _touch(self, touch, x, y, start):
+        codes = self.ABS_CODES
+        x, y = self._scale(touch, x, y)
+        events = []
+        if start:
+            if 'ABS_MT_SLOT' in touch['abs']:
+                events.append((self.EV_ABS, codes['ABS_MT_SLOT'], 0))
+            events.append((self.EV_ABS, codes['ABS_MT_TRACKING_ID'], 1))
+            for name, fraction in (('ABS_MT_TOUCH_MAJOR', 16), ('ABS_MT_PRESSURE', 2)):
+                if name in touch['abs']:
+                    events.append((self.EV_ABS, codes[name], max(1, touch['abs'][name][1] // fraction)))
+            if touch['btn_touch']:
+                events.append((self.EV_KEY, self.BTN_TOUCH, 1))
+        events += [(self.EV_ABS, codes['ABS_MT_POSITION_X'], x), (self.EV_ABS, codes['ABS_MT_POSITION_Y'], y),
+                   (self.EV_SYN, 0, 0)]
+        return self._sendevent(touch, events)
+
+    def _release(self, touch):
+        events = [(self.EV_ABS, self.ABS_CODES['ABS_MT_TRACKING_ID'], -1)]
+        if touch['btn_touch']:
+            events.append((self.EV_KEY, self.BTN_TOUCH, 0))
+        return self._sendevent(touch, events + [(self.EV_SYN, 0, 0)])
+
+    def commands(self, event, touch=None):
+        """Shell commands performing one event, raw events when touch is a touchscreen"""
+        action, args = event['action'], event['args']
+        if action == 'key':
+            return [f"input keyevent {shlex.quote(args[0])}"]
+        if action == 'text':
+            return [f"input text {shlex.quote(args[0].replace(' ', '%s'))}"]
+        if action == 'swipe':
+            x1, y1, x2, y2 = args[:4]
+            duration = args[4] if len(args) > 4 else 300
+        else:
+            x1, y1 = x2, y2 = args[:2]
+            duration = (args[2] if len(args) > 2 else 600) if action == 'longpress' else 0
+        if touch is None:
+            if action == 'tap':
+                return [f"input tap {x1} {y1}"]
+            return [f"input swipe {x1} {y1} {x2} {y2} {duration}"]
+        commands = self._touch(touch, x1, y1, True)
+        steps = int(duration / 1000 / self.MOVE_INTERVAL)
+        if action == 'swipe':
+            for step in range(1, steps + 1):
+                commands.append(f"sleep {self.MOVE_INTERVAL}")
+                commands += self._touch(touch, x1 + (x2 - x1) * step // steps, y1 + (y2 - y1) * step // steps, False)
+        elif duration:
+            commands.append(f"sleep {duration / 1000:g}")
+        return commands + self._release(touch)
+
+    async def _setup(self, shell):
+        if self.mode != 'sendevent':
+            return None
+        _, output, _ = await shell.run(['getevent -pl', 'wm size'])
+        touch = self.parse_touchscreen(output)
+        if touch is None:
+            print(f"{Colors.WARNING}⚠ No touchscreen found on {shell.serial or 'device'}, "
+                  f"falling back to input commands{Colors.ENDC}")
+        return touch
+
+    async def async_play(self, events):
+        """Play events on every device, returns the per-device latency report"""
+        shells = {}
+        report = {serial: {'latencies': [], 'lateness': [], 'failed': 0, 'errors': []} for serial in self.serials}
+        try:
+            for serial in self.serials:
+                shells[serial] = await InputShell(self.android, serial, self.timeout).open()
+            touches = await asyncio.gather(*(self._setup(shell) for shell in shells.values()))
+            self.touch = dict(zip(self.serials, touches))
+            loop = asyncio.get_running_loop()
+            
+            async def perform(serial, event, scheduled):
+                stats = report[serial]
+                stats['lateness'].append(max(0.0, loop.time() - scheduled))
+                try:
+                    status, output, latency = await shells[serial].run(self.commands(event, self.touch[serial]))
+                except (ADBError, OSError, asyncio.TimeoutError) as e:
+                    status, output, latency = -1, str(e), None
+                if latency is not None:
+                    stats['latencies'].append(latency)
+                if status != 0:
+                    stats['failed'] += 1
+                    stats['errors'].append(f"line {event['line']}: {output.strip() or f'exit status {status}'}")
+            
+            start = loop.time()
+            for event in events:
+                scheduled = start + event['at'] / self.speed
+                delay = scheduled - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await asyncio.gather(*(perform(serial, event, scheduled) for serial in self.serials))
+            for stats in report.values():
+                stats['duration'] = loop.time() - start
+        finally:
+            await asyncio.gather(*(shell.close() for shell in shells.values()), return_exceptions=True)
+        return report
+
+    def play(self, events):
+        return asyncio.run(self.async_play(events))
+
+    def print_report(self, report, events):
+        print(f"\n{Colors.OKBLUE}{'Device':24} {'Mode':9} {'Events':>6} {'p50 ms':>8} {'p90 ms':>8} {'max ms':>8} "
+              f"{'late ms':>8} {'Failed':>6}{Colors.ENDC}")
+        for serial, stats in report.items():
+            mode = 'sendevent' if self.touch.get(serial) else 'input'
+            latencies = stats['latencies'] or [0.0]
+            print(f"{serial or 'default':24} {mode:9} {len(events):>6} "
+                  f"{Benchmark.percentile(latencies, 0.5) * 1000:>8.1f} "
+                  f"{Benchmark.percentile(latencies, 0.9) * 1000:>8.1f} {max(latencies) * 1000:>8.1f} "
+                  f"{max(stats['lateness'] or [0.0]) * 1000:>8.1f} {stats['failed']:>6}")
+            for error in stats['errors'][:5]:
+                print(f"  {Colors.FAIL}✗ {error}{Colors.ENDC}")
+        return all(stats['failed'] == 0 for stats in report.values())
+
+class AndroidAccess:
+    def __init__(self, use_adb_server=True, adb_host='127.0.0.1', adb_port=5037, snapshot_ttl=30, registry=None,
+                 install=True):
+        self.adb_path = self.check_and_install_adb(install)
+        self.adb_client = ADBClient(adb_host, adb_port) if use_adb_server else None
+        self._server_checked = False
+        self.snapshot_ttl = snapshot_ttl
+        self.snapshot_cache = {}
+        self.registry = registry
+        if registry:
+            registry.subscribe(self._on_device_event)
+
+    def _on_device_event(self, event, platform, device_id, record):
+        if platform == 'android':
+            # serial=None entries refer to "the first device", which may have changed too
+            self.invalidate_snapshot(None)
+            if event != 'attached':
+                self.invalidate_snapshot(device_id)
+
+    def adb_server(self):
+        """Return the adb server client if the server is reachable, else None"""
+        if self.adb_client and not self._server_checked:
+            self._server_checked = True
+            if not self.adb_client.is_available():
+                print(f"{Colors.WARNING}adb server not reachable, falling back to adb subprocesses{Colors.ENDC}")
+                self.adb_client = None
+        return self.adb_client
+
+    def _server_failed(self, error):
+        print(f"{Colors.WARNING}adb server request failed ({error}), falling back to adb subprocess{Colors.ENDC}")
+        self._server_checked = False
+
+    def _stream_failed(self, service, error):
+        # The device already accepted the command, running it again could repeat its side effects
+        print(f"{Colors.FAIL}adb {service} connection lost while the command ran: {error}{Colors.ENDC}")
+        return None
+
+    def adb_command(self, args, serial=None):
+        """Build an adb argv, targeting serial when given"""
+        cmd = ['adb']
+        if serial:
+            cmd.extend(['-s', serial])
+        return cmd + list(args)
+
+    def shell(self, args, serial=None):
+        """Run `adb shell` args, over the adb server socket when available
+
+        A string is passed to the device shell as-is, a list is quoted per argument.
+        """
+        client = self.adb_server()
+        if client:
+            try:
+                status, output, errors = client.run(args, serial)
+                return subprocess.CompletedProcess(args, status, output.decode('utf-8', 'replace'),
+                                                   errors.decode('utf-8', 'replace'))
+            except ADBStreamError as e:
+                return self._stream_failed('shell', e)
+            except ADBError as e:
+                self._server_failed(e)
+        args = [args] if isinstance(args, str) else list(args)
+        return run_command(self.adb_command(['shell'] + args, serial))
+
+    def exec_out(self, args, serial=None):
+        """Run `adb exec-out` args and return stdout as bytes, or None on failure"""
+        client = self.adb_server()
+        if client:
+            try:
+                return client.exec_out(args, serial)
+            except ADBStreamError as e:
+                return self._stream_failed('exec-out', e)
+            except ADBError as e:
+                self._server_failed(e)
+        args = [args] if isinstance(args, str) else list(args)
+        result = run_command(self.adb_command(['exec-out'] + args, serial), text=False)
+        if not result or result.returncode != 0:
+            return None
+        return result.stdout
+
+    async def async_shell(self, args, serial=None, timeout=30, service='shell'):
+        """Asyncio version of shell(), returns a CompletedProcess or None"""
+        client = self.adb_server()
+        if client:
+            try:
+                if service == 'exec':
+                    # exec: has no exit status, like `adb exec-out`
+                    output = await asyncio.wait_for(client.async_shell(args, serial, service), timeout)
+                    return subprocess.CompletedProcess(args, 0, output, b'')
+                status, output, errors = await asyncio.wait_for(client.async_run(args, serial), timeout)
+                return subprocess.CompletedProcess(args, status, output.decode('utf-8', 'replace'),
+                                                   errors.decode('utf-8', 'replace'))
+            except asyncio.TimeoutError:
+                print(f"{Colors.FAIL}adb {service} timed out after {timeout}s{Colors.ENDC}")
+                return None
+            except ADBStreamError as e:
+                return self._stream_failed(service, e)
+            except ADBError as e:
+                self._server_failed(e)
+        args = [args] if isinstance(args, str) else list(args)
+        mode = 'exec-out' if service == 'exec' else 'shell'
+        return await async_run_command(self.adb_command([mode] + args, serial), timeout, text=service != 'exec')
+
+    async def async_exec_out(self, args, serial=None, timeout=30):
+        """Asyncio version of exec_out()"""
+        result = await self.async_shell(args, serial, timeout, service='exec')
+        if not result or result.returncode != 0:
+            return None
+        return result.stdout
+
+    def open_stream(self, args, serial=None):
+        """Start `adb exec-out` args and return a CommandStream over its stdout"""
+        client = self.adb_server()
+        if client:
+            try:
+                return CommandStream(sock=client.open_stream(args, serial))
+            except ADBError as e:
+                self._server_failed(e)
+        args = [args] if isinstance(args, str) else list(args)
+        cmd = self.adb_command(['exec-out'] + args, serial)
+        caller = command_tracer.caller() if command_tracer.enabled else None
+        start = time.time()
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            command_tracer.record(cmd, start, 0.0, None, caller=caller, mode='stream')
+            print(f"{Colors.FAIL}Unexpected error: {e}{Colors.ENDC}")
+            return None
+        return CommandStream(proc=proc, caller=caller)
+
+    def pull(self, remote_path, local_path, serial=None):
+        """Pull a file from the device, returns True on success"""
+        client = self.adb_server()
+        if client:
+            try:
+                client.pull(remote_path, local_path, serial)
+                return True
+            except ADBSyncFailed as e:
+                print(f"{Colors.FAIL}✗ {e}{Colors.ENDC}")
+                return False
+            except (ADBError, OSError) as e:
+                self._server_failed(e)
+        return bool(run_command(self.adb_command(['pull', remote_path, local_path], serial), check=True))
+
+    def check_and_install_adb(self, install=True):
+        """Check if ADB is installed, install if not (and install is set)"""
+        path = find_tool('adb')
+        if path:
             print(f"{Colors.OKGREEN}✓ ADB already installed{Colors.ENDC}")
-            return result.stdout.strip()
+            return path
+        elif not install:
+            print(f"{Colors.WARNING}⚠ ADB not found{Colors.ENDC}")
+            return None
         else:
             print(f"{Colors.WARNING}ADB not found. Installing...{Colors.ENDC}")
             return self.install_adb()
@@ -59,25 +2601,16 @@ class AndroidAccess:
         """Install ADB on Kali Linux"""
         print(f"{Colors.OKCYAN}Installing Android Debug Bridge (ADB)...{Colors.ENDC}")
         
-        # Update package list
-        print("Updating package list...")
-        run_command(['sudo', 'apt-get', 'update', '-y'])
-        
-        # Install ADB
-        print("Installing ADB...")
-        result = run_command(['sudo', 'apt-get', 'install', '-y', 'adb'])
-        
-        if result and result.returncode == 0:
+        if InstallPlanner().ensure(['android']):
             print(f"{Colors.OKGREEN}✓ ADB installed successfully!{Colors.ENDC}")
-            return 'adb'
+            return find_tool('adb') or 'adb'
         else:
             print(f"{Colors.FAIL}✗ Failed to install ADB{Colors.ENDC}")
             return None
     
     def check_and_install_scrcpy(self):
         """Check and install scrcpy if needed"""
-        result = run_command(['which', 'scrcpy'])
-        if result and result.returncode == 0:
+        if find_tool('scrcpy'):
             print(f"{Colors.OKGREEN}✓ scrcpy already installed{Colors.ENDC}")
             return True
         else:
@@ -88,13 +2621,7 @@ class AndroidAccess:
         """Install scrcpy on Kali Linux"""
         print(f"{Colors.OKCYAN}Installing scrcpy...{Colors.ENDC}")
         
-        # Update package list
-        run_command(['sudo', 'apt-get', 'update', '-y'])
-        
-        # Install scrcpy
-        result = run_command(['sudo', 'apt-get', 'install', '-y', 'scrcpy'])
-        
-        if result and result.returncode == 0:
+        if InstallPlanner().ensure(['scrcpy']):
             print(f"{Colors.OKGREEN}✓ scrcpy installed successfully!{Colors.ENDC}")
             return True
         else:
@@ -103,6 +2630,17 @@ class AndroidAccess:
     
     def list_devices(self):
         """List connected Android devices"""
+        client = self.adb_server()
+        if client:
+            try:
+                lines = ['List of devices attached'] + [f"{serial}\t{state}" for serial, state in client.devices()]
+                output = '\n'.join(lines) + '\n'
+                print(f"\n{Colors.OKBLUE}Connected Android Devices:{Colors.ENDC}")
+                print(output)
+                return output
+            except ADBError as e:
+                self._server_failed(e)
+        
         result = run_command(['adb', 'devices'])
         if result:
             print(f"\n{Colors.OKBLUE}Connected Android Devices:{Colors.ENDC}")
@@ -110,23 +2648,96 @@ class AndroidAccess:
             return result.stdout
         return None
     
-    def connect_wireless(self, ip_address, port=5555):
-        """Connect to Android device over WiFi"""
-        print(f"{Colors.OKCYAN}Connecting to {ip_address}:{port}...{Colors.ENDC}")
-        print(f"{Colors.WARNING}Note: Device must be connected via USB first to enable wireless debugging{Colors.ENDC}")
+    def device_ids(self):
+        """Return serials of devices in the 'device' state without printing"""
+        if self.registry and self.registry.is_synced('android'):
+            return self.registry.ids('android', 'device')
+        client = self.adb_server()
+        if client:
+            try:
+                return [serial for serial, state in client.devices() if state == 'device']
+            except ADBError as e:
+                self._server_failed(e)
         
-        run_command(['adb', 'tcpip', str(port)])
-        time.sleep(2)
+        result = run_command(['adb', 'devices'])
+        if not result:
+            return []
+        serials = []
+        for line in result.stdout.splitlines()[1:]:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1] == 'device':
+                serials.append(parts[0])
+        return serials
+    
+    async def async_device_ids(self, timeout=30):
+        """Asyncio version of device_ids()"""
+        if self.registry and self.registry.is_synced('android'):
+            return self.registry.ids('android', 'device')
+        client = self.adb_server()
+        if client:
+            return await asyncio.get_running_loop().run_in_executor(None, self.device_ids)
+        result = await async_run_command(['adb', 'devices'], timeout)
+        if not result:
+            return []
+        return [parts[0] for parts in (line.split() for line in result.stdout.splitlines()[1:])
+                if len(parts) >= 2 and parts[1] == 'device']
+    
+    def connect_wireless(self, ip_address, port=5555, timeout=20.0):
+        """Connect to Android device over WiFi
+
+        adbd on the USB device is switched to TCP first unless the address is
+        already connected, then the connect is retried until the device is ready.
+        """
+        address = WirelessADB.normalize(ip_address, port)
+        print(f"{Colors.OKCYAN}Connecting to {address}...{Colors.ENDC}")
+        serials = self.device_ids()
+        if address not in serials:
+            print(f"{Colors.WARNING}Note: Device must be connected via USB first to enable wireless debugging{Colors.ENDC}")
+            usb = [serial for serial in serials if not WirelessADB.ADDRESS.match(serial)]
+            if usb:
+                self.enable_tcpip(port, usb[0])
         
-        result = run_command(['adb', 'connect', f'{ip_address}:{port}'])
+        stats = WirelessADB(self, [address], connect_timeout=timeout).connect_all()[address]
         
-        if result and 'connected' in result.stdout.lower():
-            print(f"{Colors.OKGREEN}✓ Successfully connected!{Colors.ENDC}")
+        if stats['state'] == 'device':
+            print(f"{Colors.OKGREEN}✓ Successfully connected in {stats['latency']:.2f}s!{Colors.ENDC}")
             return True
         else:
-            print(f"{Colors.FAIL}✗ Connection failed{Colors.ENDC}")
+            print(f"{Colors.FAIL}✗ Connection failed: {stats['error']}{Colors.ENDC}")
             return False
     
+    def enable_tcpip(self, port=5555, serial=None):
+        """Restart adbd on a USB device listening on TCP, like `adb tcpip`"""
+        client = self.adb_server()
+        if client:
+            try:
+                client.tcpip(port, serial)
+                return True
+            except ADBStreamError:
+                # adbd restarting drops the connection once it has taken the request
+                return True
+            except ADBError as e:
+                self._server_failed(e)
+        return bool(run_command(self.adb_command(['tcpip', str(port)], serial), check=True))
+    
+    def replay_input(self, script, serials=None, mode='sendevent', speed=1.0):
+        """Play a gesture script on the given devices in lockstep, see InputReplay"""
+        try:
+            events = InputReplay.load(script)
+        except (OSError, ValueError) as e:
+            print(f"{Colors.FAIL}Cannot read gesture script {script}: {e}{Colors.ENDC}")
+            return None
+        if not events:
+            print(f"{Colors.WARNING}No events in {script}{Colors.ENDC}")
+            return None
+        
+        replay = InputReplay(self, serials, mode, speed)
+        print(f"{Colors.OKCYAN}Replaying {len(events)} events on {len(replay.serials)} device(s)...{Colors.ENDC}")
+        report = replay.play(events)
+        if replay.print_report(report, events):
+            print(f"{Colors.OKGREEN}✓ Replay finished in {max(r['duration'] for r in report.values()):.2f}s{Colors.ENDC}")
+        return report
+    
     def screen_mirror(self):
         """Mirror Android screen using scrcpy"""
         if not self.check_and_install_scrcpy():
@@ -152,99 +2763,933 @@ class AndroidAccess:
         except KeyboardInterrupt:
             print(f"\n{Colors.OKCYAN}Recording stopped{Colors.ENDC}")
     
-    def screenshot(self, output_file='android_screenshot.png'):
-        """Take a screenshot of Android device"""
+    def ring_record(self, serials=None, seconds=30, memory_cap=64 * 1024 * 1024, output_pattern='record_{serial}_{time}.mp4'):
+        """Record devices continuously and save the last seconds whenever Enter is pressed"""
+        serials = serials or self.device_ids()
+        if not serials:
+            print(f"{Colors.FAIL}✗ No Android devices connected{Colors.ENDC}")
+            return False
+        
+        recorder = ScreenRecorder(self, memory_cap)
+        recorder.start(serials)
+        print(f"\n{Colors.OKGREEN}Recording {len(serials)} device(s) into {format_bytes(memory_cap)} ring buffers{Colors.ENDC}")
+        print(f"{Colors.WARNING}Press Enter to save the last {seconds}s, Ctrl+C to stop{Colors.ENDC}")
+        try:
+            while True:
+                input()
+                stamp = time.strftime('%Y%m%d-%H%M%S')
+                for serial in serials:
+                    recorder.dump(serial, seconds, output_pattern.format(serial=serial, time=stamp))
+                recorder.print_stats()
+        except (KeyboardInterrupt, EOFError):
+            print(f"\n{Colors.OKCYAN}Recording stopped{Colors.ENDC}")
+        finally:
+            recorder.stop()
+            recorder.print_stats()
+        return True
+    
+    def capture_frame(self, serial=None, raw=False):
+        """Stream a screencap straight into memory, no temp file on the device
+
+        Returns PNG bytes, or a ScreenFrame of raw pixels when raw is True.
+        """
+        data = self.exec_out(['screencap'] if raw else ['screencap', '-p'], serial)
+        if not data:
+            return None
+        if raw:
+            return ScreenFrame.from_screencap(data)
+        return data if data.startswith(PNG_SIGNATURE) else None
+
+    async def async_capture_frame(self, serial=None, raw=False, timeout=30):
+        """Asyncio version of capture_frame()"""
+        data = await self.async_exec_out(['screencap'] if raw else ['screencap', '-p'], serial, timeout)
+        if not data:
+            return None
+        if raw:
+            return ScreenFrame.from_screencap(data)
+        return data if data.startswith(PNG_SIGNATURE) else None
+
+    async def async_screenshot(self, output_file='android_screenshot.png', serial=None, raw=False, timeout=30):
+        """Asyncio version of screenshot(), streaming only"""
+        frame = await self.async_capture_frame(serial, raw, timeout)
+        if raw and not frame:
+            # Pixel formats that cannot be converted host-side get a device-encoded PNG
+            raw = False
+            frame = await self.async_capture_frame(serial, raw, timeout)
+        if not frame:
+            print(f"{Colors.FAIL}✗ Failed to take screenshot{Colors.ENDC}")
+            return False
+        with open(output_file, 'wb') as f:
+            f.write(frame.to_png() if raw else frame)
+        print(f"{Colors.OKGREEN}✓ Screenshot saved to {output_file}{Colors.ENDC}")
+        return True
+
+    def screenshot(self, output_file='android_screenshot.png', serial=None, raw=False, store=None):
+        """Take a screenshot of Android device
+
+        With raw=True the device skips PNG compression and the frame is
+        encoded host-side, which is usually faster on slow phones. With a
+        ChunkStore as store, the image goes into its 'screenshots' snapshot
+        under output_file instead of onto disk.
+        """
         print(f"\n{Colors.OKGREEN}Taking screenshot...{Colors.ENDC}")
         
-        if run_command(['adb', 'shell', 'screencap', '-p', '/sdcard/screenshot.png'], check=True):
-            if run_command(['adb', 'pull', '/sdcard/screenshot.png', output_file], check=True):
-                run_command(['adb', 'shell', 'rm', '/sdcard/screenshot.png'])
+        frame = self.capture_frame(serial, raw)
+        if raw and not frame:
+            # Pixel formats that cannot be converted host-side get a device-encoded PNG
+            raw = False
+            frame = self.capture_frame(serial, raw)
+        if frame:
+            data = frame.to_png() if raw else frame
+            if store:
+                store.print_ingest(output_file, store.put_bytes('screenshots', output_file, data))
+                return True
+            with open(output_file, 'wb') as f:
+                f.write(data)
+            print(f"{Colors.OKGREEN}✓ Screenshot saved to {output_file}{Colors.ENDC}")
+            return True
+        if store:
+            print(f"{Colors.FAIL}✗ Failed to take screenshot{Colors.ENDC}")
+            return False
+        
+        # Devices without exec-out support fall back to a temp file on /sdcard
+        print(f"{Colors.WARNING}Streaming capture failed, using on-device temp file{Colors.ENDC}")
+        result = self.shell(['screencap', '-p', '/sdcard/screenshot.png'], serial)
+        if result and result.returncode == 0:
+            if self.pull('/sdcard/screenshot.png', output_file, serial):
+                self.shell(['rm', '/sdcard/screenshot.png'], serial)
                 print(f"{Colors.OKGREEN}✓ Screenshot saved to {output_file}{Colors.ENDC}")
+                return True
+        return False
     
-    def device_info(self):
+    def screenshot_burst(self, count=10, interval=0.5, output_pattern=None, serial=None, raw=True, encode=True,
+                         diff=None):
+        """Grab count frames every interval seconds and report the achieved rate
+
+        Frames are kept in memory unless output_pattern (e.g. 'frame_{index:03d}.png')
+        is given. Raw frames are PNG-encoded host-side when encode is True, otherwise
+        written as plain RGBA. With a FrameDiff as diff, raw frames that did not
+        change beyond its thresholds are dropped before encoding or writing.
+        """
+        print(f"\n{Colors.OKGREEN}Capturing {count} frames every {interval}s...{Colors.ENDC}")
+        
+        frames = []
+        changes = []
+        captured_at = []
+        failed = 0
+        unchanged = 0
+        start = time.monotonic()
+        next_shot = start
+        for index in range(count):
+            delay = next_shot - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_shot += interval
+            
+            frame = self.capture_frame(serial, raw)
+            if not frame:
+                failed += 1
+                continue
+            captured_at.append(time.monotonic())
+            if diff and raw:
+                change = diff.compare(frame)
+                if not change.changed:
+                    unchanged += 1
+                    continue
+                changes.append(change)
+            if output_pattern:
+                data = frame.to_png() if raw and encode else (frame.pixels if raw else frame)
+                with open(output_pattern.format(index=index, serial=serial or 'default'), 'wb') as f:
+                    f.write(data)
+            frames.append(frame)
+        
+        elapsed = time.monotonic() - start
+        # Rate over the intervals between captured frames, not including the last capture's duration
+        span = captured_at[-1] - captured_at[0] if len(captured_at) > 1 else 0.0
+        fps = (len(captured_at) - 1) / span if span > 0 else 0.0
+        print(f"{Colors.OKGREEN}✓ Captured {len(captured_at)}/{count} frames in {elapsed:.2f}s "
+              f"({fps:.2f} fps, target {1 / interval if interval > 0 else float('inf'):.2f} fps){Colors.ENDC}")
+        if diff and raw:
+            print(f"{Colors.OKCYAN}Kept {len(frames)} changed frames, dropped {unchanged} unchanged{Colors.ENDC}")
+        if failed:
+            print(f"{Colors.WARNING}⚠ {failed} frames failed{Colors.ENDC}")
+        return {'frames': frames, 'changes': changes, 'elapsed': elapsed, 'fps': fps, 'failed': failed,
+                'unchanged': unchanged}
+
+    def snapshot(self, serial=None, refresh=False):
+        """Collect getprop, battery and display info in a single shell round trip
+
+        Results are cached per serial for snapshot_ttl seconds.
+        """
+        cached = self.snapshot_cache.get(serial)
+        if cached and not refresh and time.monotonic() - cached[0] < self.snapshot_ttl:
+            return cached[1]
+        
+        result = self.shell(AndroidSnapshot.command(), serial)
+        if not result or result.returncode != 0:
+            return None
+        
+        snapshot = AndroidSnapshot.parse(result.stdout, serial)
+        self.snapshot_cache[serial] = (time.monotonic(), snapshot)
+        return snapshot
+
+    async def async_snapshot(self, serial=None, refresh=False, timeout=30):
+        """Asyncio version of snapshot(), sharing the same cache"""
+        cached = self.snapshot_cache.get(serial)
+        if cached and not refresh and time.monotonic() - cached[0] < self.snapshot_ttl:
+            return cached[1]
+        
+        result = await self.async_shell(AndroidSnapshot.command(), serial, timeout)
+        if not result or result.returncode != 0:
+            return None
+        
+        snapshot = AndroidSnapshot.parse(result.stdout, serial)
+        self.snapshot_cache[serial] = (time.monotonic(), snapshot)
+        return snapshot
+
+    def invalidate_snapshot(self, serial=None):
+        """Drop the cached snapshot for a device"""
+        self.snapshot_cache.pop(serial, None)
+
+    def device_info(self, serial=None, refresh=False):
         """Get device information"""
+        return self._print_device_info(self.snapshot(serial, refresh))
+
+    async def async_device_info(self, serial=None, refresh=False, timeout=30):
+        """Asyncio version of device_info()"""
+        return self._print_device_info(await self.async_snapshot(serial, refresh, timeout))
+
+    def _print_device_info(self, snapshot):
         print(f"\n{Colors.OKBLUE}Android Device Information:{Colors.ENDC}")
         
-        model = run_command(['adb', 'shell', 'getprop', 'ro.product.model'])
-        if model:
-            print(f"Model: {model.stdout.strip()}")
+        if not snapshot:
+            print(f"{Colors.FAIL}✗ Error getting device info{Colors.ENDC}")
+            return None
+        
+        print(f"Model: {snapshot.model}")
+        print(f"Android Version: {snapshot.version}")
+        if snapshot.battery_level is not None:
+            print(f"Battery: level: {snapshot.battery_level}")
+        if snapshot.resolution:
+            print(f"Screen: {snapshot.resolution[0]}x{snapshot.resolution[1]}")
+        return snapshot
+
+def _ideviceinfo_value(text):
+    if text in ('true', 'false'):
+        return text == 'true'
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def parse_ideviceinfo(output):
+    """Parse `ideviceinfo -x` plist output, or the plain 'Key: Value' format, into a dict
+
+    In the plain format nested dictionaries are indented under a 'Key:' line.
+    """
+    if output.lstrip().startswith('<?xml'):
+        try:
+            data = plistlib.loads(output.encode('utf-8'))
+            if isinstance(data, dict):
+                return data
+        except (ValueError, plistlib.InvalidFileException, ExpatError):
+            pass
+    
+    root = {}
+    stack = [(-1, root)]
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        key, sep, value = line.strip().partition(':')
+        if not sep:
+            continue
+        while indent <= stack[-1][0]:
+            stack.pop()
+        parent = stack[-1][1]
+        value = value.strip()
+        if value:
+            parent[key] = _ideviceinfo_value(value)
+        else:
+            child = {}
+            parent[key] = child
+            stack.append((indent, child))
+    return root
+
+class UxPlayBuilder:
+    """Incremental UxPlay build that keeps its source and build trees between runs
+
+    The source revision (git HEAD plus a hash of uncommitted changes, or a
+    fingerprint of the files for a plain directory) is recorded after each
+    successful install; a later run with the same revision does nothing.
+    cmake is only re-run when the build tree is unconfigured or the
+    configure options changed, and the build uses every CPU plus ccache when
+    it is installed. Every command runs with cwd= so the process working
+    directory is left alone. Step timings go to <build>/bluephone-builds.jsonl
+    once the sources are in place.
+    """
+    REPO = 'https://github.com/FDH2/UxPlay'
+
+    def __init__(self, source_dir='~/UxPlay', repo=REPO, jobs=None, ccache=True, runner=None, install=True):
+        self.source_dir = os.path.abspath(os.path.expanduser(source_dir))
+        self.build_dir = os.path.join(self.source_dir, 'build')
+        self.repo = repo
+        self.jobs = jobs or os.cpu_count() or 1
+        self.ccache = find_tool('ccache') if ccache else None
+        self.runner = runner or run_command
+        self.install = install
+        self.state_path = os.path.join(self.build_dir, 'bluephone-build.json')
+        self.history_path = os.path.join(self.build_dir, 'bluephone-builds.jsonl')
+
+    def _ok(self, result):
+        return bool(result) and result.returncode == 0
+
+    def is_git(self):
+        return os.path.isdir(os.path.join(self.source_dir, '.git'))
+
+    def has_remote(self):
+        try:
+            with open(os.path.join(self.source_dir, '.git', 'config')) as f:
+                return '[remote ' in f.read()
+        except OSError:
+            return False
+
+    def has_sources(self):
+        return os.path.exists(os.path.join(self.source_dir, 'CMakeLists.txt'))
+
+    def _only_bookkeeping(self):
+        """True if source_dir holds nothing but this class's own state files"""
+        try:
+            if set(os.listdir(self.source_dir)) - {'build'}:
+                return False
+            own = {os.path.basename(self.state_path), os.path.basename(self.history_path)}
+            return not os.path.isdir(self.build_dir) or set(os.listdir(self.build_dir)) <= own
+        except OSError:
+            return False
+
+    def fetch(self, update=True):
+        """Clone on first use, fast-forward afterwards; a failed pull keeps the current tree"""
+        if os.path.isdir(self.source_dir) and not self.has_sources() and self._only_bookkeeping():
+            # Left behind by a failed clone, clone again instead of configuring an empty tree
+            shutil.rmtree(self.source_dir)
+        if not os.path.exists(self.source_dir):
+            print(f"Cloning {self.repo}...")
+            parent = os.path.dirname(self.source_dir)
+            os.makedirs(parent, exist_ok=True)
+            return self._ok(self.runner(['git', 'clone', self.repo, self.source_dir], cwd=parent))
+        if not self.has_sources():
+            print(f"{Colors.FAIL}✗ {self.source_dir} has no CMakeLists.txt{Colors.ENDC}")
+            return False
+        if update and self.has_remote():
+            if not self._ok(self.runner(['git', 'pull', '--ff-only'], cwd=self.source_dir)):
+                print(f"{Colors.WARNING}⚠ git pull failed, building the current checkout{Colors.ENDC}")
+        return True
+
+    def _tree_fingerprint(self):
+        digest = hashlib.sha1()
+        for dirpath, dirnames, filenames in os.walk(self.source_dir):
+            dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) != self.build_dir and d != '.git')
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                digest.update(f"{os.path.relpath(path, self.source_dir)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def revision(self):
+        """Identifies the source that would be built, None if it cannot be determined"""
+        if not self.is_git():
+            return f"tree-{self._tree_fingerprint()}" if os.path.isdir(self.source_dir) else None
+        head = self.runner(['git', 'rev-parse', 'HEAD'], cwd=self.source_dir)
+        if not self._ok(head):
+            return None
+        revision = head.stdout.strip()
+        diff = self.runner(['git', 'diff', 'HEAD'], cwd=self.source_dir)
+        if self._ok(diff) and diff.stdout:
+            revision += '+' + hashlib.sha1(diff.stdout.encode('utf-8', 'replace')).hexdigest()[:12]
+        return revision
+
+    def configure_command(self):
+        cmd = ['cmake', '-S', self.source_dir, '-B', self.build_dir, '-DCMAKE_BUILD_TYPE=Release']
+        if self.ccache:
+            cmd += [f'-DCMAKE_C_COMPILER_LAUNCHER={self.ccache}', f'-DCMAKE_CXX_COMPILER_LAUNCHER={self.ccache}']
+        return cmd
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f, indent=2)
+
+    def _record(self, run):
+        os.makedirs(self.build_dir, exist_ok=True)
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    def build(self, update=True, force=False):
+        """Fetch, configure if needed, build and install; returns True when UxPlay is up to date"""
+        start = time.monotonic()
+        run = {'started': time.time(), 'jobs': self.jobs, 'ccache': bool(self.ccache), 'steps': {}}
+        
+        def step(name, cmd, cwd):
+            began = time.monotonic()
+            print(f"{Colors.OKCYAN}$ {' '.join(cmd)}{Colors.ENDC}")
+            ok = self._ok(self.runner(cmd, cwd=cwd))
+            run['steps'][name] = time.monotonic() - began
+            if not ok:
+                print(f"{Colors.FAIL}✗ {name} failed{Colors.ENDC}")
+            return ok
         
-        version = run_command(['adb', 'shell', 'getprop', 'ro.build.version.release'])
-        if version:
-            print(f"Android Version: {version.stdout.strip()}")
+        def finish(result):
+            run['result'] = result
+            run['total'] = time.monotonic() - start
+            self._record(run)
+            return result in ('built', 'up-to-date')
         
-        battery = run_command(['adb', 'shell', 'dumpsys', 'battery'], shell=True)
-        if battery:
-            for line in battery.stdout.split('\n'):
-                if 'level' in line:
-                    print(f"Battery: {line.strip()}")
-                    break
+        began = time.monotonic()
+        if not self.fetch(update):
+            # Not recorded: the history lives in the build tree, which must not exist without sources
+            print(f"{Colors.FAIL}✗ Failed to fetch UxPlay{Colors.ENDC}")
+            return False
+        run['steps']['fetch'] = time.monotonic() - began
+        run['revision'] = revision = self.revision()
+        
+        state = self.load_state()
+        configure = self.configure_command()
+        installed = not self.install or state.get('installed')
+        if (not force and revision and state.get('revision') == revision and installed
+                and state.get('configure') == configure
+                and os.path.exists(os.path.join(self.build_dir, 'uxplay'))):
+            print(f"{Colors.OKGREEN}✓ UxPlay is up to date ({revision[:12]}){Colors.ENDC}")
+            return finish('up-to-date')
         
-        resolution = run_command(['adb', 'shell', 'wm', 'size'])
-        if resolution:
-            print(f"Screen: {resolution.stdout.strip()}")
+        os.makedirs(self.build_dir, exist_ok=True)
+        configured = os.path.exists(os.path.join(self.build_dir, 'CMakeCache.txt'))
+        if force or not configured or state.get('configure') != configure:
+            if not step('configure', configure, self.build_dir):
+                return finish('configure-failed')
+            state['configure'] = configure
+            state['revision'] = None
+            self._save_state(state)
+        
+        if not step('build', ['cmake', '--build', self.build_dir, '--parallel', str(self.jobs)], self.build_dir):
+            return finish('build-failed')
+        if self.install and not step('install', ['sudo', 'cmake', '--install', self.build_dir], self.build_dir):
+            return finish('install-failed')
+        
+        state.update(revision=revision, installed=self.install, built=time.time())
+        self._save_state(state)
+        tool_probe.forget('uxplay')
+        tool_probe.save()
+        print(f"{Colors.OKGREEN}✓ UxPlay built in {time.monotonic() - start:.1f}s with {self.jobs} jobs"
+              f"{' and ccache' if self.ccache else ''}{Colors.ENDC}")
+        return finish('built')
+
+    def history(self):
+        runs = []
+        try:
+            with open(self.history_path) as f:
+                for line in f:
+                    try:
+                        runs.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return runs
+
+    def print_history(self):
+        runs = self.history()
+        if not runs:
+            print(f"{Colors.WARNING}No UxPlay builds recorded in {self.build_dir}{Colors.ENDC}")
+            return runs
+        print(f"\n{Colors.OKBLUE}UxPlay builds:{Colors.ENDC}")
+        for run in runs:
+            steps = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in run['steps'].items())
+            print(f"  {time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started']))}  {run['result']:16} "
+                  f"{run['total']:7.1f}s  {(run.get('revision') or '')[:12]:12}  -j{run['jobs']}"
+                  f"{' ccache' if run['ccache'] else ''}  ({steps})")
+        return runs
+
+SIOCGIFFLAGS = 0x8913
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_MULTICAST = 0x1000
+
+def network_interfaces(loopback=False):
+    """List interfaces that have an IPv4 address, asking the kernel directly"""
+    interfaces = []
+    try:
+        names = socket.if_nameindex()
+    except OSError:
+        return interfaces
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for index, name in names:
+            request = struct.pack('256s', name.encode()[:15])
+            try:
+                flags = struct.unpack('H', fcntl.ioctl(sock.fileno(), SIOCGIFFLAGS, request)[16:18])[0]
+                address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+                netmask = fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, request)[20:24]
+            except OSError:
+                # No IPv4 address configured
+                continue
+            if flags & IFF_LOOPBACK and not loopback:
+                continue
+            interfaces.append({
+                'name': name,
+                'index': index,
+                'address': address,
+                'prefix': bin(int.from_bytes(netmask, 'big')).count('1'),
+                'up': bool(flags & IFF_UP),
+                'multicast': bool(flags & IFF_MULTICAST),
+                'loopback': bool(flags & IFF_LOOPBACK),
+            })
+    return interfaces
+
+class MDNSProtocol(asyncio.DatagramProtocol):
+    """Queues every datagram received on one interface's socket"""
+    def __init__(self, interface, queue):
+        self.interface = interface
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait((self.interface, data, addr))
+
+    def error_received(self, exc):
+        pass
+
+class MDNSBrowser:
+    """One-shot mDNS browser for AirPlay receivers
+
+    PTR queries for the service types go out from an ephemeral port on
+    every multicast interface, so responders answer by unicast (RFC 6762
+    section 5.1) and Avahi keeps port 5353 to itself. Missing SRV, TXT and
+    address records are asked for in follow-up queries. Answers are
+    collected until the deadline, or until the network has been quiet for
+    a moment once everything is resolved, and cached for the shortest TTL
+    among the records that make up each service.
+    """
+    GROUP = '224.0.0.251'
+    PORT = 5353
+    SERVICE_TYPES = ['_airplay._tcp.local', '_raop._tcp.local']
+    A, PTR, TXT, AAAA, SRV = 1, 12, 16, 28, 33
+
+    def __init__(self, service_types=None, timeout=1.5, settle=0.3, interfaces=None, group=None, port=None):
+        self.service_types = service_types or self.SERVICE_TYPES
+        self.timeout = timeout
+        self.settle = settle
+        # Interface names to query on, default every multicast-capable one
+        self.interfaces = interfaces
+        self.group = group or self.GROUP
+        self.port = port or self.PORT
+        self.cache = {}
+
+    @staticmethod
+    def _key(name):
+        return tuple(label.lower() for label in name)
+
+    @staticmethod
+    def encode_name(labels):
+        encoded = b''
+        for label in labels:
+            raw = label.encode()[:63]
+            encoded += bytes([len(raw)]) + raw
+        return encoded + b'\x00'
+
+    @staticmethod
+    def read_name(data, offset):
+        """Decode a possibly compressed name, returning (labels, offset after it)"""
+        labels = []
+        end = None
+        for _ in range(128):
+            length = data[offset]
+            if length & 0xc0 == 0xc0:
+                if end is None:
+                    end = offset + 2
+                offset = struct.unpack('!H', data[offset:offset + 2])[0] & 0x3fff
+                continue
+            offset += 1
+            if not length:
+                return tuple(labels), offset if end is None else end
+            labels.append(data[offset:offset + length].decode('utf-8', 'replace'))
+            offset += length
+        raise ValueError('compression loop in name')
+
+    def build_query(self, questions):
+        packet = struct.pack('!HHHHHH', 0, 0, len(questions), 0, 0, 0)
+        for labels, qtype in questions:
+            packet += self.encode_name(labels) + struct.pack('!HH', qtype, 1)
+        return packet
+
+    def parse(self, data):
+        """Return the records of a response as (name, type, ttl, value) tuples"""
+        _, flags, questions, answers, authority, additional = struct.unpack('!HHHHHH', data[:12])
+        if not flags & 0x8000:
+            return []
+        offset = 12
+        for _ in range(questions):
+            offset = self.read_name(data, offset)[1] + 4
+        records = []
+        for _ in range(answers + authority + additional):
+            name, offset = self.read_name(data, offset)
+            rtype, _, ttl, length = struct.unpack('!HHIH', data[offset:offset + 10])
+            start = offset + 10
+            offset = start + length
+            rdata = data[start:offset]
+            if rtype == self.PTR:
+                value = self.read_name(data, start)[0]
+            elif rtype == self.SRV:
+                value = (struct.unpack('!H', rdata[4:6])[0], self.read_name(data, start + 6)[0])
+            elif rtype == self.TXT:
+                value = {}
+                i = 0
+                while i < len(rdata):
+                    item = rdata[i + 1:i + 1 + rdata[i]].decode('utf-8', 'replace')
+                    i += 1 + rdata[i]
+                    if item:
+                        key, _, val = item.partition('=')
+                        value[key] = val
+            elif rtype == self.A and length == 4:
+                value = socket.inet_ntoa(rdata)
+            elif rtype == self.AAAA and length == 16:
+                value = socket.inet_ntop(socket.AF_INET6, rdata)
+            else:
+                continue
+            records.append((name, rtype, ttl, value))
+        return records
+
+    def _absorb(self, records, interface, seen):
+        for name, rtype, ttl, value in records:
+            key = self._key(name)
+            if rtype == self.PTR:
+                if key in seen['ptr']:
+                    instances = seen['ptr'][key]
+                    if ttl:
+                        instances[self._key(value)] = (value, ttl, interface)
+                    else:
+                        # TTL 0 is a goodbye
+                        instances.pop(self._key(value), None)
+            elif rtype == self.SRV:
+                seen['srv'][key] = (value, ttl)
+            elif rtype == self.TXT:
+                seen['txt'][key] = (value, ttl)
+            elif ttl:
+                seen['addr'].setdefault(key, {})[value] = ttl
+            elif key in seen['addr']:
+                seen['addr'][key].pop(value, None)
+                if not seen['addr'][key]:
+                    # Every address said goodbye, ask again
+                    del seen['addr'][key]
+
+    def _followups(self, seen):
+        """Questions for whatever is still unresolved"""
+        questions = []
+        for type_key, instances in seen['ptr'].items():
+            if not instances:
+                questions.append((type_key, self.PTR))
+            for key, (name, _, _) in instances.items():
+                if key not in seen['srv']:
+                    questions.append((name, self.SRV))
+                if key not in seen['txt']:
+                    questions.append((name, self.TXT))
+                if key in seen['srv'] and self._key(seen['srv'][key][0][1]) not in seen['addr']:
+                    questions.append((seen['srv'][key][0][1], self.A))
+        return list(dict.fromkeys(questions))
+
+    def _entries(self, type_key, seen):
+        entries = []
+        for key, (name, ttl, interface) in seen['ptr'][type_key].items():
+            ttls = [ttl]
+            entry = {
+                'name': '.'.join(name),
+                'instance': name[0],
+                'type': '.'.join(name[1:-1]),
+                'host': None,
+                'port': None,
+                'addresses': [],
+                'txt': {},
+                'interface': interface,
+            }
+            if key in seen['srv']:
+                (entry['port'], host), srv_ttl = seen['srv'][key]
+                entry['host'] = '.'.join(host)
+                ttls.append(srv_ttl)
+                addresses = seen['addr'].get(self._key(host), {})
+                entry['addresses'] = sorted(addresses)
+                ttls.extend(addresses.values())
+            if key in seen['txt']:
+                entry['txt'], txt_ttl = seen['txt'][key]
+                ttls.append(txt_ttl)
+            entry['ttl'] = min(ttls)
+            entry['expires'] = time.time() + entry['ttl']
+            entries.append(entry)
+        return entries
+
+    def _resolved(self, seen):
+        return all(seen['ptr'].values()) and not self._followups(seen)
+
+    def _sockets(self):
+        wanted = self.interfaces
+        sockets = []
+        for interface in network_interfaces(loopback=bool(wanted)):
+            if wanted and interface['name'] not in wanted:
+                continue
+            if not wanted and not (interface['up'] and interface['multicast']):
+                continue
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface['address']))
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+                sock.bind((interface['address'], 0))
+                sock.setblocking(False)
+            except OSError as e:
+                sock.close()
+                print(f"{Colors.WARNING}⚠ Cannot query mDNS on {interface['name']}: {e}{Colors.ENDC}")
+                continue
+            sockets.append((interface['name'], sock))
+        return sockets
+
+    async def async_browse(self, service_types=None, refresh=False):
+        """Return the services of the given types, from the cache while their TTLs last"""
+        types = [tuple(t.split('.')) for t in (service_types or self.service_types)]
+        now = time.monotonic()
+        if not refresh and all(self._key(t) in self.cache and self.cache[self._key(t)][0] > now for t in types):
+            return [entry for t in types for entry in self.cache[self._key(t)][1]]
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        transports = []
+        for name, sock in self._sockets():
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda name=name: MDNSProtocol(name, queue), sock=sock)
+            transports.append(transport)
+        if not transports:
+            return None
+        seen = {'ptr': {self._key(t): {} for t in types}, 'srv': {}, 'txt': {}, 'addr': {}}
+        try:
+            start = loop.time()
+            deadline = start + self.timeout
+            interval = self.timeout / 4
+            next_send = start
+            last_packet = None
+            asked = set()
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                if last_packet and now - last_packet >= self.settle and self._resolved(seen):
+                    break
+                if now >= next_send:
+                    # Initial query, then periodic retransmits of everything unanswered
+                    questions = self._followups(seen) if asked else [(t, self.PTR) for t in types]
+                    next_send = now + interval
+                else:
+                    # Ask for newly discovered names right away
+                    questions = [q for q in self._followups(seen) if q not in asked]
+                if questions:
+                    asked.update(questions)
+                    packet = self.build_query(questions)
+                    for transport in transports:
+                        transport.sendto(packet, (self.group, self.port))
+                wait = min(deadline, next_send) - now
+                if last_packet:
+                    wait = min(wait, max(last_packet + self.settle - now, 0.01))
+                try:
+                    interface, data, _ = await asyncio.wait_for(queue.get(), wait)
+                except asyncio.TimeoutError:
+                    continue
+                try:
+                    records = self.parse(data)
+                except (ValueError, IndexError, struct.error, OSError):
+                    continue
+                if records:
+                    last_packet = loop.time()
+                    self._absorb(records, interface, seen)
+        finally:
+            for transport in transports:
+                transport.close()
+        entries = []
+        now = time.monotonic()
+        for t in types:
+            found = self._entries(self._key(t), seen)
+            if found:
+                self.cache[self._key(t)] = (now + min(e['ttl'] for e in found), found)
+            else:
+                self.cache.pop(self._key(t), None)
+            entries.extend(found)
+        return entries
+
+    def browse(self, service_types=None, refresh=False):
+        return asyncio.run(self.async_browse(service_types, refresh))
+
+    @staticmethod
+    def print_services(services, indent=''):
+        for service in services:
+            where = f"{service['host']}:{service['port']}" if service['host'] else 'unresolved'
+            addresses = ', '.join(service['addresses'])
+            model = service['txt'].get('model') or service['txt'].get('am')
+            print(f"{indent}{service['instance']}  [{service['type']}]  {where}"
+                  f"{f'  ({addresses})' if addresses else ''}{f'  {model}' if model else ''}"
+                  f"  via {service['interface']}, ttl {service['ttl']}s")
 
 class iOSAccess:
-    def __init__(self):
-        self.check_and_install_dependencies()
-        self.setup_usbmuxd()
-    
-    def check_and_install_dependencies(self):
-        """Check and install iOS tools automatically"""
-        tools = {
-            'idevice_id': 'libimobiledevice-utils',
-            'ideviceinfo': 'libimobiledevice-utils',
-            'idevicescreenshot': 'libimobiledevice-utils',
-            'idevicepair': 'libimobiledevice-utils',
-            'ifuse': 'ifuse',
-            'idevicebackup2': 'libimobiledevice-utils'
-        }
-        
-        missing = []
-        for tool, package in tools.items():
-            result = run_command(['which', tool])
-            if not result or result.returncode != 0:
-                if package not in missing:
-                    missing.append(package)
+    def __init__(self, lazy_services=True, registry=None, info_ttl=60, use_usbmux=True,
+                 usbmux_path='/var/run/usbmuxd', install=True):
+        self.usbmuxd_ready = False
+        self.usbmux = UsbmuxClient(usbmux_path) if use_usbmux else None
+        self._usbmux_checked = False
+        self.lockdown_sessions = {}
+        self.lockdown_lock = threading.Lock()
+        # udid -> monotonic time until which lockdownd is not retried for that device
+        self.lockdown_failures = {}
+        self.airplay_ready = False
+        self.info_ttl = info_ttl
+        self.info_cache = {}
+        self.registry = registry
+        self.airplay_browser = MDNSBrowser()
+        if registry:
+            registry.subscribe(self._on_device_event)
+        self.check_and_install_dependencies(install)
+        if not lazy_services:
+            self.ensure_usbmuxd()
+            self.ensure_airplay()
+    
+    def _on_device_event(self, event, platform, device_id, record):
+        if platform == 'ios':
+            # udid=None entries refer to "the first device", which may have changed too
+            self.info_cache.pop(device_id, None)
+            self.info_cache.pop(None, None)
+            self.lockdown_failures.pop(device_id, None)
+            if event == 'detached':
+                self.close_session(device_id)
+    
+    def usbmux_server(self):
+        """Return the usbmuxd client if its socket answers, else None"""
+        if self.usbmux and not self._usbmux_checked:
+            self._usbmux_checked = True
+            try:
+                self.usbmux.devices()
+            except UsbmuxError:
+                print(f"{Colors.WARNING}usbmuxd not reachable, falling back to libimobiledevice tools{Colors.ENDC}")
+                self.usbmux = None
+        return self.usbmux
+    
+    def _usbmux_failed(self, error):
+        print(f"{Colors.WARNING}usbmuxd request failed ({error}), falling back to libimobiledevice tools{Colors.ENDC}")
+        self._usbmux_checked = False
+    
+    def _lockdown_failed(self, udid, error):
+        """Use the tools for one device that lockdownd refused, usbmuxd itself is fine"""
+        print(f"{Colors.WARNING}⚠ lockdown on {udid} failed ({error}), using libimobiledevice tools{Colors.ENDC}")
+        self.lockdown_failures[udid] = time.monotonic() + self.info_ttl
+    
+    def _native_udids(self):
+        """UDIDs straight from usbmuxd, or None if the tools have to be asked"""
+        usbmux = self.usbmux_server()
+        if usbmux:
+            try:
+                return usbmux.udids()
+            except UsbmuxError as e:
+                self._usbmux_failed(e)
+        return None
+    
+    def lockdown(self, udid=None):
+        """Return the kept-open lockdownd session for a device, or None without usbmuxd"""
+        if udid is None:
+            udids = self._native_udids()
+            if not udids:
+                return None
+            udid = udids[0]
+        with self.lockdown_lock:
+            client = self.lockdown_sessions.get(udid)
+            if client is None:
+                client = self.lockdown_sessions[udid] = LockdownClient(udid, self.usbmux)
+            return client
+    
+    def close_session(self, udid=None):
+        """Close the lockdownd session of one device, or all with udid=None"""
+        with self.lockdown_lock:
+            if udid is None:
+                clients = list(self.lockdown_sessions.values())
+                self.lockdown_sessions.clear()
+                self.lockdown_failures.clear()
+            else:
+                clients = [self.lockdown_sessions.pop(udid)] if udid in self.lockdown_sessions else []
+                self.lockdown_failures.pop(udid, None)
+        for client in clients:
+            with client.lock:
+                client.close()
+    
+    def _native_properties(self, udid):
+        """Lockdown values over a kept-open session, or None to fall back to ideviceinfo"""
+        if not self.usbmux_server():
+            return None
+        client = self.lockdown(udid)
+        if client is None or self.lockdown_failures.get(client.udid, 0) > time.monotonic():
+            return None
+        try:
+            properties = dict(client.get_value() or {})
+            for domain in self.INFO_DOMAINS:
+                values = client.get_value(domain=domain)
+                if isinstance(values, dict):
+                    properties.update(values)
+            return properties
+        except LockdownError as e:
+            error = e
+        # Tell an unpaired, locked or unplugged device apart from usbmuxd going away
+        try:
+            self.usbmux.devices()
+        except UsbmuxError as e:
+            self._usbmux_failed(e)
+            return None
+        self._lockdown_failed(client.udid, error)
+        return None
+    
+    def ensure_usbmuxd(self):
+        """Set up usbmuxd the first time a device feature needs it"""
+        if not self.usbmuxd_ready:
+            self.setup_usbmuxd()
+            self.usbmuxd_ready = True
+    
+    def ensure_airplay(self):
+        """Set up Avahi and the firewall the first time an AirPlay feature needs them"""
+        if not self.airplay_ready:
+            self.setup_airplay()
+            self.airplay_ready = True
+    
+    def check_and_install_dependencies(self, install=True):
+        """Check and install iOS tools automatically, or only report them when install is off"""
+        missing = InstallPlanner().missing_tools(['ios'])
         
-        if missing:
-            print(f"{Colors.WARNING}Missing iOS tools. Installing...{Colors.ENDC}")
-            self.install_dependencies(missing)
+        if missing and not install:
+            print(f"{Colors.WARNING}⚠ Missing iOS tools ({', '.join(missing)}){Colors.ENDC}")
+        elif missing:
+            print(f"{Colors.WARNING}Missing iOS tools ({', '.join(missing)}). Installing...{Colors.ENDC}")
+            self.install_dependencies()
         else:
             print(f"{Colors.OKGREEN}✓ All iOS tools already installed{Colors.ENDC}")
     
     def install_dependencies(self, packages=None):
-        """Install libimobiledevice and related tools"""
+        """Install libimobiledevice and related tools
+
+        Everything missing for iOS is installed in one apt transaction, along
+        with any extra packages given.
+        """
         print(f"{Colors.OKCYAN}Installing iOS tools...{Colors.ENDC}")
         
-        # Update package list
-        print("Updating package list...")
-        run_command(['sudo', 'apt-get', 'update', '-y'])
-        
-        # Add universe repository
-        print("Adding universe repository...")
-        run_command(['sudo', 'add-apt-repository', '-y', 'universe'])
-        run_command(['sudo', 'apt-get', 'update', '-y'])
-        
-        # Install all iOS tools including Avahi
-        packages_to_install = [
-            'libimobiledevice-utils',
-            'libimobiledevice6',
-            'usbmuxd',
-            'libusbmuxd-tools',
-            'ifuse',
-            'avahi-daemon',
-            'avahi-utils',
-            'gstreamer1.0-tools',
-            'gstreamer1.0-plugins-base',
-            'gstreamer1.0-plugins-good',
-            'gstreamer1.0-plugins-bad'
-        ]
-        
-        print(f"Installing packages: {', '.join(packages_to_install)}")
-        result = run_command(['sudo', 'apt-get', 'install', '-y'] + packages_to_install)
-        
-        if result and result.returncode == 0:
+        if InstallPlanner().ensure(['ios'], packages or ()):
             print(f"{Colors.OKGREEN}✓ iOS tools installed successfully!{Colors.ENDC}")
         else:
             print(f"{Colors.FAIL}✗ Some packages may have failed to install{Colors.ENDC}")
@@ -253,25 +3698,33 @@ class iOSAccess:
         """Setup and start usbmuxd service"""
         print(f"{Colors.OKCYAN}Setting up usbmuxd service...{Colors.ENDC}")
         
-        # Restart usbmuxd
-        run_command(['sudo', 'systemctl', 'restart', 'usbmuxd'])
-        run_command(['sudo', 'systemctl', 'enable', 'usbmuxd'])
+        # Only restart usbmuxd if it is not already running
+        if not service_active('usbmuxd'):
+            run_command(['sudo', 'systemctl', 'restart', 'usbmuxd'])
+            run_command(['sudo', 'systemctl', 'enable', 'usbmuxd'])
         
         # Check if running
-        result = run_command(['systemctl', 'is-active', 'usbmuxd'])
-        if result and 'active' in result.stdout:
+        if service_active('usbmuxd'):
             print(f"{Colors.OKGREEN}✓ usbmuxd service is running{Colors.ENDC}")
         else:
             print(f"{Colors.WARNING}⚠ usbmuxd may not be running properly{Colors.ENDC}")
         
+        # Add user to plugdev group
+        username = os.environ.get('USER')
+        if username:
+            print(f"Adding {username} to plugdev group...")
+            run_command(['sudo', 'usermod', '-a', '-G', 'plugdev', username])
+    
+    def setup_airplay(self):
+        """Setup Avahi daemon and firewall for AirPlay"""
         # Setup and start Avahi daemon for AirPlay discovery
         print(f"{Colors.OKCYAN}Setting up Avahi daemon (required for AirPlay)...{Colors.ENDC}")
-        run_command(['sudo', 'systemctl', 'restart', 'avahi-daemon'])
-        run_command(['sudo', 'systemctl', 'enable', 'avahi-daemon'])
+        if not service_active('avahi-daemon'):
+            run_command(['sudo', 'systemctl', 'restart', 'avahi-daemon'])
+            run_command(['sudo', 'systemctl', 'enable', 'avahi-daemon'])
         
         # Check if Avahi is running
-        result = run_command(['systemctl', 'is-active', 'avahi-daemon'])
-        if result and 'active' in result.stdout:
+        if service_active('avahi-daemon'):
             print(f"{Colors.OKGREEN}✓ Avahi daemon is running{Colors.ENDC}")
         else:
             print(f"{Colors.WARNING}⚠ Avahi daemon may not be running properly{Colors.ENDC}")
@@ -279,18 +3732,11 @@ class iOSAccess:
         # Configure firewall for AirPlay
         print(f"{Colors.OKCYAN}Configuring firewall for AirPlay...{Colors.ENDC}")
         self.configure_firewall()
-        
-        # Add user to plugdev group
-        username = os.environ.get('USER')
-        if username:
-            print(f"Adding {username} to plugdev group...")
-            run_command(['sudo', 'usermod', '-a', '-G', 'plugdev', username])
     
     def configure_firewall(self):
         """Configure firewall to allow AirPlay connections"""
         # Check if ufw is installed
-        result = run_command(['which', 'ufw'])
-        if not result or result.returncode != 0:
+        if not find_tool('ufw'):
             print(f"{Colors.WARNING}UFW not installed, skipping firewall configuration{Colors.ENDC}")
             return
         
@@ -323,8 +3769,7 @@ class iOSAccess:
     
     def check_uxplay(self):
         """Check if UxPlay is installed"""
-        result = run_command(['which', 'uxplay'])
-        return result and result.returncode == 0
+        return find_tool('uxplay') is not None
     
     def install_uxplay_guide(self):
         """Guide for installing UxPlay"""
@@ -341,69 +3786,28 @@ class iOSAccess:
         """Automatically install UxPlay"""
         print(f"{Colors.OKCYAN}Installing UxPlay dependencies...{Colors.ENDC}")
         
-        # Install dependencies
-        deps = [
-            'cmake', 'pkg-config', 'libavahi-compat-libdnssd-dev',
-            'libplist-dev', 'libssl-dev', 'libgstreamer1.0-dev',
-            'libgstreamer-plugins-base1.0-dev', 'git'
-        ]
-        
-        run_command(['sudo', 'apt-get', 'update', '-y'])
-        result = run_command(['sudo', 'apt-get', 'install', '-y'] + deps)
-        
-        if not result or result.returncode != 0:
+        # Install build dependencies, header packages are checked even if the tools exist
+        if not InstallPlanner().ensure(['uxplay'], thorough=True):
             print(f"{Colors.FAIL}✗ Failed to install dependencies{Colors.ENDC}")
             return False
         
-        print(f"{Colors.OKCYAN}Cloning and building UxPlay...{Colors.ENDC}")
-        
-        # Clone UxPlay
-        uxplay_dir = os.path.expanduser('~/UxPlay')
-        if os.path.exists(uxplay_dir):
-            print(f"Removing old UxPlay directory...")
-            run_command(['rm', '-rf', uxplay_dir])
-        
-        os.chdir(os.path.expanduser('~'))
-        result = run_command(['git', 'clone', 'https://github.com/FDH2/UxPlay'])
-        
-        if not result or result.returncode != 0:
-            print(f"{Colors.FAIL}✗ Failed to clone UxPlay{Colors.ENDC}")
-            return False
-        
-        # Build UxPlay
-        os.chdir(uxplay_dir)
-        os.makedirs('build', exist_ok=True)
-        os.chdir('build')
-        
-        print("Running cmake...")
-        if not run_command(['cmake', '..']):
-            print(f"{Colors.FAIL}✗ cmake failed{Colors.ENDC}")
-            return False
-        
-        print("Running make...")
-        if not run_command(['make']):
-            print(f"{Colors.FAIL}✗ make failed{Colors.ENDC}")
-            return False
-        
-        print("Installing UxPlay...")
-        if not run_command(['sudo', 'make', 'install']):
-            print(f"{Colors.FAIL}✗ Installation failed{Colors.ENDC}")
-            return False
-        
-        print(f"{Colors.OKGREEN}✓ UxPlay installed successfully!{Colors.ENDC}")
-        
-        # Return to original directory
-        os.chdir(os.path.expanduser('~'))
-        return True
+        print(f"{Colors.OKCYAN}Building UxPlay...{Colors.ENDC}")
+        return UxPlayBuilder().build()
     
     def list_devices(self):
         """List connected iOS devices"""
-        result = run_command(['idevice_id', '-l'])
+        self.ensure_usbmuxd()
+        udids = self._native_udids()
+        if udids is None:
+            result = run_command(['idevice_id', '-l'])
+            output = result.stdout if result else ''
+        else:
+            output = ''.join(f"{udid}\n" for udid in udids)
         
         print(f"\n{Colors.OKBLUE}Connected iOS Devices:{Colors.ENDC}")
-        if result and result.stdout.strip():
-            print(result.stdout)
-            return result.stdout
+        if output.strip():
+            print(output)
+            return output
         else:
             print(f"{Colors.WARNING}No iOS devices found{Colors.ENDC}")
             print(f"{Colors.OKCYAN}Make sure:")
@@ -412,48 +3816,171 @@ class iOSAccess:
             print(f"  3. You tapped 'Trust' on the device{Colors.ENDC}")
             return None
     
-    def device_info(self, udid=None):
-        """Get iOS device information"""
-        print(f"\n{Colors.OKBLUE}iOS Device Information:{Colors.ENDC}")
-        
-        cmd = ['ideviceinfo']
+    def device_ids(self):
+        """Return UDIDs of connected devices without printing"""
+        self.ensure_usbmuxd()
+        if self.registry and self.registry.is_synced('ios'):
+            return self.registry.ids('ios', 'attached')
+        udids = self._native_udids()
+        if udids is not None:
+            return udids
+        result = run_command(['idevice_id', '-l'])
+        if not result or result.returncode != 0:
+            return []
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+    
+    async def async_device_ids(self, timeout=30):
+        """Asyncio version of device_ids()"""
+        self.ensure_usbmuxd()
+        if self.registry and self.registry.is_synced('ios'):
+            return self.registry.ids('ios', 'attached')
+        udids = await asyncio.get_running_loop().run_in_executor(None, self._native_udids)
+        if udids is not None:
+            return udids
+        result = await async_run_command(['idevice_id', '-l'], timeout)
+        if not result or result.returncode != 0:
+            return []
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+    
+    def _udid_command(self, tool, udid, *args):
+        cmd = [tool]
         if udid:
             cmd.extend(['-u', udid])
-        
-        result = run_command(cmd)
-        
-        if result and result.returncode == 0:
-            lines = result.stdout.split('\n')
-            important_fields = ['DeviceName', 'ProductType', 'ProductVersion', 
-                              'ModelNumber', 'SerialNumber', 'WiFiAddress',
-                              'BluetoothAddress', 'BatteryCurrentCapacity']
-            
-            for line in lines:
-                for field in important_fields:
-                    if field in line:
-                        print(line)
+        return cmd + list(args)
+    
+    IMPORTANT_FIELDS = ['DeviceName', 'ProductType', 'ProductVersion',
+                        'ModelNumber', 'SerialNumber', 'WiFiAddress',
+                        'BluetoothAddress', 'BatteryCurrentCapacity']
+    # Queried in addition to the default lockdown domain
+    INFO_DOMAINS = ['com.apple.mobile.battery']
+    
+    def _info_commands(self, udid):
+        commands = [self._udid_command('ideviceinfo', udid, '-x')]
+        for domain in self.INFO_DOMAINS:
+            commands.append(self._udid_command('ideviceinfo', udid, '-x', '-q', domain))
+        return commands
+    
+    def _store_properties(self, udid, results):
+        if not results[0] or results[0].returncode != 0:
+            return None
+        properties = {}
+        for result in results:
+            if result and result.returncode == 0:
+                properties.update(parse_ideviceinfo(result.stdout))
+        return self._cache_properties(udid, properties)
+    
+    def _cache_properties(self, udid, properties):
+        self.info_cache[udid] = (time.monotonic(), properties)
+        return properties
+    
+    def _cached_properties(self, udid, refresh):
+        cached = self.info_cache.get(udid)
+        if cached and not refresh and time.monotonic() - cached[0] < self.info_ttl:
+            return cached[1]
+        return None
+    
+    def device_properties(self, udid=None, refresh=False):
+        """Return every lockdown value of a device as a typed dict, cached for info_ttl seconds"""
+        properties = self._cached_properties(udid, refresh)
+        if properties is not None:
+            return properties
+        self.ensure_usbmuxd()
+        properties = self._native_properties(udid)
+        if properties is not None:
+            return self._cache_properties(udid, properties)
+        return self._store_properties(udid, [run_command(cmd) for cmd in self._info_commands(udid)])
+    
+    async def async_device_properties(self, udid=None, refresh=False, timeout=30):
+        """Asyncio version of device_properties()"""
+        properties = self._cached_properties(udid, refresh)
+        if properties is not None:
+            return properties
+        self.ensure_usbmuxd()
+        properties = await asyncio.get_running_loop().run_in_executor(None, self._native_properties, udid)
+        if properties is not None:
+            return self._cache_properties(udid, properties)
+        results = await asyncio.gather(*(async_run_command(cmd, timeout) for cmd in self._info_commands(udid)))
+        return self._store_properties(udid, results)
+    
+    def invalidate_info(self, udid=None):
+        """Drop cached device properties for one device, or all with udid=None"""
+        if udid is None:
+            self.info_cache.clear()
+        else:
+            self.info_cache.pop(udid, None)
+    
+    def query(self, fields, udids=None, refresh=False, max_workers=8):
+        """Return {udid: {field: value}} for many devices, fetching only uncached ones
+
+        Missing fields are None. Devices that could not be queried are omitted.
+        """
+        udids = self.device_ids() if udids is None else udids
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(udids) or 1))) as pool:
+            properties = dict(zip(udids, pool.map(lambda u: self.device_properties(u, refresh), udids)))
+        return {udid: {field: props.get(field) for field in fields}
+                for udid, props in properties.items() if props is not None}
+    
+    def device_info(self, udid=None, refresh=False):
+        """Get iOS device information"""
+        print(f"\n{Colors.OKBLUE}iOS Device Information:{Colors.ENDC}")
+        return self._report_device_info(self.device_properties(udid, refresh))
+    
+    async def async_device_info(self, udid=None, refresh=False, timeout=30):
+        """Asyncio version of device_info()"""
+        print(f"\n{Colors.OKBLUE}iOS Device Information:{Colors.ENDC}")
+        return self._report_device_info(await self.async_device_properties(udid, refresh, timeout))
+    
+    def _report_device_info(self, properties):
+        if properties:
+            for field in self.IMPORTANT_FIELDS:
+                if field in properties:
+                    print(f"{field}: {properties[field]}")
+            return properties
         else:
             print(f"{Colors.FAIL}✗ Error getting device info. Make sure device is trusted.{Colors.ENDC}")
+            return None
     
-    def screenshot(self, output_file='ios_screenshot.png', udid=None):
-        """Take a screenshot of iOS device"""
+    def screenshot(self, output_file='ios_screenshot.png', udid=None, store=None):
+        """Take a screenshot of iOS device
+
+        With a ChunkStore as store, the image goes into its 'screenshots'
+        snapshot under output_file instead of onto disk.
+        """
+        self.ensure_usbmuxd()
         print(f"\n{Colors.OKGREEN}Taking iOS screenshot...{Colors.ENDC}")
+        if not store:
+            result = run_command(self._udid_command('idevicescreenshot', udid, output_file))
+            return self._report_screenshot(result, output_file)
         
-        cmd = ['idevicescreenshot']
-        if udid:
-            cmd.extend(['-u', udid])
-        cmd.append(output_file)
-        
-        result = run_command(cmd)
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_file = os.path.join(tmp, os.path.basename(output_file))
+            result = run_command(self._udid_command('idevicescreenshot', udid, tmp_file))
+            if not result or result.returncode != 0:
+                return self._report_screenshot(result, output_file)
+            with open(tmp_file, 'rb') as f:
+                store.print_ingest(output_file, store.put_bytes('screenshots', output_file, f.read()))
+        return True
+    
+    async def async_screenshot(self, output_file='ios_screenshot.png', udid=None, timeout=30):
+        """Asyncio version of screenshot()"""
+        self.ensure_usbmuxd()
+        print(f"\n{Colors.OKGREEN}Taking iOS screenshot...{Colors.ENDC}")
+        result = await async_run_command(self._udid_command('idevicescreenshot', udid, output_file), timeout)
+        return self._report_screenshot(result, output_file)
+    
+    def _report_screenshot(self, result, output_file):
         if result and result.returncode == 0:
             print(f"{Colors.OKGREEN}✓ Screenshot saved to {output_file}{Colors.ENDC}")
+            return True
         else:
             print(f"{Colors.FAIL}✗ Failed to take screenshot{Colors.ENDC}")
             if result and result.stderr:
                 print(f"{Colors.FAIL}Error: {result.stderr}{Colors.ENDC}")
+            return False
     
     def screen_mirror_airplay(self):
         """Mirror iOS screen using AirPlay (UxPlay)"""
+        self.ensure_airplay()
         if not self.check_uxplay():
             print(f"{Colors.WARNING}UxPlay is not installed{Colors.ENDC}")
             response = input(f"{Colors.OKCYAN}Install UxPlay now? (y/n): {Colors.ENDC}")
@@ -513,6 +4040,7 @@ Press Ctrl+C to stop screen mirroring
     
     def mount_device(self, mount_point='/tmp/iphone'):
         """Mount iOS device filesystem"""
+        self.ensure_usbmuxd()
         print(f"\n{Colors.OKGREEN}Mounting iOS device...{Colors.ENDC}")
         
         os.makedirs(mount_point, exist_ok=True)
@@ -526,27 +4054,65 @@ Press Ctrl+C to stop screen mirroring
         else:
             print(f"{Colors.FAIL}✗ Failed to mount device{Colors.ENDC}")
     
-    def backup_device(self, backup_path='./ios_backup'):
-        """Create iOS device backup"""
-        print(f"\n{Colors.OKGREEN}Creating iOS backup...{Colors.ENDC}")
-        print(f"{Colors.WARNING}This may take several minutes depending on device size{Colors.ENDC}")
-        
-        os.makedirs(backup_path, exist_ok=True)
+    def export_files(self, dest='./ios_export', mount_point='/tmp/iphone', subdir='DCIM', workers=8):
+        """Copy files out of an ifuse mount in parallel, skipping unchanged ones"""
+        source = os.path.join(mount_point, subdir) if subdir else mount_point
+        if not os.path.isdir(source):
+            print(f"{Colors.FAIL}✗ {source} not found. Mount the device first.{Colors.ENDC}")
+            return None
         
-        cmd = ['idevicebackup2', 'backup', backup_path]
-        result = run_command(cmd, capture=False)
+        print(f"\n{Colors.OKGREEN}Exporting {source} to {dest}...{Colors.ENDC}")
+        try:
+            stats = TreeExporter(workers).export(source, dest)
+        except KeyboardInterrupt:
+            print(f"\n{Colors.WARNING}Export interrupted, run again to resume{Colors.ENDC}")
+            return None
         
-        if result and result.returncode == 0:
-            print(f"{Colors.OKGREEN}✓ Backup completed successfully at {backup_path}{Colors.ENDC}")
+        print(f"{Colors.OKGREEN}✓ Copied {stats['copied']} files ({stats['skipped']} unchanged), "
+              f"{format_bytes(stats['bytes'])} in {stats['duration']:.1f}s: "
+              f"{stats['files_per_second']:.1f} files/s, {format_bytes(stats['bytes_per_second'])}/s{Colors.ENDC}")
+        if stats['failed']:
+            print(f"{Colors.WARNING}⚠ {stats['failed']} files failed, run again to retry{Colors.ENDC}")
+        return stats
+    
+    def backup_device(self, backup_path='./ios_backup', udid=None, timeout=None, store=None):
+        """Create iOS device backup
+
+        backup_path is a root directory; each device is backed up incrementally
+        into backup_path/<UDID> and every run is recorded in its manifest. With a
+        ChunkStore as store, each successful run is also kept as a snapshot there.
+        """
+        self.ensure_usbmuxd()
+        print(f"\n{Colors.OKGREEN}Creating iOS backup...{Colors.ENDC}")
+        print(f"{Colors.WARNING}This may take several minutes depending on device size{Colors.ENDC}")
+        run = BackupManager(self, backup_path, store=store).backup(udid, timeout)
+        return self._report_backup(run)
+    
+    async def async_backup_device(self, backup_path='./ios_backup', udid=None, timeout=None, store=None):
+        """Asyncio version of backup_device()"""
+        self.ensure_usbmuxd()
+        print(f"\n{Colors.OKGREEN}Creating iOS backup...{Colors.ENDC}")
+        run = await BackupManager(self, backup_path, store=store).async_backup(udid, timeout)
+        return self._report_backup(run)
+    
+    def _report_backup(self, run):
+        if run and run['success']:
+            kind = 'incremental' if run['incremental'] else 'full'
+            print(f"{Colors.OKGREEN}✓ Backup completed successfully at {run['path']} "
+                  f"({kind}, {format_bytes(run['bytes_changed'])} changed in {run['duration']:.1f}s){Colors.ENDC}")
+            return True
         else:
             print(f"{Colors.FAIL}✗ Backup failed{Colors.ENDC}")
+            return False
     
     def pair_device(self):
-        """Pair with iOS device"""
+        """Pair with iOS device, returns True once the pairing is validated"""
+        self.ensure_usbmuxd()
         print(f"\n{Colors.OKGREEN}Pairing with iOS device...{Colors.ENDC}")
         print(f"{Colors.WARNING}Make sure to tap 'Trust' on your device when prompted{Colors.ENDC}")
         
-        # First, unpair to reset
+        # First, unpair to reset; kept-open sessions belong to the old pair record
+        self.close_session()
         run_command(['idevicepair', 'unpair'])
         
         # Pair
@@ -557,80 +4123,1692 @@ Press Ctrl+C to stop screen mirroring
             
             # Validate
             time.sleep(1)
-            validate = run_command(['idevicepair', 'validate'])
-            if validate and 'SUCCESS' in validate.stdout:
+            client = self.lockdown() if self.usbmux_server() else None
+            if client:
+                validated = client.validate()
+            else:
+                validate = run_command(['idevicepair', 'validate'])
+                validated = bool(validate and 'SUCCESS' in validate.stdout)
+            if validated:
                 print(f"{Colors.OKGREEN}✓ Pairing validated!{Colors.ENDC}")
+            else:
+                print(f"{Colors.FAIL}✗ Pairing could not be validated{Colors.ENDC}")
+            return validated
         else:
             print(f"{Colors.FAIL}✗ Pairing failed. Make sure you tapped 'Trust' on your device{Colors.ENDC}")
+            return False
     
     def network_diagnostics(self):
         """Run network diagnostics for AirPlay troubleshooting"""
+        self.ensure_airplay()
         print(f"\n{Colors.OKBLUE}=== Network Diagnostics for AirPlay ==={Colors.ENDC}\n")
         
         # Check network interfaces
         print(f"{Colors.OKCYAN}1. Network Interfaces:{Colors.ENDC}")
-        result = run_command(['ip', 'addr', 'show'])
+        interfaces = network_interfaces()
+        for interface in interfaces:
+            state = 'UP' if interface['up'] else 'DOWN'
+            if not interface['multicast']:
+                state += ', no multicast'
+            print(f"   {interface['name']:12} {interface['address']}/{interface['prefix']}  ({state})")
+        if not interfaces:
+            print(f"   {Colors.FAIL}✗ No interface has an IPv4 address{Colors.ENDC}")
+        
+        # Check Avahi status
+        print(f"\n{Colors.OKCYAN}2. Avahi Daemon Status:{Colors.ENDC}")
+        result = run_command(['systemctl', 'is-active', 'avahi-daemon'])
+        if result and 'active' in result.stdout:
+            print(f"   {Colors.OKGREEN}✓ Avahi is running{Colors.ENDC}")
+        else:
+            print(f"   {Colors.FAIL}✗ Avahi is NOT running{Colors.ENDC}")
+            response = input(f"\n{Colors.OKCYAN}Start Avahi daemon? (y/n): {Colors.ENDC}")
+            if response.lower() == 'y':
+                run_command(['sudo', 'systemctl', 'start', 'avahi-daemon'])
+                print(f"   {Colors.OKGREEN}✓ Avahi started{Colors.ENDC}")
+        
+        # Check for AirPlay services
+        print(f"\n{Colors.OKCYAN}3. Scanning for AirPlay devices on network...{Colors.ENDC}")
+        services = self.airplay_browser.browse()
+        if services:
+            print(f"   {Colors.OKGREEN}✓ AirPlay services detected on network{Colors.ENDC}")
+            MDNSBrowser.print_services(services, indent='   ')
+        elif services is None:
+            print(f"   {Colors.WARNING}⚠ No multicast-capable interface to scan on{Colors.ENDC}")
+        else:
+            print(f"   {Colors.WARNING}⚠ No AirPlay services detected{Colors.ENDC}")
+        
+        # Check firewall status
+        print(f"\n{Colors.OKCYAN}4. Firewall Status:{Colors.ENDC}")
+        result = run_command(['sudo', 'ufw', 'status'])
         if result:
-            lines = result.stdout.split('\n')
-            for line in lines:
-                if 'inet ' in line and '127.0.0.1' not in line:
-                    print(f"   {line.strip()}")
+            if 'inactive' in result.stdout.lower():
+                print(f"   {Colors.OKGREEN}✓ Firewall is inactive (no blocking){Colors.ENDC}")
+            else:
+                print(f"   {Colors.WARNING}Firewall is active{Colors.ENDC}")
+                if '7000' in result.stdout and '5353' in result.stdout:
+                    print(f"   {Colors.OKGREEN}✓ AirPlay ports are open{Colors.ENDC}")
+                else:
+                    print(f"   {Colors.WARNING}⚠ AirPlay ports may be blocked{Colors.ENDC}")
+                    response = input(f"\n{Colors.OKCYAN}Open AirPlay ports? (y/n): {Colors.ENDC}")
+                    if response.lower() == 'y':
+                        self.configure_firewall()
+        
+        # Check if UxPlay is installed
+        print(f"\n{Colors.OKCYAN}5. UxPlay Status:{Colors.ENDC}")
+        if self.check_uxplay():
+            print(f"   {Colors.OKGREEN}✓ UxPlay is installed{Colors.ENDC}")
+        else:
+            print(f"   {Colors.FAIL}✗ UxPlay is NOT installed{Colors.ENDC}")
+        
+        # Recommendations
+        print(f"\n{Colors.OKBLUE}=== Recommendations ==={Colors.ENDC}")
+        print(f"""
+{Colors.OKCYAN}For successful AirPlay mirroring:{Colors.ENDC}
+1. Ensure iPhone and Linux are on the SAME WiFi network
+2. Make sure Avahi daemon is running (checked above)
+3. Ensure firewall allows AirPlay ports (checked above)
+4. When starting UxPlay, wait 10-15 seconds before checking iPhone
+5. On iPhone: Settings → WiFi → Verify network name matches Linux
+6. Try restarting UxPlay if device doesn't appear
+        """)
+        return {'interfaces': interfaces, 'services': services or []}
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+class ChunkStore:
+    """Content-addressed, deduplicating store for screenshots and backups
+
+    Files are split with content-defined chunking (a gear rolling hash), so an
+    edit only changes the chunks around it, and every chunk is stored once
+    under its SHA-256. Each ingest is recorded as a named snapshot that can be
+    restored later.
+    """
+    # 256 fixed pseudo-random 64-bit values for the gear hash
+    GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'little') for i in range(256)]
+    FICLONE = 0x40049409
+    READ_SIZE = 1024 * 1024
+    # Bytes hashed per NumPy pass when looking for cut points
+    SCAN_BLOCK = 256 * 1024
+
+    def __init__(self, root, min_size=16 * 1024, avg_size=64 * 1024, max_size=256 * 1024):
+        self.root = os.path.abspath(root)
+        self.chunk_dir = os.path.join(self.root, 'chunks')
+        self.snapshot_dir = os.path.join(self.root, 'snapshots')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.mask = (1 << max(avg_size.bit_length() - 1, 1)) - 1
+        # Only the masked low bits decide a cut, and those depend on the last `window` bytes alone
+        self.window = self.mask.bit_length()
+        self.gear_low = [g & self.mask for g in self.GEAR]
+        if np is not None:
+            dtype = np.uint16 if self.window <= 16 else np.uint32 if self.window <= 32 else np.uint64
+            self.gear_array = np.array(self.gear_low, dtype)
+        self.lock = threading.Lock()
+        self._files = None
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    # -- chunking
+    def _cut(self, data, start):
+        end = min(start + self.max_size, len(data))
+        i = start + self.min_size
+        if i >= end:
+            return end
+        h = 0
+        gear = self.gear_low
+        mask = self.mask
+        for byte in data[i:end]:
+            h = ((h << 1) + gear[byte]) & mask
+            i += 1
+            if not h:
+                return i
+        return end
+
+    def _candidates(self, data):
+        """Offsets where the gear hash over the preceding window bytes is zero, via NumPy
+
+        The windowed hash is built with log2(window) shifted adds, so this finds
+        the same cuts as _cut() except within window bytes of a chunk's hash start.
+        """
+        found = []
+        for pos in range(0, len(data), self.SCAN_BLOCK):
+            lead = min(pos, self.window - 1)
+            stop = min(pos + self.SCAN_BLOCK, len(data))
+            h = self.gear_array[np.frombuffer(data, np.uint8, stop - pos + lead, pos - lead)]
+            width = 1
+            while width < self.window:
+                h[width:] += h[:-width] << h.dtype.type(width)
+                width *= 2
+            if self.mask != np.iinfo(h.dtype).max:
+                h &= h.dtype.type(self.mask)
+            found.append(np.flatnonzero(h[lead:] == 0) + (pos + 1))
+        return np.concatenate(found) if found else np.zeros(0, np.int64)
+
+    def _ends(self, data, final=True):
+        """Chunk end offsets in data; unless final, stop where more data could still move a cut"""
+        ends = []
+        start = 0
+        if np is None:
+            while start < len(data) and (final or start + self.max_size <= len(data)):
+                start = self._cut(data, start)
+                ends.append(start)
+            return ends
+        
+        candidates = self._candidates(data)
+        gear = self.gear_low
+        mask = self.mask
+        while start < len(data) and (final or start + self.max_size <= len(data)):
+            end = min(start + self.max_size, len(data))
+            head = min(start + self.min_size + self.window - 1, end)
+            # The hash restarts at min_size, so the first window bytes cover less than a window
+            cut = None
+            h = 0
+            for i in range(start + self.min_size, head):
+                h = ((h << 1) + gear[data[i]]) & mask
+                if not h:
+                    cut = i + 1
+                    break
+            if cut is None:
+                k = int(np.searchsorted(candidates, head + 1))
+                cut = int(candidates[k]) if k < len(candidates) and candidates[k] <= end else end
+            ends.append(cut)
+            start = cut
+        return ends
+
+    def chunks(self, data):
+        """Yield the content-defined chunks of data"""
+        view = memoryview(data)
+        start = 0
+        for end in self._ends(data):
+            yield view[start:end]
+            start = end
+
+    def chunk_file(self, f):
+        """Yield the chunks of an open binary file, reading READ_SIZE at a time"""
+        pending = b''
+        while True:
+            block = f.read(self.READ_SIZE)
+            data = pending + block
+            view = memoryview(data)
+            start = 0
+            for end in self._ends(data, final=not block):
+                yield view[start:end]
+                start = end
+            if not block:
+                return
+            # The unfinished tail is chunked again together with the next read
+            pending = data[start:]
+
+    # -- storage
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def _put_chunk(self, chunk):
+        """Store a chunk if it is new, returns (digest, bytes written)"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(chunk)
+        os.replace(tmp, path)
+        return digest, len(chunk)
+
+    @property
+    def files(self):
+        """Whole-file digest -> chunk list index, so identical files skip chunking"""
+        if self._files is None:
+            try:
+                with open(os.path.join(self.root, 'files.json')) as f:
+                    self._files = json.load(f)
+            except (OSError, ValueError):
+                self._files = {}
+        return self._files
+
+    def _save_json(self, path, data):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _put_data(self, data):
+        """Store file content, returns (file digest, new bytes stored)"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            known = digest in self.files
+        if known:
+            return digest, 0
+        chunk_list = []
+        written = 0
+        for chunk in self.chunks(data):
+            chunk_digest, size = self._put_chunk(chunk)
+            chunk_list.append(chunk_digest)
+            written += size
+        with self.lock:
+            self.files[digest] = chunk_list
+        return digest, written
+
+    def _put_file(self, path):
+        """Store a file without loading it whole, returns (file digest, size, new bytes stored)"""
+        with open(path, 'rb') as f:
+            whole = hashlib.sha256()
+            while True:
+                block = f.read(self.READ_SIZE)
+                if not block:
+                    break
+                whole.update(block)
+            with self.lock:
+                known = whole.hexdigest() in self.files
+            if known:
+                return whole.hexdigest(), f.tell(), 0
+            
+            f.seek(0)
+            # Hash again while chunking in case the file changed since the first pass
+            whole = hashlib.sha256()
+            chunk_list = []
+            size = written = 0
+            for chunk in self.chunk_file(f):
+                whole.update(chunk)
+                chunk_digest, new_bytes = self._put_chunk(chunk)
+                chunk_list.append(chunk_digest)
+                size += len(chunk)
+                written += new_bytes
+        digest = whole.hexdigest()
+        with self.lock:
+            self.files[digest] = chunk_list
+        return digest, size, written
+
+    def load_snapshot(self, name):
+        try:
+            with open(os.path.join(self.snapshot_dir, f"{name}.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _commit(self, name, entries):
+        with self.lock:
+            snapshot = self.load_snapshot(name)
+            snapshot.update(entries)
+            self._save_json(os.path.join(self.snapshot_dir, f"{name}.json"), snapshot)
+            self._save_json(os.path.join(self.root, 'files.json'), self.files)
+
+    def put_bytes(self, snapshot, path, data, mtime=None, mode=0o644):
+        """Store in-memory content as path inside snapshot"""
+        start = time.monotonic()
+        digest, written = self._put_data(data)
+        entry = {'digest': digest, 'size': len(data), 'mtime': mtime or time.time(), 'mode': mode}
+        self._commit(snapshot, {path: entry})
+        return self._ingest_stats(len(data), written, 1, time.monotonic() - start)
+
+    def ingest_tree(self, snapshot, source):
+        """Store a file or directory tree as snapshot, returns ingest statistics"""
+        start = time.monotonic()
+        entries = {}
+        logical = written = 0
+        if os.path.isfile(source):
+            walk = [(os.path.dirname(source), [], [os.path.basename(source)])]
+            base = os.path.dirname(source)
+        else:
+            walk = os.walk(source)
+            base = source
+        for dirpath, _, filenames in walk:
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                    digest, size, new_bytes = self._put_file(full)
+                except OSError as e:
+                    print(f"{Colors.WARNING}⚠ Skipping {full}: {e}{Colors.ENDC}")
+                    continue
+                entries[os.path.relpath(full, base)] = {
+                    'digest': digest, 'size': size,
+                    'mtime': st.st_mtime, 'mode': st.st_mode & 0o7777,
+                }
+                logical += size
+                written += new_bytes
+        self._commit(snapshot, entries)
+        return self._ingest_stats(logical, written, len(entries), time.monotonic() - start)
+
+    @staticmethod
+    def _ingest_stats(logical, written, files, duration):
+        return {
+            'files': files,
+            'logical_bytes': logical,
+            'stored_bytes': written,
+            'duration': duration,
+            'bytes_per_second': logical / duration if duration > 0 else 0.0,
+        }
+
+    # -- restore
+    def _clone(self, src, dst, link):
+        if link == 'hardlink':
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        elif link == 'reflink':
+            try:
+                with open(src, 'rb') as s, open(dst, 'wb') as d:
+                    fcntl.ioctl(d.fileno(), self.FICLONE, s.fileno())
+                return
+            except OSError:
+                pass
+        shutil.copyfile(src, dst)
+
+    def restore(self, snapshot, dest, link='hardlink'):
+        """Rebuild a snapshot under dest, returns the number of files restored
+
+        Identical files are assembled once and then hardlinked or reflinked
+        (link='hardlink'/'reflink', falling back to a copy). Hardlinks share
+        their mode and mtime, so only files whose metadata also matches are
+        linked and the rest are copied. Hardlinked files share storage, so edit
+        restored trees only when link='copy'.
+        """
+        entries = self.load_snapshot(snapshot)
+        if not entries:
+            print(f"{Colors.FAIL}✗ Unknown snapshot: {snapshot}{Colors.ENDC}")
+            return 0
+        restored = {}
+        linked = {}
+        for path, entry in entries.items():
+            target = os.path.join(dest, path)
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            if os.path.lexists(target):
+                os.remove(target)
+            mode = entry.get('mode', 0o644)
+            key = (entry['digest'], mode, entry['mtime'])
+            first = restored.get(entry['digest'])
+            if link == 'hardlink' and key in linked:
+                self._clone(linked[key], target, link)
+                # os.link() succeeded only if target now shares the first file's inode
+                if os.path.samefile(linked[key], target):
+                    continue
+            elif first and link != 'copy':
+                self._clone(first, target, 'copy' if link == 'hardlink' else link)
+            else:
+                with open(target, 'wb') as out:
+                    for chunk_digest in self.files[entry['digest']]:
+                        with open(self._chunk_path(chunk_digest), 'rb') as f:
+                            out.write(f.read())
+                restored[entry['digest']] = target
+            linked.setdefault(key, target)
+            os.chmod(target, mode)
+            os.utime(target, (entry['mtime'], entry['mtime']))
+        return len(entries)
+
+    def snapshots(self):
+        return sorted(name[:-5] for name in os.listdir(self.snapshot_dir) if name.endswith('.json'))
+
+    def stats(self):
+        """Logical vs stored size across all snapshots"""
+        logical = sum(entry['size'] for name in self.snapshots()
+                      for entry in self.load_snapshot(name).values())
+        stored = chunks = 0
+        for dirpath, _, filenames in os.walk(self.chunk_dir):
+            for name in filenames:
+                stored += os.path.getsize(os.path.join(dirpath, name))
+                chunks += 1
+        return {
+            'snapshots': len(self.snapshots()),
+            'chunks': chunks,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'dedup_ratio': logical / stored if stored else 0.0,
+        }
+
+    def print_ingest(self, label, stats):
+        print(f"{Colors.OKGREEN}✓ Stored {label}: {stats['files']} files, "
+              f"{format_bytes(stats['logical_bytes'])} in, {format_bytes(stats['stored_bytes'])} new, "
+              f"{format_bytes(stats['bytes_per_second'])}/s{Colors.ENDC}")
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"\n{Colors.OKBLUE}Artifact store {self.root}:{Colors.ENDC}")
+        print(f"  Snapshots: {stats['snapshots']}")
+        print(f"  Chunks: {stats['chunks']}")
+        print(f"  Logical size: {format_bytes(stats['logical_bytes'])}")
+        print(f"  Stored size: {format_bytes(stats['stored_bytes'])}")
+        print(f"  Dedup ratio: {stats['dedup_ratio']:.2f}x")
+        return stats
+
+class BackupProgress:
+    """Tracks idevicebackup2 progress output and derives throughput and ETA"""
+    PERCENT = re.compile(r'(\d+(?:\.\d+)?)%')
+    SIZES = re.compile(r'\((\d+(?:\.\d+)?)\s*([KMGT]?B)\s*/\s*(\d+(?:\.\d+)?)\s*([KMGT]?B)\)')
+    UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.percent = 0.0
+        self.bytes_done = None
+        self.bytes_total = None
+        self.bytes_per_second = 0.0
+        self._last_sample = None
+
+    def feed(self, line):
+        """Parse one output line, returns True if it carried progress"""
+        updated = False
+        match = self.PERCENT.search(line)
+        if match:
+            self.percent = float(match.group(1))
+            updated = True
+        match = self.SIZES.search(line)
+        if match:
+            done = float(match.group(1)) * self.UNITS[match.group(2)]
+            self.bytes_total = float(match.group(3)) * self.UNITS[match.group(4)]
+            now = time.monotonic()
+            if self._last_sample and done >= self._last_sample[1] and now > self._last_sample[0]:
+                rate = (done - self._last_sample[1]) / (now - self._last_sample[0])
+                # Smooth the rate, individual files make it jumpy
+                self.bytes_per_second = rate if not self.bytes_per_second else 0.7 * self.bytes_per_second + 0.3 * rate
+            self._last_sample = (now, done)
+            self.bytes_done = done
+            updated = True
+        return updated
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    @property
+    def eta(self):
+        """Seconds remaining, or None until there is enough progress to estimate"""
+        if self.bytes_total and self.bytes_per_second:
+            return max(self.bytes_total - (self.bytes_done or 0), 0) / self.bytes_per_second
+        if 0 < self.percent < 100:
+            return self.elapsed * (100 - self.percent) / self.percent
+        return None
+
+    def describe(self):
+        text = f"{self.percent:5.1f}%"
+        if self.bytes_per_second:
+            text += f" {format_bytes(self.bytes_per_second)}/s"
+        if self.eta is not None:
+            text += f" ETA {int(self.eta // 60)}:{int(self.eta % 60):02d}"
+        return text
+
+class BackupManager:
+    """Incremental per-UDID iOS backups with progress and a run manifest
+
+    idevicebackup2 writes into <root>/<UDID> and only transfers what changed
+    when a previous backup exists there. Each run is appended to
+    <root>/manifest.jsonl so throughput can be tracked across the fleet.
+    """
+    def __init__(self, ios, root='./ios_backup', progress_interval=1.0, store=None):
+        self.ios = ios
+        self.root = os.path.abspath(root)
+        self.manifest_path = os.path.join(self.root, 'manifest.jsonl')
+        self.progress_interval = progress_interval
+        self.store = store
+
+    def device_dir(self, udid):
+        return os.path.join(self.root, udid)
+
+    @staticmethod
+    def scan(path):
+        """Map relative file path to (size, mtime) for everything under path"""
+        files = {}
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                files[os.path.relpath(full, path)] = (st.st_size, st.st_mtime)
+        return files
+
+    def _resolve_udid(self, udid):
+        if udid:
+            return udid
+        udids = self.ios.device_ids()
+        if not udids:
+            print(f"{Colors.FAIL}✗ No iOS device connected{Colors.ENDC}")
+            return None
+        return udids[0]
+
+    def backup(self, udid=None, timeout=None):
+        """Run a backup and return its manifest record, or None if no device was found"""
+        return asyncio.run(self.async_backup(udid, timeout))
+
+    async def async_backup(self, udid=None, timeout=None):
+        udid = self._resolve_udid(udid)
+        if not udid:
+            return None
+        device_dir = self.device_dir(udid)
+        os.makedirs(self.root, exist_ok=True)
+        
+        before = self.scan(device_dir)
+        incremental = os.path.exists(os.path.join(device_dir, 'Manifest.db'))
+        progress = BackupProgress()
+        last_report = [0.0]
+        
+        def on_output(line):
+            if progress.feed(line):
+                now = time.monotonic()
+                if now - last_report[0] >= self.progress_interval or progress.percent >= 100:
+                    last_report[0] = now
+                    print(f"{Colors.OKCYAN}[{udid}] {progress.describe()}{Colors.ENDC}")
+            else:
+                print(f"[{udid}] {line}")
+        
+        started = time.time()
+        result = await async_run_command(
+            ['idevicebackup2', '-u', udid, 'backup', self.root], timeout,
+            on_stdout=on_output,
+            on_stderr=lambda line: print(f"{Colors.WARNING}[{udid}] {line}{Colors.ENDC}"))
+        duration = time.time() - started
+        
+        after = self.scan(device_dir)
+        changed = sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
+        run = {
+            'udid': udid,
+            'path': device_dir,
+            'started': started,
+            'duration': duration,
+            'success': bool(result) and result.returncode == 0,
+            'incremental': incremental,
+            'files': len(after),
+            'total_bytes': sum(size for size, _ in after.values()),
+            'bytes_changed': changed,
+            'bytes_per_second': changed / duration if duration > 0 else 0.0,
+        }
+        if self.store and run['success']:
+            run['snapshot'] = f"{udid}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}"
+            stats = await asyncio.get_running_loop().run_in_executor(
+                None, self.store.ingest_tree, run['snapshot'], device_dir)
+            self.store.print_ingest(run['snapshot'], stats)
+        self.record(run)
+        return run
+
+    def record(self, run):
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    def history(self, udid=None):
+        """Return recorded runs, oldest first, optionally for one device"""
+        runs = []
+        try:
+            with open(self.manifest_path) as f:
+                for line in f:
+                    try:
+                        run = json.loads(line)
+                    except ValueError:
+                        continue
+                    if udid is None or run.get('udid') == udid:
+                        runs.append(run)
+        except OSError:
+            pass
+        return runs
+
+    def print_history(self, udid=None):
+        runs = self.history(udid)
+        if not runs:
+            print(f"{Colors.WARNING}No backups recorded in {self.manifest_path}{Colors.ENDC}")
+            return runs
+        print(f"\n{Colors.OKBLUE}Backup history ({self.root}):{Colors.ENDC}")
+        for run in runs:
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started']))
+            status = f"{Colors.OKGREEN}ok{Colors.ENDC}" if run['success'] else f"{Colors.FAIL}failed{Colors.ENDC}"
+            kind = 'incremental' if run['incremental'] else 'full'
+            print(f"  {when}  {run['udid']}  {status}  {kind:11}  {run['duration']:7.1f}s  "
+                  f"{format_bytes(run['bytes_changed']):>10} changed  {format_bytes(run['bytes_per_second'])}/s")
+        return runs
+
+class TreeExporter:
+    """Parallel, resumable copy of a directory tree such as an ifuse mount
+
+    FUSE over usbmuxd has a high per-file latency, so files are copied by a
+    thread pool with large buffers. A local index of (size, mtime) per file
+    lets unchanged files be skipped and an interrupted export resume.
+    """
+    INDEX_NAME = '.bluephone-export.json'
+
+    def __init__(self, workers=8, buffer_size=1024 * 1024, save_interval=5.0):
+        self.workers = workers
+        self.buffer_size = buffer_size
+        self.save_interval = save_interval
+
+    @staticmethod
+    def scan(root):
+        """Return {relative path: (size, mtime)} using os.scandir"""
+        files = {}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                with os.scandir(os.path.join(root, rel) if rel else root) as entries:
+                    for entry in entries:
+                        path = os.path.join(rel, entry.name) if rel else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(path)
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                files[path] = (st.st_size, int(st.st_mtime))
+                        except OSError:
+                            continue
+            except OSError as e:
+                print(f"{Colors.WARNING}⚠ Cannot read {rel or root}: {e}{Colors.ENDC}")
+        return files
+
+    def _load_index(self, dest):
+        try:
+            with open(os.path.join(dest, self.INDEX_NAME)) as f:
+                return {path: tuple(meta) for path, meta in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, dest, index):
+        path = os.path.join(dest, self.INDEX_NAME)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _copy(self, source, target, mtime):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f"{target}.part"
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        copied = 0
+        with open(source, 'rb', buffering=0) as src, open(partial, 'wb', buffering=0) as dst:
+            while True:
+                n = src.readinto(buf)
+                if not n:
+                    break
+                dst.write(view[:n])
+                copied += n
+        os.utime(partial, (mtime, mtime))
+        os.replace(partial, target)
+        return copied
+
+    def export(self, source, dest):
+        """Copy new or changed files from source to dest, returns export stats"""
+        start = time.monotonic()
+        os.makedirs(dest, exist_ok=True)
+        index = self._load_index(dest)
+        files = self.scan(source)
+        todo = [(rel, meta) for rel, meta in files.items()
+                if index.get(rel) != meta or not os.path.exists(os.path.join(dest, rel))]
+        print(f"{Colors.OKCYAN}{len(files)} files found, {len(todo)} to copy, "
+              f"{len(files) - len(todo)} unchanged{Colors.ENDC}")
+        
+        copied = failed = size = 0
+        last_save = time.monotonic()
+        futures = {}
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {pool.submit(self._copy, os.path.join(source, rel), os.path.join(dest, rel), meta[1]): (rel, meta)
+                       for rel, meta in todo}
+            for future in concurrent.futures.as_completed(futures):
+                rel, meta = futures[future]
+                try:
+                    size += future.result()
+                    index[rel] = meta
+                    copied += 1
+                except OSError as e:
+                    failed += 1
+                    print(f"{Colors.WARNING}⚠ {rel}: {e}{Colors.ENDC}")
+                if time.monotonic() - last_save >= self.save_interval:
+                    self._save_index(dest, index)
+                    last_save = time.monotonic()
+        finally:
+            # Save progress even when interrupted so the next run resumes
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+            self._save_index(dest, index)
+        
+        duration = time.monotonic() - start
+        return {
+            'files': len(files),
+            'copied': copied,
+            'skipped': len(files) - len(todo),
+            'failed': failed,
+            'bytes': size,
+            'duration': duration,
+            'files_per_second': copied / duration if duration > 0 else 0.0,
+            'bytes_per_second': size / duration if duration > 0 else 0.0,
+        }
+
+class FileSync:
+    """Mirror directory trees between the host and Android devices over sync:
+
+    Only files whose size or mtime differ are transferred. Requests are
+    pipelined on the device's persistent sync session, and several devices
+    can be synced in parallel.
+    """
+    def __init__(self, android, window=32):
+        self.android = android
+        self.window = window
+
+    @staticmethod
+    def _local_tree(root):
+        files = {}
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                st = os.stat(full)
+                files[os.path.relpath(full, root).replace(os.sep, '/')] = (st.st_size, int(st.st_mtime))
+        return files
+
+    @staticmethod
+    def _remote_tree(session, root):
+        files = {}
+        pending = ['']
+        while pending:
+            rel = pending.pop()
+            for name, mode, size, mtime in session.list(posixpath.join(root, rel) if rel else root):
+                path = posixpath.join(rel, name) if rel else name
+                if stat.S_ISDIR(mode):
+                    pending.append(path)
+                elif stat.S_ISREG(mode):
+                    files[path] = (size, mtime)
+        return files
+
+    def _session(self, serial):
+        client = self.android.adb_server()
+        return client.sync(serial) if client else None
+
+    def _result(self, serial, direction, transferred, skipped, size, start):
+        duration = time.monotonic() - start
+        return {
+            'serial': serial,
+            'direction': direction,
+            'transferred': transferred,
+            'skipped': skipped,
+            'bytes': size,
+            'duration': duration,
+            'bytes_per_second': size / duration if duration > 0 else 0.0,
+        }
+
+    def push(self, local_dir, remote_dir, serial=None):
+        """Push changed files under local_dir to remote_dir, returns transfer stats"""
+        start = time.monotonic()
+        session = self._session(serial)
+        if not session:
+            # adb push --sync also skips files that are unchanged on the device
+            result = run_command(self.android.adb_command(['push', '--sync', f"{local_dir.rstrip('/')}/.", remote_dir], serial))
+            if not result or result.returncode != 0:
+                return None
+            return self._result(serial, 'push', None, None, 0, start)
+        
+        local = self._local_tree(local_dir)
+        with session.lock:
+            remote = self._remote_tree(session, remote_dir) if session.stat(remote_dir)[0] else {}
+            changed = [(os.path.join(local_dir, rel), posixpath.join(remote_dir, rel))
+                       for rel, meta in sorted(local.items()) if remote.get(rel) != meta]
+            size = sum(nbytes for _, _, nbytes in session.push_many(changed, self.window))
+        return self._result(serial, 'push', len(changed), len(local) - len(changed), size, start)
+
+    def pull(self, remote_dir, local_dir, serial=None):
+        """Pull changed files under remote_dir into local_dir, returns transfer stats"""
+        start = time.monotonic()
+        session = self._session(serial)
+        if not session:
+            os.makedirs(local_dir, exist_ok=True)
+            result = run_command(self.android.adb_command(['pull', f"{remote_dir.rstrip('/')}/.", local_dir], serial))
+            if not result or result.returncode != 0:
+                return None
+            return self._result(serial, 'pull', None, None, 0, start)
         
-        # Check Avahi status
-        print(f"\n{Colors.OKCYAN}2. Avahi Daemon Status:{Colors.ENDC}")
-        result = run_command(['systemctl', 'is-active', 'avahi-daemon'])
-        if result and 'active' in result.stdout:
-            print(f"   {Colors.OKGREEN}✓ Avahi is running{Colors.ENDC}")
-        else:
-            print(f"   {Colors.FAIL}✗ Avahi is NOT running{Colors.ENDC}")
-            response = input(f"\n{Colors.OKCYAN}Start Avahi daemon? (y/n): {Colors.ENDC}")
-            if response.lower() == 'y':
-                run_command(['sudo', 'systemctl', 'start', 'avahi-daemon'])
-                print(f"   {Colors.OKGREEN}✓ Avahi started{Colors.ENDC}")
+        with session.lock:
+            remote = self._remote_tree(session, remote_dir)
+            local = self._local_tree(local_dir) if os.path.isdir(local_dir) else {}
+            changed = [rel for rel, meta in sorted(remote.items()) if local.get(rel) != meta]
+            transfers = []
+            for rel in changed:
+                target = os.path.join(local_dir, *rel.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                transfers.append((posixpath.join(remote_dir, rel), target))
         
-        # Check for AirPlay services
-        print(f"\n{Colors.OKCYAN}3. Scanning for AirPlay devices on network...{Colors.ENDC}")
-        result = run_command(['avahi-browse', '-a', '-t', '-r'], capture=True)
-        if result:
-            if '_airplay' in result.stdout.lower() or '_raop' in result.stdout.lower():
-                print(f"   {Colors.OKGREEN}✓ AirPlay services detected on network{Colors.ENDC}")
-            else:
-                print(f"   {Colors.WARNING}⚠ No AirPlay services detected{Colors.ENDC}")
+        size = 0
+        failed = []
+        retried = None
+        pending = collections.deque(transfers)
+        while pending:
+            try:
+                with session.lock:
+                    for remote_path, target, nbytes in session.pull_many(list(pending), self.window):
+                        pending.popleft()
+                        mtime = remote[posixpath.relpath(remote_path, remote_dir)][1]
+                        os.utime(target, (mtime, mtime))
+                        size += nbytes
+            except (ADBError, OSError) as e:
+                # adbd closes the connection after a FAIL and drops the rest of the pipeline; the
+                # close can also lose the FAIL itself, so a file that breaks two sessions is skipped too
+                head = pending[0][0]
+                if isinstance(e, ADBSyncFailed) or retried == head:
+                    print(f"{Colors.WARNING}⚠ {e}{Colors.ENDC}")
+                    failed.append(pending.popleft()[0])
+                retried = head
+                client = self.android.adb_server()
+                client.close_sync(serial)
+                session = client.sync(serial)
+        result = self._result(serial, 'pull', len(changed) - len(failed), len(remote) - len(changed), size, start)
+        result['failed'] = failed
+        return result
+
+    def run_all(self, direction, source, dest, serials=None, max_workers=8):
+        """Push or pull on several devices in parallel, printing per-device throughput"""
+        def operation(serial=None):
+            try:
+                if direction == 'push':
+                    return self.push(source, dest, serial)
+                return self.pull(source, dest.format(device=serial), serial)
+            except (ADBError, OSError):
+                client = self.android.adb_server()
+                if client:
+                    client.close_sync(serial)
+                raise
         
-        # Check firewall status
-        print(f"\n{Colors.OKCYAN}4. Firewall Status:{Colors.ENDC}")
-        result = run_command(['sudo', 'ufw', 'status'])
-        if result:
-            if 'inactive' in result.stdout.lower():
-                print(f"   {Colors.OKGREEN}✓ Firewall is inactive (no blocking){Colors.ENDC}")
+        results = []
+        for result in DeviceFanOut(self.android, max_workers).run(operation, devices=serials):
+            results.append(result)
+            if result.ok:
+                self.print_result(result.value)
             else:
-                print(f"   {Colors.WARNING}Firewall is active{Colors.ENDC}")
-                if '7000' in result.stdout and '5353' in result.stdout:
-                    print(f"   {Colors.OKGREEN}✓ AirPlay ports are open{Colors.ENDC}")
-                else:
-                    print(f"   {Colors.WARNING}⚠ AirPlay ports may be blocked{Colors.ENDC}")
-                    response = input(f"\n{Colors.OKCYAN}Open AirPlay ports? (y/n): {Colors.ENDC}")
-                    if response.lower() == 'y':
-                        self.configure_firewall()
-        
-        # Check if UxPlay is installed
-        print(f"\n{Colors.OKCYAN}5. UxPlay Status:{Colors.ENDC}")
-        if self.check_uxplay():
-            print(f"   {Colors.OKGREEN}✓ UxPlay is installed{Colors.ENDC}")
+                print(f"{Colors.FAIL}✗ {result.device}: {result.error or 'sync failed'}{Colors.ENDC}")
+        DeviceFanOut.print_summary(results)
+        return results
+
+    @staticmethod
+    def print_result(stats):
+        if stats['transferred'] is None:
+            print(f"{Colors.OKGREEN}✓ {stats['serial']}: {stats['direction']} via adb in {stats['duration']:.2f}s{Colors.ENDC}")
+            return
+        print(f"{Colors.OKGREEN}✓ {stats['serial']}: {stats['direction']} {stats['transferred']} files "
+              f"({stats['skipped']} unchanged), {format_bytes(stats['bytes'])} in {stats['duration']:.2f}s, "
+              f"{format_bytes(stats['bytes_per_second'])}/s{Colors.ENDC}")
+        if stats.get('failed'):
+            print(f"{Colors.WARNING}⚠ {stats['serial']}: {len(stats['failed'])} files could not be read{Colors.ENDC}")
+
+LOGCAT_LINE = re.compile(r'^(\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+(\d+)\s+(\d+)\s+([VDIWEFS])\s+(.*?)\s*: (.*)$')
+SYSLOG_LINE = re.compile(r'^(\w{3}\s+\d+ \d\d:\d\d:\d\d(?:\.\d+)?) \S+ ([^\[\s]+)(?:\[(\d+)\])? <(\w+)>: (.*)$')
+SYSLOG_LEVELS = {'Debug': 'D', 'Info': 'I', 'Notice': 'I', 'Warning': 'W', 'Error': 'E',
+                 'Critical': 'F', 'Alert': 'F', 'Emergency': 'F', 'Fault': 'F'}
+
+class LogRecord:
+    """One parsed logcat or syslog line; fields the line did not have are None"""
+    __slots__ = ('platform', 'device', 'time', 'pid', 'tid', 'level', 'tag', 'message', 'raw')
+
+    def __init__(self, platform, device, raw, time=None, pid=None, tid=None, level=None, tag=None, message=None):
+        self.platform = platform
+        self.device = device
+        self.raw = raw
+        self.time = time
+        self.pid = pid
+        self.tid = tid
+        self.level = level
+        self.tag = tag
+        self.message = raw if message is None else message
+
+    @classmethod
+    def from_logcat(cls, line, device=None):
+        """Parse `logcat -v threadtime` output"""
+        match = LOGCAT_LINE.match(line)
+        if not match:
+            return cls('android', device, line)
+        time_, pid, tid, level, tag, message = match.groups()
+        return cls('android', device, line, time_, int(pid), int(tid), level, tag, message)
+
+    @classmethod
+    def from_syslog(cls, line, device=None):
+        """Parse idevicesyslog output, mapping syslog levels onto logcat letters"""
+        match = SYSLOG_LINE.match(line)
+        if not match:
+            return cls('ios', device, line)
+        time_, process, pid, level, message = match.groups()
+        return cls('ios', device, line, time_, int(pid) if pid else None, None,
+                   SYSLOG_LEVELS.get(level, 'I'), process, message)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'raw'}
+
+class LogFilter:
+    """Compiled tag / minimum level / regex filter, all given criteria must match
+
+    Lines that could not be parsed have no tag or level and only pass when
+    neither a tag nor a level filter is set.
+    """
+    LEVELS = 'VDIWEFS'
+
+    def __init__(self, tags=None, min_level=None, pattern=None, ignore_case=False):
+        self.tags = frozenset(tags) if tags else None
+        self.min_rank = self.LEVELS.index(min_level.upper()) if min_level else None
+        self.pattern = re.compile(pattern, re.IGNORECASE if ignore_case else 0) if pattern else None
+
+    def match(self, record):
+        if self.tags is not None and record.tag not in self.tags:
+            return False
+        if self.min_rank is not None and (record.level is None or self.LEVELS.index(record.level) < self.min_rank):
+            return False
+        if self.pattern is not None and not self.pattern.search(record.message):
+            return False
+        return True
+
+class RotatingLogFile:
+    """gzip log file rotated once max_bytes of uncompressed text have been written to it
+
+    Rotated files are <name>.1.log.gz (newest) up to <name>.<backups>.log.gz.
+    """
+    def __init__(self, base, max_bytes=16 * 1024 * 1024, backups=5):
+        self.base = base
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = None
+        self.size = 0
+
+    def path(self, index=0):
+        return f"{self.base}.log.gz" if index == 0 else f"{self.base}.{index}.log.gz"
+
+    def rotate(self):
+        self.close()
+        if self.backups == 0:
+            os.remove(self.path())
+            return
+        for index in range(self.backups - 1, -1, -1):
+            if os.path.exists(self.path(index)):
+                os.replace(self.path(index), self.path(index + 1))
+
+    def _existing_size(self):
+        """Uncompressed bytes already in the current file, None if it is unreadable"""
+        size = 0
+        try:
+            with gzip.open(self.path(), 'rb') as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        return size
+                    size += len(chunk)
+        except FileNotFoundError:
+            return 0
+        except (OSError, EOFError):
+            return None
+
+    def write_lines(self, lines):
+        """Write a batch of encoded lines, returns the uncompressed size"""
+        data = b''.join(lines)
+        if self.file is None:
+            # Appending to a file left by an earlier run continues its count
+            size = self._existing_size()
+            if size is None:
+                # Truncated by a crash, start a new file rather than append after the damage
+                self.rotate()
+                size = 0
+            self.file = gzip.open(self.path(), 'ab', compresslevel=6)
+            self.size = size
+        self.file.write(data)
+        self.size += len(data)
+        if self.size >= self.max_bytes:
+            self.rotate()
+        return len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class LogCollector:
+    """Tail logcat / idevicesyslog from many devices on one asyncio event loop
+
+    Lines are parsed and filtered as they arrive and only matching records are
+    queued. Each device has a bounded queue: when its writer falls behind, the
+    reader stops reading and the adb socket or pipe backs up instead of host
+    memory growing. Records go to per-device rotating gzip files.
+    """
+    def __init__(self, android=None, ios=None, out_dir='./logs', log_filter=None, fmt='text',
+                 max_bytes=16 * 1024 * 1024, backups=5, queue_size=10000, batch_lines=1000,
+                 report_interval=5.0, on_record=None):
+        self.android = android
+        self.ios = ios
+        self.out_dir = out_dir
+        self.log_filter = log_filter
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.batch_lines = batch_lines
+        self.report_interval = report_interval
+        self.on_record = on_record
+        self.stats = {}
+        self.start = None
+
+    async def _open(self, platform, device_id):
+        """Return (reader, close) for the device's log stream, close is a coroutine function"""
+        if platform == 'android':
+            client = self.android.adb_server()
+            if client:
+                try:
+                    reader, writer = await client.async_open_stream('logcat -v threadtime', device_id)
+                    
+                    async def close():
+                        writer.close()
+                    return reader, close
+                except ADBError as e:
+                    self.android._server_failed(e)
+            cmd = self.android.adb_command(['logcat', '-v', 'threadtime'], device_id)
         else:
-            print(f"   {Colors.FAIL}✗ UxPlay is NOT installed{Colors.ENDC}")
+            cmd = self.ios._udid_command('idevicesyslog', device_id)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True)
         
-        # Recommendations
-        print(f"\n{Colors.OKBLUE}=== Recommendations ==={Colors.ENDC}")
-        print(f"""
-{Colors.OKCYAN}For successful AirPlay mirroring:{Colors.ENDC}
-1. Ensure iPhone and Linux are on the SAME WiFi network
-2. Make sure Avahi daemon is running (checked above)
-3. Ensure firewall allows AirPlay ports (checked above)
-4. When starting UxPlay, wait 10-15 seconds before checking iPhone
-5. On iPhone: Settings → WiFi → Verify network name matches Linux
-6. Try restarting UxPlay if device doesn't appear
-        """)
+        async def close():
+            kill_process_group(proc, grace=0)
+            # Reap the child so it does not linger as a zombie
+            await proc.wait()
+        return proc.stdout, close
+
+    def _encode(self, record):
+        if self.fmt == 'jsonl':
+            return json.dumps(record.to_dict()).encode('utf-8') + b'\n'
+        return record.raw.encode('utf-8') + b'\n'
+
+    async def _read(self, platform, device_id, queue, stats):
+        parse = LogRecord.from_logcat if platform == 'android' else LogRecord.from_syslog
+        log_filter = self.log_filter
+        reader, close = await self._open(platform, device_id)
+        try:
+            pending = b''
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                *lines, pending = LINE_BREAK.split(pending + data)
+                for line in lines:
+                    if not line:
+                        continue
+                    stats['read'] += 1
+                    record = parse(line.decode('utf-8', 'replace'), device_id)
+                    if log_filter and not log_filter.match(record):
+                        continue
+                    stats['kept'] += 1
+                    if self.on_record:
+                        self.on_record(record)
+                    if queue.full():
+                        stats['stalls'] += 1
+                        await queue.put(record)
+                    else:
+                        queue.put_nowait(record)
+        finally:
+            await close()
+
+    async def _write(self, queue, log_file, stats):
+        loop = asyncio.get_running_loop()
+        done = False
+        try:
+            while not done:
+                batch = [await queue.get()]
+                while len(batch) < self.batch_lines and not queue.empty():
+                    batch.append(queue.get_nowait())
+                if batch[-1] is None:
+                    done = True
+                    batch.pop()
+                if batch:
+                    lines = [self._encode(record) for record in batch]
+                    # Compression runs off the event loop so other devices keep streaming
+                    stats['bytes'] += await loop.run_in_executor(None, log_file.write_lines, lines)
+        finally:
+            await loop.run_in_executor(None, log_file.close)
+
+    async def _device(self, platform, device_id):
+        stats = self.stats[device_id] = {'platform': platform, 'read': 0, 'kept': 0, 'bytes': 0, 'stalls': 0}
+        safe_id = re.sub(r'[^\w.-]', '_', device_id)
+        log_file = RotatingLogFile(os.path.join(self.out_dir, f"{platform}-{safe_id}"), self.max_bytes, self.backups)
+        queue = asyncio.Queue(self.queue_size)
+        writer = asyncio.create_task(self._write(queue, log_file, stats))
+        try:
+            await self._read(platform, device_id, queue, stats)
+        except (ADBError, OSError) as e:
+            print(f"{Colors.FAIL}✗ {device_id}: log stream failed: {e}{Colors.ENDC}")
+        finally:
+            await queue.put(None)
+            await writer
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.print_stats(final=False)
+
+    def devices(self):
+        devices = []
+        if self.android:
+            devices += [('android', serial) for serial in self.android.device_ids()]
+        if self.ios:
+            devices += [('ios', udid) for udid in self.ios.device_ids()]
+        return devices
+
+    async def collect(self, devices=None, duration=None):
+        """Stream logs from (platform, id) pairs until they disconnect or duration passes"""
+        devices = self.devices() if devices is None else devices
+        if not devices:
+            print(f"{Colors.FAIL}✗ No devices to collect logs from{Colors.ENDC}")
+            return self.summary()
+        if self.ios and any(platform == 'ios' for platform, _ in devices):
+            self.ios.ensure_usbmuxd()
+        os.makedirs(self.out_dir, exist_ok=True)
+        
+        self.start = time.monotonic()
+        tasks = [asyncio.create_task(self._device(platform, device_id)) for platform, device_id in devices]
+        reporter = asyncio.create_task(self._report()) if self.report_interval else None
+        try:
+            await asyncio.wait(tasks, timeout=duration)
+        finally:
+            if reporter:
+                reporter.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.summary()
+
+    def run(self, devices=None, duration=None):
+        """Blocking wrapper around collect(), Ctrl+C stops collection cleanly"""
+        try:
+            asyncio.run(self.collect(devices, duration))
+        except KeyboardInterrupt:
+            pass
+        self.print_stats()
+        return self.summary()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start if self.start else 0.0
+        read = sum(stats['read'] for stats in self.stats.values())
+        return {
+            'elapsed': elapsed,
+            'read': read,
+            'kept': sum(stats['kept'] for stats in self.stats.values()),
+            'bytes': sum(stats['bytes'] for stats in self.stats.values()),
+            'lines_per_second': read / elapsed if elapsed else 0.0,
+            'devices': {device: dict(stats) for device, stats in self.stats.items()},
+        }
+
+    def print_stats(self, final=True):
+        summary = self.summary()
+        if final:
+            print(f"\n{Colors.OKBLUE}Log collection:{Colors.ENDC}")
+            for device, stats in summary['devices'].items():
+                stalled = f", writer stalled {stats['stalls']}x" if stats['stalls'] else ''
+                print(f"  {stats['platform']:7} {device}: {stats['read']} lines, {stats['kept']} kept, "
+                      f"{format_bytes(stats['bytes'])}{stalled}")
+        print(f"{Colors.OKCYAN}{summary['read']} lines in {summary['elapsed']:.1f}s "
+              f"({summary['lines_per_second']:.0f} lines/s), {summary['kept']} kept{Colors.ENDC}")
+
+class FanOutResult:
+    """Outcome of one operation on one device"""
+    def __init__(self, device, ok, value=None, error=None, duration=0.0, timed_out=False):
+        self.device = device
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.duration = duration
+        self.timed_out = timed_out
+
+class DeviceFanOut:
+    """Run one AndroidAccess / iOSAccess operation on every attached device at once
+
+    Devices are discovered through device_ids() and the operation runs on a
+    bounded thread pool. String arguments may contain {device}, which is
+    replaced by the serial/UDID so every device gets its own output path.
+    """
+    def __init__(self, access, max_workers=8, timeout=None):
+        self.access = access
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # Android methods take serial=, iOS methods take udid=
+        self.device_arg = 'udid' if isinstance(access, iOSAccess) else 'serial'
+
+    def _call(self, operation, device, args, kwargs, started):
+        started[device] = time.monotonic()
+        args = [a.format(device=device) if isinstance(a, str) else a for a in args]
+        kwargs = {k: v.format(device=device) if isinstance(v, str) else v for k, v in kwargs.items()}
+        kwargs[self.device_arg] = device
+        if isinstance(operation, str):
+            return getattr(self.access, operation)(*args, **kwargs)
+        return operation(*args, **kwargs)
+
+    def run(self, operation, *args, devices=None, **kwargs):
+        """Yield a FanOutResult per device as soon as it completes
+
+        operation is a method name on the access object or a callable accepting
+        the serial/udid keyword. A device exceeding timeout seconds is reported as
+        timed out; its worker thread is abandoned, not killed.
+        """
+        if devices is None:
+            devices = self.access.device_ids()
+        if not devices:
+            return
+        
+        started = {}
+        pending = {}
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(devices)))
+        try:
+            pending = {pool.submit(self._call, operation, device, args, kwargs, started): device
+                       for device in devices}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, timeout=0.1,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                now = time.monotonic()
+                for future in done:
+                    device = pending.pop(future)
+                    duration = now - started.get(device, now)
+                    try:
+                        value = future.result()
+                        yield FanOutResult(device, value is not None and value is not False, value, None, duration)
+                    except Exception as e:
+                        yield FanOutResult(device, False, None, e, duration)
+                
+                if self.timeout is None:
+                    continue
+                for future, device in list(pending.items()):
+                    if device in started and now - started[device] > self.timeout:
+                        future.cancel()
+                        del pending[future]
+                        yield FanOutResult(device, False, None, TimeoutError(f"timed out after {self.timeout}s"),
+                                           now - started[device], timed_out=True)
+        finally:
+            # Drop devices that never started when the caller stops early (cancel_futures needs 3.9)
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def run_all(self, operation, *args, devices=None, **kwargs):
+        """Run on every device, printing each result as it arrives, and return the list"""
+        results = []
+        for result in self.run(operation, *args, devices=devices, **kwargs):
+            if result.ok:
+                print(f"{Colors.OKGREEN}✓ {result.device} ({result.duration:.2f}s){Colors.ENDC}")
+            else:
+                reason = result.error or 'operation failed'
+                print(f"{Colors.FAIL}✗ {result.device} ({result.duration:.2f}s): {reason}{Colors.ENDC}")
+            results.append(result)
+        self.print_summary(results)
+        return results
+
+    @staticmethod
+    def print_summary(results):
+        passed = sum(1 for r in results if r.ok)
+        timed_out = sum(1 for r in results if r.timed_out)
+        failed = len(results) - passed - timed_out
+        wall = max((r.duration for r in results), default=0.0)
+        print(f"\n{Colors.OKBLUE}Fan-out summary:{Colors.ENDC} {len(results)} devices, "
+              f"{Colors.OKGREEN}{passed} passed{Colors.ENDC}, "
+              f"{Colors.FAIL}{failed} failed{Colors.ENDC}, "
+              f"{Colors.WARNING}{timed_out} timed out{Colors.ENDC} "
+              f"(slowest {wall:.2f}s)")
+
+class FleetInventory:
+    """SQLite record of every Android serial and iOS UDID ever seen
+
+    refresh() compares the attached devices with the previous pass and only
+    re-queries devices that are new, changed state, got a hotplug event or
+    whose data is older than max_age. Those queries run concurrently.
+    """
+    COLUMNS = ['platform', 'device_id', 'model', 'os_version', 'battery', 'resolution',
+               'state', 'first_seen', 'last_seen', 'refreshed']
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS devices (
+            platform TEXT NOT NULL,
+            device_id TEXT NOT NULL,
+            model TEXT,
+            os_version TEXT,
+            battery INTEGER,
+            resolution TEXT,
+            state TEXT,
+            first_seen REAL,
+            last_seen REAL,
+            refreshed REAL,
+            PRIMARY KEY (platform, device_id)
+        );
+        CREATE INDEX IF NOT EXISTS devices_last_seen ON devices (last_seen);
+        CREATE INDEX IF NOT EXISTS devices_model ON devices (model);
+        CREATE INDEX IF NOT EXISTS devices_os_version ON devices (platform, os_version);
+    """
+    # State in which a device answers queries
+    READY = {'android': 'device', 'ios': 'attached'}
+
+    def __init__(self, path='./bluephone_inventory.db', android=None, ios=None, registry=None,
+                 max_workers=16, timeout=60, max_age=3600):
+        self.path = path
+        self.access = {'android': android, 'ios': ios}
+        self.registry = registry
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_age = max_age
+        self.dirty = set()
+        self.dirty_lock = threading.Lock()
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(self.SCHEMA)
+        if registry:
+            registry.subscribe(self._on_device_event)
+
+    def _on_device_event(self, event, platform, device_id, record):
+        with self.dirty_lock:
+            self.dirty.add((platform, device_id))
+
+    def close(self):
+        self.db.close()
+
+    def _attached(self, platform):
+        """{device_id: state} for the devices currently attached"""
+        if self.registry and self.registry.is_synced(platform):
+            return {record['id']: record['state'] for record in self.registry.devices(platform)}
+        return {device_id: self.READY[platform] for device_id in self.access[platform].device_ids()}
+
+    def _rows(self, platform):
+        cursor = self.db.execute('SELECT * FROM devices WHERE platform = ?', (platform,))
+        return {row['device_id']: row for row in cursor}
+
+    def _needs_query(self, platform, device_id, state, row, now):
+        if state != self.READY[platform]:
+            return False
+        if row is None or row['refreshed'] is None or row['state'] != state:
+            return True
+        with self.dirty_lock:
+            if (platform, device_id) in self.dirty:
+                return True
+        return now - row['refreshed'] > self.max_age
+
+    def _query(self, platform):
+        access = self.access[platform]
+        if platform == 'android':
+            return lambda serial: access.snapshot(serial, refresh=True)
+        return lambda udid: access.device_properties(udid, refresh=True)
+
+    @staticmethod
+    def _fields(platform, value):
+        if platform == 'android':
+            size = value.resolution
+            return {'model': value.model, 'os_version': value.version, 'battery': value.battery_level,
+                    'resolution': f"{size[0]}x{size[1]}" if size else None}
+        width, height = value.get('ScreenWidth'), value.get('ScreenHeight')
+        return {'model': value.get('ProductType'), 'os_version': value.get('ProductVersion'),
+                'battery': value.get('BatteryCurrentCapacity'),
+                'resolution': f"{width}x{height}" if width and height else None}
+
+    def refresh(self, platforms=('android', 'ios'), full=False):
+        """Update the inventory from the attached devices, returns per-pass stats"""
+        start = time.monotonic()
+        stats = {'seen': 0, 'queried': 0, 'failed': 0, 'skipped': 0}
+        for platform in platforms:
+            if self.access[platform] is None:
+                continue
+            now = time.time()
+            attached = self._attached(platform)
+            rows = self._rows(platform)
+            stale = [device_id for device_id, state in attached.items()
+                     if full and state == self.READY[platform]
+                     or self._needs_query(platform, device_id, state, rows.get(device_id), now)]
+            stats['seen'] += len(attached)
+            stats['skipped'] += len(attached) - len(stale)
+            
+            for device_id, state in attached.items():
+                self.db.execute("""
+                    INSERT INTO devices (platform, device_id, state, first_seen, last_seen)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (platform, device_id) DO UPDATE SET state = excluded.state, last_seen = excluded.last_seen
+                """, (platform, device_id, state, now, now))
+            self.db.execute(
+                f"UPDATE devices SET state = 'absent' WHERE platform = ? AND device_id NOT IN ({','.join('?' * len(attached))})",
+                (platform, *attached))
+            
+            if stale:
+                fan_out = DeviceFanOut(self.access[platform], self.max_workers, self.timeout)
+                for result in fan_out.run(self._query(platform), devices=stale):
+                    stats['queried'] += 1
+                    if not result.ok:
+                        stats['failed'] += 1
+                        continue
+                    fields = self._fields(platform, result.value)
+                    self.db.execute("""
+                        UPDATE devices SET model = ?, os_version = ?, battery = ?, resolution = ?, refreshed = ?
+                        WHERE platform = ? AND device_id = ?
+                    """, (fields['model'], fields['os_version'], fields['battery'], fields['resolution'],
+                          time.time(), platform, result.device))
+                    with self.dirty_lock:
+                        self.dirty.discard((platform, result.device))
+            self.db.commit()
+        stats['duration'] = time.monotonic() - start
+        return stats
+
+    def query(self, platform=None, model=None, os_version=None, seen_since=None, present=False):
+        """Return inventory rows as dicts, newest first"""
+        clauses, params = [], []
+        for column, value in (('platform', platform), ('model', model), ('os_version', os_version)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if seen_since is not None:
+            clauses.append('last_seen >= ?')
+            params.append(seen_since)
+        if present:
+            clauses.append("state != 'absent'")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        cursor = self.db.execute(f"SELECT * FROM devices {where} ORDER BY last_seen DESC", params)
+        return [dict(row) for row in cursor]
+
+    def wireless_addresses(self):
+        """Android device ids that are Wi-Fi ADB host:port addresses, most recently seen first"""
+        return [row['device_id'] for row in self.query(platform='android')
+                if WirelessADB.ADDRESS.match(row['device_id'])]
+
+    def export(self, path, fmt=None, **filters):
+        """Write a CSV or JSON snapshot, format taken from the extension by default"""
+        rows = self.query(**filters)
+        fmt = fmt or ('json' if path.endswith('.json') else 'csv')
+        with open(path, 'w', newline='') as f:
+            if fmt == 'json':
+                json.dump(rows, f, indent=2)
+            else:
+                writer = csv.DictWriter(f, fieldnames=self.COLUMNS)
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
+
+    @staticmethod
+    def print_refresh(stats):
+        print(f"{Colors.OKGREEN}✓ Inventory refreshed in {stats['duration']:.2f}s: {stats['seen']} attached, "
+              f"{stats['queried']} queried, {stats['skipped']} unchanged{Colors.ENDC}")
+        if stats['failed']:
+            print(f"{Colors.WARNING}⚠ {stats['failed']} devices could not be queried{Colors.ENDC}")
+
+    @staticmethod
+    def print_rows(rows):
+        print(f"\n{Colors.OKBLUE}{'Platform':8} {'Device':40} {'Model':18} {'OS':8} {'Battery':>7} "
+              f"{'Screen':10} {'State':9} Last seen{Colors.ENDC}")
+        for row in rows:
+            battery = '' if row['battery'] is None else f"{row['battery']}%"
+            print(f"{row['platform']:8} {row['device_id']:40} {row['model'] or '':18} {row['os_version'] or '':8} "
+                  f"{battery:>7} {row['resolution'] or '':10} {row['state'] or '':9} "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row['last_seen']))}")
+
+class WirelessADB:
+    """Keeps a fleet of devices connected over Wi-Fi ADB
+
+    Every address is connected concurrently through the adb server's
+    host:connect (or `adb connect` without a server) and retried with
+    backoff until adbd accepts and the device reports the "device" state.
+    watch() then polls the device list every interval and reconnects any
+    address that dropped, keeping connect latency and drop counts per device.
+    """
+    ADDRESS = re.compile(r'^[\w.-]+:\d+$')
+    # First and longest wait between connect attempts
+    BACKOFF = (0.1, 2.0)
+
+    def __init__(self, android, addresses, port=5555, concurrency=32, connect_timeout=20.0,
+                 interval=5.0, request_timeout=10.0):
+        self.android = android
+        self.addresses = list(dict.fromkeys(self.normalize(address, port) for address in addresses))
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.interval = interval
+        self.request_timeout = request_timeout
+        self.stats = {address: {'state': 'disconnected', 'attempts': 0, 'connects': 0, 'drops': 0,
+                                'latency': None, 'mean_latency': None, 'error': None, 'connected_at': None}
+                      for address in self.addresses}
+        self.reconnecting = {}
+        self.semaphore = None
+
+    @staticmethod
+    def normalize(address, port=5555):
+        return address if re.search(r':\d+$', address) else f'{address}:{port}'
+
+    async def _adb(self, request, args):
+        """Send a host request to the adb server, or run the matching adb command"""
+        client = self.android.adb_server()
+        if client:
+            try:
+                return await asyncio.wait_for(client.async_host_query(request), self.request_timeout)
+            except asyncio.TimeoutError:
+                raise ADBError(f"{request} timed out after {self.request_timeout}s")
+        result = await async_run_command(['adb'] + args, self.request_timeout)
+        if result is None:
+            raise ADBError(f"adb {' '.join(args)} failed")
+        if result.returncode != 0:
+            raise ADBError((result.stderr or result.stdout).strip())
+        return result.stdout
+
+    async def _devices(self):
+        devices = {}
+        for line in (await self._adb('host:devices', ['devices'])).splitlines():
+            parts = line.split('\t')
+            if len(parts) >= 2:
+                devices[parts[0]] = parts[1]
+        return devices
+
+    async def async_connect(self, address):
+        """Connect one address, retrying with backoff until it is ready or the timeout passes"""
+        stats = self.stats[address]
+        stats['state'] = 'connecting'
+        start = time.monotonic()
+        delay = self.BACKOFF[0]
+        async with self.semaphore:
+            while True:
+                stats['attempts'] += 1
+                try:
+                    message = (await self._adb(f'host:connect:{address}', ['connect', address])).strip()
+                    if message.startswith(('connected', 'already connected')):
+                        # adbd may still be offline or waiting for the RSA prompt
+                        state = (await self._adb(f'host-serial:{address}:get-state',
+                                                 ['-s', address, 'get-state'])).strip()
+                        if state == 'device':
+                            break
+                        stats['error'] = state
+                    else:
+                        stats['error'] = message
+                except ADBError as e:
+                    stats['error'] = str(e)
+                if time.monotonic() - start + delay > self.connect_timeout:
+                    stats['state'] = 'failed'
+                    return False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.BACKOFF[1])
+        latency = time.monotonic() - start
+        stats['connects'] += 1
+        mean = stats['mean_latency'] or 0.0
+        stats.update(state='device', error=None, latency=latency, connected_at=time.time(),
+                     mean_latency=mean + (latency - mean) / stats['connects'])
+        return True
+
+    async def _connect_all(self):
+        await asyncio.gather(*(self.async_connect(address) for address in self.addresses))
+        return self.stats
+
+    async def async_connect_all(self):
+        """Connect every address concurrently, returns the per-device stats"""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return await self._connect_all()
+
+    async def _reconnect(self, address, state):
+        try:
+            if state is not None:
+                # adb keeps an offline transport around until told to drop it
+                try:
+                    await self._adb(f'host:disconnect:{address}', ['disconnect', address])
+                except ADBError:
+                    pass
+            await self.async_connect(address)
+        finally:
+            self.reconnecting.pop(address, None)
+
+    async def check(self):
+        """One health check pass, returns the addresses that dropped since the last one"""
+        try:
+            devices = await self._devices()
+        except ADBError as e:
+            print(f"{Colors.WARNING}⚠ Health check failed: {e}{Colors.ENDC}")
+            return []
+        dropped = []
+        for address, stats in self.stats.items():
+            if address in self.reconnecting:
+                continue
+            state = devices.get(address)
+            if state == 'device':
+                stats['state'] = 'device'
+                continue
+            if stats['state'] == 'device':
+                stats['drops'] += 1
+                dropped.append(address)
+                print(f"{Colors.WARNING}⚠ {address} dropped ({state or 'gone'}), reconnecting{Colors.ENDC}")
+            self.reconnecting[address] = asyncio.ensure_future(self._reconnect(address, state))
+        return dropped
+
+    async def async_watch(self, duration=None):
+        """Connect everything, then health-check every interval and reconnect drops"""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        deadline = None if duration is None else time.monotonic() + duration
+        await self._connect_all()
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                wait = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+                await asyncio.sleep(max(wait, 0))
+                await self.check()
+        finally:
+            tasks = list(self.reconnecting.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats
+
+    def connect_all(self):
+        self.android.adb_server()
+        return asyncio.run(self.async_connect_all())
+
+    def watch(self, duration=None):
+        self.android.adb_server()
+        try:
+            return asyncio.run(self.async_watch(duration))
+        except KeyboardInterrupt:
+            print(f"\n{Colors.OKCYAN}Stopped watching{Colors.ENDC}")
+            return self.stats
+
+    def print_report(self):
+        print(f"\n{Colors.OKBLUE}{'Address':24} {'State':13} {'Latency':>8} {'Mean':>8} {'Attempts':>8} "
+              f"{'Drops':>5}  Last error{Colors.ENDC}")
+        for address, stats in self.stats.items():
+            latency = '-' if stats['latency'] is None else f"{stats['latency'] * 1000:.0f}ms"
+            mean = '-' if stats['mean_latency'] is None else f"{stats['mean_latency'] * 1000:.0f}ms"
+            print(f"{address:24} {stats['state']:13} {latency:>8} {mean:>8} {stats['attempts']:>8} "
+                  f"{stats['drops']:>5}  {stats['error'] or ''}")
+        ready = sum(1 for stats in self.stats.values() if stats['state'] == 'device')
+        drops = sum(stats['drops'] for stats in self.stats.values())
+        color = Colors.OKGREEN if ready == len(self.stats) else Colors.WARNING
+        print(f"{color}{ready}/{len(self.stats)} devices connected, {drops} drops{Colors.ENDC}")
+        return ready
+
+def clear_screen():
+    """Clear the terminal with ANSI escapes instead of spawning `clear`"""
+    if sys.stdout.isatty():
+        print('\033[2J\033[H', end='', flush=True)
 
 def print_banner():
     banner = f"""
@@ -724,7 +5902,7 @@ def android_menu(android):
             print(f"{Colors.FAIL}Invalid option. Please try again.{Colors.ENDC}")
         
         input(f"\n{Colors.OKCYAN}Press Enter to continue...{Colors.ENDC}")
-        os.system('clear')
+        clear_screen()
         print_banner()
 
 def ios_menu(ios):
@@ -757,22 +5935,887 @@ def ios_menu(ios):
             print(f"{Colors.FAIL}Invalid option. Please try again.{Colors.ENDC}")
         
         input(f"\n{Colors.OKCYAN}Press Enter to continue...{Colors.ENDC}")
-        os.system('clear')
+        clear_screen()
         print_banner()
 
-def main():
+STARTUP_TARGET_COLD = 0.25
+STARTUP_TARGET_WARM = 0.05
+
+def profile_startup(runs=3):
+    """Time AndroidAccess/iOSAccess construction with an empty and a warm probe cache
+
+    Nothing is installed and the probes use a throwaway cache file, so missing
+    tools only show up as misses and the user's own cache is left alone.
+    """
+    global tool_probe
+    saved_probe = tool_probe
+    
+    def timed_init():
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            AndroidAccess(install=False)
+            iOSAccess(install=False)
+        return time.perf_counter() - start
+    
+    cold, warm = [], []
+    with tempfile.TemporaryDirectory(prefix='bluephone-profile-') as workdir:
+        cache_file = os.path.join(workdir, 'tools.json')
+        try:
+            for _ in range(runs):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(cache_file)
+                tool_probe = ToolProbe(cache_file)
+                cold.append(timed_init())
+                tool_probe.save()
+                tool_probe = ToolProbe(cache_file)
+                warm.append(timed_init())
+            hits, misses = tool_probe.hits, tool_probe.misses
+        finally:
+            tool_probe = saved_probe
+    
+    print(f"\n{Colors.OKBLUE}Startup profile ({runs} runs):{Colors.ENDC}")
+    for label, samples, target in (('cold', cold, STARTUP_TARGET_COLD), ('warm', warm, STARTUP_TARGET_WARM)):
+        best = min(samples)
+        color = Colors.OKGREEN if best <= target else Colors.FAIL
+        print(f"  {label}: best {best * 1000:.1f} ms, mean {sum(samples) / len(samples) * 1000:.1f} ms "
+              f"{color}(target {target * 1000:.0f} ms){Colors.ENDC}")
+    print(f"  probe cache: temporary ({hits} hits, {misses} misses on last warm run)")
+    return {'cold': cold, 'warm': warm}
+
+BENCH_STUB = r'''#!{python} -S
+import os, plistlib, sys, time
+tool = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+with open(os.environ['BLUEPHONE_BENCH_LOG'], 'a') as f:
+    f.write(tool + '\n')
+time.sleep(float(os.environ.get('BLUEPHONE_BENCH_LATENCY', '0')))
+size = int(os.environ.get('BLUEPHONE_BENCH_SIZE', '0'))
+devices = int(os.environ.get('BLUEPHONE_BENCH_DEVICES', '1'))
+out = sys.stdout.buffer
+png = b'\x89PNG\r\n\x1a\n' + bytes(size)
+
+def udid_args(args):
+    if args[:1] == ['-u']:
+        return args[1], args[2:]
+    return 'BENCHUDID0', args
+
+if tool == 'adb':
+    if args[:1] == ['-s']:
+        args = args[2:]
+    command = args[0] if args else ''
+    if command == 'devices':
+        out.write(b'List of devices attached\n' + b''.join(b'bench%d\tdevice\n' % i for i in range(devices)))
+    elif args[1:] == ['screencap', '-p']:
+        out.write(png)
+    elif args[1:] == ['screencap']:
+        height = max(1, size // 4096)
+        out.write((1024).to_bytes(4, 'little') + height.to_bytes(4, 'little') + (1).to_bytes(4, 'little')
+                  + bytes(1024 * height * 4))
+    elif command == 'shell' and '{marker}' in ' '.join(args):
+        out.write(b'{marker}getprop\n[ro.product.model]: [Bench]\n[ro.build.version.release]: [14]\n'
+                  b'{marker}battery\n  level: 80\n{marker}display\nPhysical size: 1080x2400\n')
+    elif command == 'pull' and len(args) >= 3:
+        with open(args[2], 'wb') as f:
+            f.write(png)
+    elif command == 'connect':
+        out.write(b'connected to ' + args[1].encode() + b'\n')
+    elif command == 'get-state':
+        out.write(b'device\n')
+elif tool == 'idevice_id':
+    out.write(b''.join(b'BENCHUDID%d\n' % i for i in range(devices)))
+elif tool == 'ideviceinfo':
+    udid, args = udid_args(args)
+    if '-q' in args:
+        values = {{'BatteryCurrentCapacity': 80, 'BatteryIsCharging': False}}
+    else:
+        values = {{'DeviceName': 'Bench ' + udid, 'ProductType': 'iPhone14,2', 'ProductVersion': '17.0',
+                   'SerialNumber': udid, 'UniqueDeviceID': udid}}
+    out.write(plistlib.dumps(values))
+elif tool == 'idevicescreenshot':
+    udid, args = udid_args(args)
+    with open(args[-1], 'wb') as f:
+        f.write(png)
+    out.write(b'Screenshot saved to ' + args[-1].encode() + b'\n')
+elif tool == 'idevicebackup2':
+    udid, args = udid_args(args)
+    device_dir = os.path.join(args[-1], udid)
+    os.makedirs(device_dir, exist_ok=True)
+    for name in ('Manifest.db', 'payload'):
+        with open(os.path.join(device_dir, name), 'wb') as f:
+            f.write(bytes(size))
+    out.write(b'[==================================================] 100% Finished\nBackup Successful.\n')
+elif tool == 'idevicepair':
+    out.write(b'SUCCESS: Paired with device BENCHUDID0\n')
+elif tool == 'systemctl':
+    out.write(b'active\n')
+'''
+
+class Benchmark:
+    """Times AndroidAccess / iOSAccess operations against stub device tools
+
+    Stub adb, scrcpy, idevice* (plus sudo and systemctl, so nothing real gets
+    installed or restarted) are put first on PATH. Each stub sleeps latency
+    seconds and returns output_size bytes where the real tool returns a file
+    or image. Every stub run is logged, which gives the subprocess count per
+    operation. The stubs are Python scripts, so each spawn also pays an
+    interpreter start; compare runs made on the same machine.
+    """
+    STUB_TOOLS = ['adb', 'scrcpy', 'idevice_id', 'ideviceinfo', 'idevicescreenshot', 'idevicebackup2',
+                  'idevicepair', 'idevicesyslog', 'iproxy', 'ifuse', 'avahi-browse', 'gst-launch-1.0',
+                  'sudo', 'systemctl']
+
+    def __init__(self, iterations=5, latency=0.01, output_size=256 * 1024, devices=2, only=None):
+        self.iterations = iterations
+        self.latency = latency
+        self.output_size = output_size
+        self.devices = devices
+        self.only = re.compile(only) if only else None
+        self.workdir = None
+        self.log_path = None
+
+    def _install_stubs(self):
+        bin_dir = os.path.join(self.workdir, 'bin')
+        os.makedirs(bin_dir)
+        script = os.path.join(bin_dir, 'bluephone-stub')
+        with open(script, 'w') as f:
+            f.write(BENCH_STUB.format(python=sys.executable, marker=AndroidSnapshot.MARKER))
+        os.chmod(script, 0o755)
+        for tool in self.STUB_TOOLS:
+            os.symlink(script, os.path.join(bin_dir, tool))
+        return bin_dir
+
+    def _environment(self, bin_dir):
+        return {
+            'PATH': bin_dir + os.pathsep + os.environ.get('PATH', os.defpath),
+            'XDG_CACHE_HOME': os.path.join(self.workdir, 'cache'),
+            'BLUEPHONE_BENCH_LOG': self.log_path,
+            'BLUEPHONE_BENCH_LATENCY': str(self.latency),
+            'BLUEPHONE_BENCH_SIZE': str(self.output_size),
+            'BLUEPHONE_BENCH_DEVICES': str(self.devices),
+        }
+
+    def _spawned(self):
+        try:
+            with open(self.log_path) as f:
+                return f.read().split()
+        except OSError:
+            return []
+
+    def operations(self):
+        """(name, callable) pairs to time, sharing one AndroidAccess and one iOSAccess"""
+        work = self.workdir
+        android = AndroidAccess(use_adb_server=False)
+        ios = iOSAccess(use_usbmux=False)
+        backup_root = os.path.join(work, 'backup')
+        return [
+            ('AndroidAccess()', lambda: AndroidAccess(use_adb_server=False)),
+            ('AndroidAccess.list_devices', android.list_devices),
+            ('AndroidAccess.device_ids', android.device_ids),
+            ('AndroidAccess.device_info', lambda: android.device_info(refresh=True)),
+            ('AndroidAccess.device_info (cached)', android.device_info),
+            ('AndroidAccess.async_device_info', lambda: asyncio.run(android.async_device_info(refresh=True))),
+            ('AndroidAccess.shell', lambda: android.shell(['true'])),
+            ('AndroidAccess.capture_frame', android.capture_frame),
+            ('AndroidAccess.capture_frame (raw)', lambda: android.capture_frame(raw=True)),
+            ('AndroidAccess.screenshot', lambda: android.screenshot(os.path.join(work, 'a.png'))),
+            ('AndroidAccess.async_screenshot', lambda: asyncio.run(android.async_screenshot(os.path.join(work, 'a.png')))),
+            ('AndroidAccess.screenshot_burst', lambda: android.screenshot_burst(3, 0)),
+            ('AndroidAccess.pull', lambda: android.pull('/sdcard/a.png', os.path.join(work, 'pulled.png'))),
+            ('AndroidAccess.connect_wireless', lambda: android.connect_wireless('127.0.0.1')),
+            ('AndroidAccess.screen_mirror', android.screen_mirror),
+            ('AndroidAccess.screen_record', lambda: android.screen_record(os.path.join(work, 'a.mp4'))),
+            ('iOSAccess()', lambda: iOSAccess(use_usbmux=False)),
+            ('iOSAccess.list_devices', ios.list_devices),
+            ('iOSAccess.device_ids', ios.device_ids),
+            ('iOSAccess.device_info', lambda: ios.device_info(refresh=True)),
+            ('iOSAccess.device_info (cached)', ios.device_info),
+            ('iOSAccess.async_device_info', lambda: asyncio.run(ios.async_device_info(refresh=True))),
+            ('iOSAccess.query', lambda: ios.query(['ProductVersion'], refresh=True)),
+            ('iOSAccess.screenshot', lambda: ios.screenshot(os.path.join(work, 'i.png'))),
+            ('iOSAccess.async_screenshot', lambda: asyncio.run(ios.async_screenshot(os.path.join(work, 'i.png')))),
+            ('iOSAccess.backup_device', lambda: ios.backup_device(backup_root)),
+            ('iOSAccess.pair_device', ios.pair_device),
+            ('main() startup', self._main_startup),
+        ]
+
+    def _main_startup(self):
+        """A fresh interpreter running `bluephone android devices`"""
+        module_dir, module_file = os.path.split(os.path.abspath(__file__))
+        code = (f"import sys; sys.path.insert(0, {module_dir!r}); "
+                f"import {os.path.splitext(module_file)[0]} as bluephone; bluephone.main(sys.argv[1:])")
+        run_command([sys.executable, '-c', code, 'android', 'devices'])
+
+    @staticmethod
+    def percentile(samples, fraction):
+        ordered = sorted(samples)
+        position = (len(ordered) - 1) * fraction
+        low = int(position)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    def _measure(self, operation):
+        samples = []
+        spawned = collections.Counter()
+        for _ in range(self.iterations):
+            before = len(self._spawned())
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                operation()
+                samples.append(time.perf_counter() - start)
+            spawned.update(self._spawned()[before:])
+        return {
+            'p50': self.percentile(samples, 0.5),
+            'p90': self.percentile(samples, 0.9),
+            'p99': self.percentile(samples, 0.99),
+            'max': max(samples),
+            'mean': sum(samples) / len(samples),
+            'subprocesses': sum(spawned.values()) / self.iterations,
+            'tools': {tool: count / self.iterations for tool, count in spawned.items()},
+        }
+
+    def run(self):
+        """Run every selected operation, returns {'config': ..., 'results': {name: stats}}"""
+        global tool_probe
+        saved_probe = tool_probe
+        self.workdir = tempfile.mkdtemp(prefix='bluephone-bench-')
+        self.log_path = os.path.join(self.workdir, 'spawned.log')
+        environment = self._environment(self._install_stubs())
+        saved_env = {key: os.environ.get(key) for key in environment}
+        results = {}
+        try:
+            os.environ.update(environment)
+            tool_probe = ToolProbe()
+            with contextlib.redirect_stdout(io.StringIO()):
+                operations = self.operations()
+            for name, operation in operations:
+                if self.only and not self.only.search(name):
+                    continue
+                results[name] = self._measure(operation)
+        finally:
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            tool_probe = saved_probe
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        config = {'iterations': self.iterations, 'latency': self.latency,
+                  'output_size': self.output_size, 'devices': self.devices}
+        return {'config': config, 'results': results}
+
+    @staticmethod
+    def compare(report, baseline, tolerance=0.25, floor=0.005):
+        """Names of operations whose p50 got slower than baseline by more than tolerance
+
+        Differences under floor seconds are ignored as noise.
+        """
+        regressions = []
+        for name, stats in report['results'].items():
+            base = baseline.get('results', {}).get(name)
+            if base and stats['p50'] - base['p50'] > max(base['p50'] * tolerance, floor):
+                regressions.append(name)
+        return regressions
+
+    @staticmethod
+    def print_report(report, baseline=None, regressions=()):
+        config = report['config']
+        print(f"\n{Colors.OKBLUE}Benchmark: {config['iterations']} iterations, {config['latency'] * 1000:.0f} ms stub "
+              f"latency, {format_bytes(config['output_size'])} outputs, {config['devices']} devices{Colors.ENDC}")
+        print(f"{'Operation':38} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'procs':>6}"
+              + (f" {'vs base':>8}" if baseline else ''))
+        for name, stats in report['results'].items():
+            line = (f"{name:38} {stats['p50'] * 1000:9.1f} {stats['p90'] * 1000:9.1f} "
+                    f"{stats['p99'] * 1000:9.1f} {stats['subprocesses']:6.1f}")
+            base = (baseline or {}).get('results', {}).get(name)
+            if base and base['p50']:
+                line += f" {(stats['p50'] / base['p50'] - 1) * 100:+7.0f}%"
+            if name in regressions:
+                line = f"{Colors.FAIL}{line}{Colors.ENDC}"
+            print(line)
+        if regressions:
+            print(f"{Colors.FAIL}✗ {len(regressions)} operations slower than the baseline{Colors.ENDC}")
+        elif baseline:
+            print(f"{Colors.OKGREEN}✓ No regressions against the baseline{Colors.ENDC}")
+
+class CLISession:
+    """Holds the device objects and device lists shared by CLI and batch commands"""
+    def __init__(self, registry=None):
+        self._android = None
+        self._ios = None
+        self.device_cache = {}
+        self.registry = registry
+
+    @property
+    def android(self):
+        if self._android is None:
+            self._android = AndroidAccess(registry=self.registry)
+        return self._android
+
+    @property
+    def ios(self):
+        if self._ios is None:
+            self._ios = iOSAccess(registry=self.registry)
+        return self._ios
+
+    def devices(self, platform, refresh=False):
+        """Device ids for a platform, from the live registry or listed once per session"""
+        if self.registry and self.registry.is_synced(platform):
+            return self.registry.ids(platform, 'device' if platform == 'android' else 'attached')
+        if refresh or platform not in self.device_cache:
+            access = self.android if platform == 'android' else self.ios
+            self.device_cache[platform] = access.device_ids()
+        return self.device_cache[platform]
+
+    def fan_out(self, platform, args, operation, *op_args, **op_kwargs):
+        access = self.android if platform == 'android' else self.ios
+        fan_out = DeviceFanOut(access, max_workers=args.workers, timeout=args.timeout)
+        results = fan_out.run_all(operation, *op_args, devices=self.devices(platform), **op_kwargs)
+        return bool(results) and all(r.ok for r in results)
+
+    def store(self, args):
+        """ChunkStore for --store, shared by every command using the same root"""
+        root = getattr(args, 'store', None)
+        if not root:
+            return None
+        key = ('store', os.path.abspath(root))
+        if key not in self.device_cache:
+            self.device_cache[key] = ChunkStore(root)
+        return self.device_cache[key]
+
+    def run(self, args):
+        """Dispatch a parsed command, returns True on success"""
+        if args.platform == 'batch':
+            return self.run_batch(args.file, args.keep_going)
+        if args.platform == 'monitor':
+            return self.run_monitor(args.duration)
+        if args.platform == 'store':
+            return self.run_store(args)
+        if args.platform == 'inventory':
+            return self.run_inventory(args)
+        if args.platform == 'logs':
+            return self.run_logs(args)
+        if args.platform == 'benchmark':
+            return self.run_benchmark(args)
+        if args.platform == 'install':
+            return self.run_install(args)
+        handler = getattr(self, f"{args.platform}_{args.action.replace('-', '_')}")
+        result = handler(args)
+        return result is not None and result is not False
+
+    def android_devices(self, args):
+        return self.android.list_devices()
+
+    def android_info(self, args):
+        if args.all:
+            return self.fan_out('android', args, 'device_info', refresh=args.refresh)
+        return self.android.device_info(args.serial, args.refresh)
+
+    def android_screenshot(self, args):
+        if args.all:
+            return self.fan_out('android', args, 'screenshot', args.out, raw=args.raw, store=self.store(args))
+        return self.android.screenshot(args.out, args.serial, args.raw, self.store(args))
+
+    def android_burst(self, args):
+        diff = FrameDiff(args.tile, frame_threshold=args.threshold) if args.changes_only else None
+        return self.android.screenshot_burst(args.count, args.interval, args.out, args.serial, args.raw, diff=diff)
+
+    def android_record(self, args):
+        return self.android.screen_record(args.out) is not False
+
+    def android_ring_record(self, args):
+        serials = self.devices('android') if args.all else ([args.serial] if args.serial else None)
+        return self.android.ring_record(serials, args.seconds, int(args.memory_mb * 1024 * 1024), args.out)
+
+    def android_push(self, args):
+        serials = None if args.all else [args.serial or (self.devices('android') or [None])[0]]
+        results = FileSync(self.android).run_all('push', args.local, args.remote, serials, args.workers)
+        return bool(results) and all(r.ok for r in results)
+
+    def android_pull(self, args):
+        serials = None if args.all else [args.serial or (self.devices('android') or [None])[0]]
+        results = FileSync(self.android).run_all('pull', args.remote, args.local, serials, args.workers)
+        return bool(results) and all(r.ok for r in results)
+
+    def android_mirror(self, args):
+        return self.android.screen_mirror() is not False
+
+    def android_connect(self, args):
+        return self.android.connect_wireless(args.ip, args.port)
+
+    def android_replay(self, args):
+        serials = self.devices('android') if args.all else args.serial
+        if not args.json:
+            report = self.android.replay_input(args.script, serials, args.mode, args.speed)
+            return bool(report) and all(stats['failed'] == 0 for stats in report.values())
+        try:
+            events = InputReplay.load(args.script)
+        except (OSError, ValueError) as e:
+            print(f"{Colors.FAIL}Cannot read gesture script {args.script}: {e}{Colors.ENDC}")
+            return False
+        report = InputReplay(self.android, serials, args.mode, args.speed).play(events)
+        print(json.dumps(report, indent=2))
+        return all(stats['failed'] == 0 for stats in report.values())
+
+    def android_wifi(self, args):
+        addresses = args.addresses
+        if not addresses:
+            inventory = FleetInventory(args.db)
+            addresses = inventory.wireless_addresses()
+            inventory.close()
+            if not addresses:
+                print(f"{Colors.WARNING}No WiFi addresses given or recorded in {args.db}{Colors.ENDC}")
+                return False
+        manager = WirelessADB(self.android, addresses, args.port, args.concurrency, args.timeout, args.interval)
+        stats = manager.watch(args.duration) if args.watch else manager.connect_all()
+        if args.json:
+            print(json.dumps(stats, indent=2))
+            return all(device['state'] == 'device' for device in stats.values())
+        return manager.print_report() == len(stats)
+
+    def ios_devices(self, args):
+        return self.ios.list_devices()
+
+    def ios_pair(self, args):
+        return self.ios.pair_device()
+
+    def ios_info(self, args):
+        if args.all:
+            return self.fan_out('ios', args, 'device_info')
+        return self.ios.device_info(args.udid, args.refresh)
+
+    def ios_query(self, args):
+        fields = [f for f in args.fields.split(',') if f]
+        rows = self.ios.query(fields, [args.udid] if args.udid else self.devices('ios'), args.refresh)
+        if args.json:
+            print(json.dumps(rows, indent=2, default=str))
+        else:
+            print('\t'.join(['UDID'] + fields))
+            for udid, values in rows.items():
+                print('\t'.join([udid] + ['' if values[f] is None else str(values[f]) for f in fields]))
+        return bool(rows)
+
+    def ios_screenshot(self, args):
+        if args.all:
+            return self.fan_out('ios', args, 'screenshot', args.out, store=self.store(args))
+        return self.ios.screenshot(args.out, args.udid, self.store(args))
+
+    def ios_backup(self, args):
+        if args.all:
+            return self.fan_out('ios', args, 'backup_device', args.path, store=self.store(args))
+        return self.ios.backup_device(args.path, args.udid, store=self.store(args))
+
+    def ios_backup_history(self, args):
+        return BackupManager(self.ios, args.path).print_history(args.udid) is not None
+
+    def ios_mount(self, args):
+        return self.ios.mount_device(args.mount_point) is not False
+
+    def ios_export(self, args):
+        stats = self.ios.export_files(args.dest, args.mount_point, args.subdir, args.workers)
+        return bool(stats) and stats['failed'] == 0
+
+    def ios_uxplay_build(self, args):
+        builder = UxPlayBuilder(args.source, args.repo, args.jobs, not args.no_ccache, install=not args.no_install)
+        if args.history:
+            return bool(builder.print_history())
+        if not InstallPlanner().ensure(['uxplay'], thorough=True):
+            return False
+        return builder.build(update=not args.no_update, force=args.force)
+
+    def ios_mirror(self, args):
+        return self.ios.screen_mirror_airplay() is not False
+
+    def ios_diagnostics(self, args):
+        return self.ios.network_diagnostics() is not False
+
+    def ios_airplay_scan(self, args):
+        browser = MDNSBrowser(timeout=args.timeout, interfaces=args.interface)
+        services = browser.browse() or []
+        if args.json:
+            print(json.dumps(services, indent=2))
+        elif services:
+            browser.print_services(services)
+        else:
+            print(f"{Colors.WARNING}⚠ No AirPlay services detected{Colors.ENDC}")
+        return bool(services)
+
+    def run_store(self, args):
+        store = self.store(args)
+        if args.action == 'stats':
+            return bool(store.print_stats())
+        if args.action == 'list':
+            for name in store.snapshots():
+                print(name)
+            return True
+        if args.action == 'restore':
+            count = store.restore(args.snapshot, args.dest, args.link)
+            if count:
+                print(f"{Colors.OKGREEN}✓ Restored {count} files to {args.dest}{Colors.ENDC}")
+            return count > 0
+        return False
+
+    def run_inventory(self, args):
+        platforms = ('android', 'ios') if args.platform_filter is None else (args.platform_filter,)
+        if args.action == 'refresh':
+            inventory = FleetInventory(args.db, self.android if 'android' in platforms else None,
+                                       self.ios if 'ios' in platforms else None, self.registry,
+                                       args.workers, args.timeout, args.max_age)
+            stats = inventory.refresh(platforms, full=args.full)
+            inventory.print_refresh(stats)
+            return stats['failed'] == 0
+        inventory = FleetInventory(args.db)
+        filters = {'platform': args.platform_filter, 'model': args.model, 'present': args.present}
+        if args.action == 'list':
+            inventory.print_rows(inventory.query(**filters))
+            return True
+        if args.action == 'export':
+            count = inventory.export(args.out, args.format, **filters)
+            print(f"{Colors.OKGREEN}✓ Exported {count} devices to {args.out}{Colors.ENDC}")
+            return True
+        return False
+
+    def run_logs(self, args):
+        log_filter = None
+        if args.tag or args.level or args.grep:
+            log_filter = LogFilter(args.tag, args.level, args.grep, args.ignore_case)
+        collector = LogCollector(self.android if args.platform_filter != 'ios' else None,
+                                 self.ios if args.platform_filter != 'android' else None,
+                                 args.out, log_filter, args.format, args.max_bytes, args.backups,
+                                 report_interval=args.report_interval)
+        devices = None
+        if args.device:
+            platform = args.platform_filter or 'android'
+            devices = [(platform, device_id) for device_id in args.device]
+        summary = collector.run(devices, args.duration)
+        return bool(summary['devices'])
+
+    def run_benchmark(self, args):
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        if args.frame_diff:
+            FrameDiff.print_benchmark(FrameDiff.benchmark(iterations=args.iterations))
+            return True
+        report = Benchmark(args.iterations, args.latency, args.output_size, args.devices, args.only).run()
+        regressions = Benchmark.compare(report, baseline, args.tolerance) if baseline else []
+        Benchmark.print_report(report, baseline, regressions)
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"{Colors.OKGREEN}✓ Baseline saved to {args.save_baseline}{Colors.ENDC}")
+        return not regressions
+
+    def run_install(self, args):
+        features = args.features or ['android', 'scrcpy', 'ios']
+        unknown = [feature for feature in features if feature not in InstallPlanner.FEATURES]
+        if unknown:
+            print(f"{Colors.FAIL}✗ Unknown feature: {', '.join(unknown)}{Colors.ENDC}")
+            return False
+        return InstallPlanner().ensure(features, dry_run=args.dry_run, thorough=True)
+
+    def run_monitor(self, duration=None):
+        """Print hotplug events until interrupted or duration seconds pass"""
+        registry = self.registry or DeviceRegistry()
+        
+        def show(event, platform, device_id, record):
+            color = {'attached': Colors.OKGREEN, 'detached': Colors.FAIL}.get(event, Colors.WARNING)
+            print(f"{color}{time.strftime('%H:%M:%S')} {event:8} {platform:7} {device_id} ({record['state']}){Colors.ENDC}")
+        
+        registry.subscribe(show)
+        if not registry.running:
+            registry.start()
+        print(f"{Colors.OKCYAN}Watching for devices, press Ctrl+C to stop{Colors.ENDC}")
+        try:
+            deadline = time.monotonic() + duration if duration else None
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if registry is not self.registry:
+                registry.stop()
+        return True
+
+    def run_batch(self, path, keep_going=False):
+        """Run one command per line from a file ('-' for stdin) in this process"""
+        if self.registry is None:
+            self.registry = DeviceRegistry().start()
+        parser = build_parser()
+        try:
+            f = sys.stdin if path == '-' else open(path)
+        except OSError as e:
+            print(f"{Colors.FAIL}✗ Cannot read batch file: {e}{Colors.ENDC}")
+            return False
+        passed = failed = 0
+        start = time.monotonic()
+        try:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                print(f"\n{Colors.OKBLUE}[{lineno}] {line}{Colors.ENDC}")
+                op_start = time.monotonic()
+                try:
+                    args = parser.parse_args(shlex.split(line))
+                    ok = args.platform not in (None, 'batch') and self.run(args)
+                except SystemExit:
+                    ok = False
+                except ValueError as e:
+                    # Unbalanced quotes from shlex
+                    print(f"{Colors.FAIL}✗ Cannot parse line {lineno}: {e}{Colors.ENDC}")
+                    ok = False
+                except Exception as e:
+                    print(f"{Colors.FAIL}✗ line {lineno} raised {type(e).__name__}: {e}{Colors.ENDC}")
+                    ok = False
+                if ok:
+                    passed += 1
+                    print(f"{Colors.OKGREEN}✓ line {lineno} ({time.monotonic() - op_start:.2f}s){Colors.ENDC}")
+                else:
+                    failed += 1
+                    print(f"{Colors.FAIL}✗ line {lineno} failed ({time.monotonic() - op_start:.2f}s){Colors.ENDC}")
+                    if not keep_going:
+                        break
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        
+        print(f"\n{Colors.OKBLUE}Batch finished in {time.monotonic() - start:.2f}s:{Colors.ENDC} "
+              f"{Colors.OKGREEN}{passed} passed{Colors.ENDC}, {Colors.FAIL}{failed} failed{Colors.ENDC}")
+        return failed == 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='bluephone',
+                                     description='Ethical Device Remote Access Tool - Android & iOS')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='measure cold and warm startup time and exit')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='record every external command and write the trace to FILE on exit')
+    parser.add_argument('--trace-format', choices=['chrome', 'json'], default='chrome',
+                        help='chrome://tracing / Perfetto events (default) or plain JSON records')
+    platforms = parser.add_subparsers(dest='platform', metavar='{android,ios,install,store,inventory,logs,benchmark,monitor,batch}')
+    
+    def fan_out_options(p):
+        p.add_argument('--all', action='store_true', help='run on every connected device; use {device} in paths')
+        p.add_argument('--workers', type=int, default=8, help='parallel devices with --all (default: 8)')
+        p.add_argument('--timeout', type=float, default=None, help='per-device timeout in seconds with --all')
+    
+    android = platforms.add_parser('android', help='Android device management')
+    actions = android.add_subparsers(dest='action', required=True)
+    actions.add_parser('devices', help='list connected devices')
+    p = actions.add_parser('info', help='show device information')
+    p.add_argument('--serial')
+    p.add_argument('--refresh', action='store_true', help='ignore the cached snapshot')
+    fan_out_options(p)
+    p = actions.add_parser('screenshot', help='take a screenshot')
+    p.add_argument('--serial')
+    p.add_argument('--out', default='android_screenshot.png')
+    p.add_argument('--raw', action='store_true', help='capture raw pixels and encode host-side')
+    p.add_argument('--store', help='save into this deduplicating artifact store instead of a file')
+    fan_out_options(p)
+    p = actions.add_parser('burst', help='capture a series of screenshots')
+    p.add_argument('--serial')
+    p.add_argument('--count', type=int, default=10)
+    p.add_argument('--interval', type=float, default=0.5)
+    p.add_argument('--out', default=None, help="output pattern, e.g. 'frame_{index:03d}.png'")
+    p.add_argument('--raw', dest='raw', action='store_true', default=True,
+                   help='capture raw pixels and encode host-side (default)')
+    p.add_argument('--no-raw', dest='raw', action='store_false', help='capture PNGs on the device')
+    p.add_argument('--changes-only', action='store_true', help='drop frames identical to the last kept one (raw only)')
+    p.add_argument('--threshold', type=float, default=0.0, help='fraction of pixels that must change (default: any)')
+    p.add_argument('--tile', type=int, default=64, help='tile size in pixels for change detection')
+    p = actions.add_parser('record', help='record the screen with scrcpy')
+    p.add_argument('--out', default='android_record.mp4')
+    p = actions.add_parser('ring-record', help='record continuously and save the last seconds on Enter')
+    p.add_argument('--serial')
+    p.add_argument('--all', action='store_true', help='record every connected device')
+    p.add_argument('--seconds', type=float, default=30, help='length of each saved clip (default: 30)')
+    p.add_argument('--memory-mb', type=float, default=64, help='ring buffer size per device (default: 64)')
+    p.add_argument('--out', default='record_{serial}_{time}.mp4')
+    p = actions.add_parser('push', help='push changed files of a directory tree')
+    p.add_argument('local')
+    p.add_argument('remote')
+    p.add_argument('--serial')
+    fan_out_options(p)
+    p = actions.add_parser('pull', help='pull changed files of a directory tree')
+    p.add_argument('remote')
+    p.add_argument('local', help='local directory; use {device} to separate devices with --all')
+    p.add_argument('--serial')
+    fan_out_options(p)
+    actions.add_parser('mirror', help='mirror the screen with scrcpy')
+    p = actions.add_parser('connect', help='connect over WiFi')
+    p.add_argument('ip')
+    p.add_argument('--port', type=int, default=5555)
+    p = actions.add_parser('replay', help='play a gesture script with accurate timing')
+    p.add_argument('script', help='lines of "<seconds> tap|longpress|swipe|key|text <args>"')
+    p.add_argument('--serial', action='append', help='device to play on (repeatable)')
+    p.add_argument('--all', action='store_true', help='play on every connected device in lockstep')
+    p.add_argument('--mode', choices=['sendevent', 'input'], default='sendevent',
+                   help='raw touchscreen events, or input commands for everything')
+    p.add_argument('--speed', type=float, default=1.0, help='playback speed factor')
+    p.add_argument('--json', action='store_true')
+    p = actions.add_parser('wifi', help='connect many devices over WiFi and keep them connected')
+    p.add_argument('addresses', nargs='*', metavar='ADDRESS',
+                   help='host[:port] (default: the WiFi addresses recorded in the inventory)')
+    p.add_argument('--db', default='./bluephone_inventory.db', help='inventory to take addresses from')
+    p.add_argument('--port', type=int, default=5555, help='port for addresses given without one')
+    p.add_argument('--concurrency', type=int, default=32, help='connects in flight at once')
+    p.add_argument('--timeout', type=float, default=20.0, help='per-device connect timeout in seconds')
+    p.add_argument('--watch', action='store_true', help='keep health-checking and reconnect dropped devices')
+    p.add_argument('--interval', type=float, default=5.0, help='seconds between health checks with --watch')
+    p.add_argument('--duration', type=float, default=None, help='stop watching after this many seconds')
+    p.add_argument('--json', action='store_true')
+    
+    ios = platforms.add_parser('ios', help='iOS device management')
+    actions = ios.add_subparsers(dest='action', required=True)
+    actions.add_parser('devices', help='list connected devices')
+    actions.add_parser('pair', help='pair with the device')
+    p = actions.add_parser('info', help='show device information')
+    p.add_argument('--udid')
+    p.add_argument('--refresh', action='store_true', help='ignore cached values')
+    fan_out_options(p)
+    p = actions.add_parser('query', help='print selected lockdown fields for every device')
+    p.add_argument('fields', help='comma separated, e.g. DeviceName,ProductVersion,BatteryCurrentCapacity')
+    p.add_argument('--udid')
+    p.add_argument('--refresh', action='store_true', help='ignore cached values')
+    p.add_argument('--json', action='store_true')
+    p = actions.add_parser('screenshot', help='take a screenshot')
+    p.add_argument('--udid')
+    p.add_argument('--out', default='ios_screenshot.png')
+    p.add_argument('--store', help='save into this deduplicating artifact store instead of a file')
+    fan_out_options(p)
+    p = actions.add_parser('backup', help='create a device backup')
+    p.add_argument('--udid')
+    p.add_argument('--path', default='./ios_backup', help='backup root, each device gets <path>/<UDID>')
+    p.add_argument('--store', help='also keep each run as a snapshot in this artifact store')
+    fan_out_options(p)
+    p = actions.add_parser('backup-history', help='show recorded backup runs and throughput')
+    p.add_argument('--udid')
+    p.add_argument('--path', default='./ios_backup')
+    p = actions.add_parser('mount', help='mount the device filesystem')
+    p.add_argument('--mount-point', default='/tmp/iphone')
+    p = actions.add_parser('export', help='copy files out of a mounted device in parallel')
+    p.add_argument('--dest', default='./ios_export')
+    p.add_argument('--mount-point', default='/tmp/iphone', help='ifuse mount, or any directory')
+    p.add_argument('--subdir', default='DCIM', help="directory inside the mount (default: DCIM, '' for all)")
+    p.add_argument('--workers', type=int, default=8)
+    p = actions.add_parser('uxplay-build', help='build and install UxPlay, only when its source changed')
+    p.add_argument('--source', default='~/UxPlay', help='source tree, cloned here if missing (default: ~/UxPlay)')
+    p.add_argument('--repo', default=UxPlayBuilder.REPO)
+    p.add_argument('--jobs', type=int, default=None, help='parallel build jobs (default: CPU count)')
+    p.add_argument('--no-ccache', action='store_true')
+    p.add_argument('--no-update', action='store_true', help='build the checkout as is, without git pull')
+    p.add_argument('--no-install', action='store_true', help='build only, skip sudo install')
+    p.add_argument('--force', action='store_true', help='reconfigure and rebuild even if up to date')
+    p.add_argument('--history', action='store_true', help='show recorded build times and exit')
+    actions.add_parser('mirror', help='mirror the screen over AirPlay')
+    actions.add_parser('diagnostics', help='network diagnostics for AirPlay')
+    p = actions.add_parser('airplay-scan', help='list AirPlay receivers on the local network')
+    p.add_argument('--timeout', type=float, default=1.5, help='seconds to wait for answers')
+    p.add_argument('--interface', action='append', help='query only on this interface (repeatable)')
+    p.add_argument('--json', action='store_true')
+    
+    install = platforms.add_parser('install', help='install missing tools in one apt transaction')
+    install.add_argument('features', nargs='*', metavar='FEATURE',
+                         help=f"one of {', '.join(sorted(InstallPlanner.FEATURES))} (default: android scrcpy ios)")
+    install.add_argument('--dry-run', action='store_true', help='print the plan and its estimated cost only')
+    
+    store = platforms.add_parser('store', help='deduplicating artifact store')
+    actions = store.add_subparsers(dest='action', required=True)
+    p = actions.add_parser('stats', help='show dedup ratio and sizes')
+    p.add_argument('store')
+    p = actions.add_parser('list', help='list snapshots')
+    p.add_argument('store')
+    p = actions.add_parser('restore', help='restore a snapshot')
+    p.add_argument('store')
+    p.add_argument('snapshot')
+    p.add_argument('dest')
+    p.add_argument('--link', choices=['hardlink', 'reflink', 'copy'], default='hardlink',
+                   help='how identical files are restored (default: hardlink)')
+    
+    inventory = platforms.add_parser('inventory', help='persistent record of every device seen')
+    actions = inventory.add_subparsers(dest='action', required=True)
+    refresh = actions.add_parser('refresh', help='query new and changed devices and update the database')
+    refresh.add_argument('--full', action='store_true', help='re-query every attached device')
+    refresh.add_argument('--max-age', type=float, default=3600, help='re-query devices older than this (seconds)')
+    refresh.add_argument('--workers', type=int, default=16)
+    refresh.add_argument('--timeout', type=float, default=60, help='per-device timeout in seconds')
+    listing = actions.add_parser('list', help='show the inventory')
+    export = actions.add_parser('export', help='write a CSV or JSON snapshot')
+    export.add_argument('out', help='output file, .json for JSON, anything else for CSV')
+    export.add_argument('--format', choices=['csv', 'json'])
+    for p in (refresh, listing, export):
+        p.add_argument('--db', default='./bluephone_inventory.db')
+        p.add_argument('--platform', dest='platform_filter', choices=['android', 'ios'])
+    for p in (listing, export):
+        p.add_argument('--model')
+        p.add_argument('--present', action='store_true', help='only devices attached at the last refresh')
+    
+    logs = platforms.add_parser('logs', help='stream logcat / idevicesyslog from every device to rotating files')
+    logs.add_argument('--platform', dest='platform_filter', choices=['android', 'ios'])
+    logs.add_argument('--device', action='append', help='serial or UDID (repeatable, default: all attached)')
+    logs.add_argument('--out', default='./logs', help='output directory (default: ./logs)')
+    logs.add_argument('--tag', action='append', help='only keep this tag / process (repeatable)')
+    logs.add_argument('--level', choices=list('VDIWEF'), help='minimum level')
+    logs.add_argument('--grep', help='only keep messages matching this regex')
+    logs.add_argument('--ignore-case', action='store_true')
+    logs.add_argument('--format', choices=['text', 'jsonl'], default='text')
+    logs.add_argument('--max-bytes', type=int, default=16 * 1024 * 1024, help='rotate after this much text')
+    logs.add_argument('--backups', type=int, default=5, help='rotated files kept per device')
+    logs.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    logs.add_argument('--report-interval', type=float, default=5.0, help='seconds between lines/s reports, 0 to disable')
+    
+    benchmark = platforms.add_parser('benchmark', help='time every operation against stub device tools')
+    benchmark.add_argument('--iterations', type=int, default=5)
+    benchmark.add_argument('--latency', type=float, default=0.01, help='seconds each stub tool sleeps')
+    benchmark.add_argument('--output-size', type=int, default=256 * 1024, help='bytes per stub screenshot/file')
+    benchmark.add_argument('--devices', type=int, default=2, help='devices the stubs report')
+    benchmark.add_argument('--only', help='regex selecting operations to run')
+    benchmark.add_argument('--baseline', help='JSON report to compare against, exits non-zero on regressions')
+    benchmark.add_argument('--save-baseline', help='write this run as a JSON baseline')
+    benchmark.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 slowdown (default: 0.25)')
+    benchmark.add_argument('--frame-diff', action='store_true',
+                           help='time screenshot change detection on synthetic 1080x2400 frames instead')
+    
+    monitor = platforms.add_parser('monitor', help='watch devices being attached and detached')
+    monitor.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    
+    batch = platforms.add_parser('batch', help='run commands from a file, one per line')
+    batch.add_argument('file', help="command file, or '-' for stdin")
+    batch.add_argument('--keep-going', action='store_true', help='continue after a failed command')
+    return parser
+
+def parse_args(argv=None):
+    return build_parser().parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.trace:
+        # Lets the tracer name the caller of commands started through asyncio.gather
+        sys.set_coroutine_origin_tracking_depth(8)
+        atexit.register(command_tracer.finish, args.trace, args.trace_format)
+    if args.startup_profile:
+        profile_startup()
+        return
+    
+    if args.platform:
+        sys.exit(0 if CLISession().run(args) else 1)
+    
     print_banner()
     
     print(f"\n{Colors.OKCYAN}Initializing and checking dependencies...{Colors.ENDC}\n")
     
-    # Initialize classes (will auto-install dependencies)
-    android = AndroidAccess()
-    ios = iOSAccess()
+    # Install whatever both platforms are missing in one transaction, then
+    # initialize classes (which only verify their tools from here on)
+    InstallPlanner().ensure(['android', 'ios'])
+    registry = DeviceRegistry().start()
+    android = AndroidAccess(registry=registry)
+    ios = iOSAccess(registry=registry)
     
     print(f"\n{Colors.OKGREEN}✓ All dependencies checked and installed!{Colors.ENDC}")
     time.sleep(2)
     
-    os.system('clear')
+    clear_screen()
     print_banner()
     
     while True:
@@ -780,11 +6823,11 @@ def main():
         choice = input(f"{Colors.OKCYAN}Select an option: {Colors.ENDC}")
         
         if choice == '1':
-            os.system('clear')
+            clear_screen()
             print_banner()
             android_menu(android)
         elif choice == '2':
-            os.system('clear')
+            clear_screen()
             print_banner()
             ios_menu(ios)
         elif choice == '0':
@@ -793,7 +6836,7 @@ def main():
         else:
             print(f"{Colors.FAIL}Invalid option. Please try again.{Colors.ENDC}")
         
-        os.system('clear')
+        clear_screen()
         print_banner()
 
 if __name__ == "__main__":
@@ -0,0 +1,503 @@
+"""In-process stand-ins for the daemons BluePhone talks to, used by the tests"""
+import contextlib
+import io
+import plistlib
+import re
+import socket
+import struct
+import threading
+from unittest import mock
+
+import BluePhone
+
+
+def android_access(server):
+    """AndroidAccess talking to a FakeADB, without looking for an adb binary"""
+    with mock.patch.object(BluePhone.AndroidAccess, 'check_and_install_adb', return_value='adb'), \
+         contextlib.redirect_stdout(io.StringIO()):
+        return BluePhone.AndroidAccess(adb_port=server.port)
+
+
+def recv_exact(conn, n):
+    data = b''
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+class FakeADB:
+    """A minimal adb server on a loopback port
+
+    handler(serial, command) returns stdout bytes or a (stdout, status) tuple.
+    Devices whose serial is in shell_v2 advertise the shell_v2 feature and get
+    framed shell,v2 replies, the others only understand the legacy shell: service.
+    exec:sh stays open and runs InputShell batches line by line.
+    files[serial] maps device paths to (data, mtime, mode) for the sync: service,
+    which holds back its replies until sync_hold requests have arrived so a
+    client that waits for each reply stalls. RECV of a path in unreadable
+    answers FAIL and closes the connection, as adbd does.
+    """
+    def __init__(self, devices=(('emu1', 'device'),), handler=None, shell_v2=(), sync_hold=1):
+        self.devices = list(devices)
+        self.handler = handler or (lambda serial, command: f"ran:{command}\n".encode())
+        self.shell_v2 = set(shell_v2)
+        self.files = {serial: {} for serial, _ in self.devices}
+        self.sync_hold = sync_hold
+        self.unreadable = set()
+        self.commands = []
+        self.sync_requests = []
+        self.trackers = []
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+        self.drop_trackers()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _device_list(self):
+        text = ''.join(f"{serial}\t{state}\n" for serial, state in self.devices).encode()
+        return b'%04x' % len(text) + text
+
+    def set_devices(self, devices):
+        """Replace the device list and push it to every host:track-devices client"""
+        self.devices = list(devices)
+        for serial, _ in self.devices:
+            self.files.setdefault(serial, {})
+        for conn in list(self.trackers):
+            try:
+                conn.sendall(self._device_list())
+            except OSError:
+                self.trackers.remove(conn)
+
+    def drop_trackers(self):
+        for conn in self.trackers:
+            with contextlib.suppress(OSError):
+                conn.shutdown(socket.SHUT_RDWR)
+        self.trackers = []
+
+    def _request(self, conn):
+        return recv_exact(conn, int(recv_exact(conn, 4), 16)).decode()
+
+    def _reply(self, conn, text):
+        data = text.encode()
+        conn.sendall(b'OKAY' + b'%04x' % len(data) + data)
+
+    def _fail(self, conn, message):
+        data = message.encode()
+        conn.sendall(b'FAIL' + b'%04x' % len(data) + data)
+
+    def _run(self, serial, command):
+        self.commands.append((serial, command))
+        result = self.handler(serial, command)
+        return result if isinstance(result, tuple) else (result, 0)
+
+    def _handle(self, conn):
+        serial = None
+        try:
+            while True:
+                request = self._request(conn)
+                if request == 'host:version':
+                    return self._reply(conn, '0029')
+                if request == 'host:devices':
+                    return self._reply(conn, ''.join(f"{s}\t{state}\n" for s, state in self.devices))
+                if request == 'host:track-devices':
+                    conn.sendall(b'OKAY' + self._device_list())
+                    self.trackers.append(conn)
+                    # Stay open until either side hangs up
+                    while conn.recv(1):
+                        pass
+                    return
+                if request == 'host:features':
+                    request = f'host-serial:{self.devices[0][0]}:features'
+                if request.startswith('host-serial:') and request.endswith(':features'):
+                    target = request[len('host-serial:'):-len(':features')]
+                    return self._reply(conn, 'cmd,stat_v2' + (',shell_v2' if target in self.shell_v2 else ''))
+                if request.startswith('host:transport'):
+                    serial = request.split(':', 2)[2] if request.startswith('host:transport:') else self.devices[0][0]
+                    if serial not in dict(self.devices):
+                        return self._fail(conn, f"device '{serial}' not found")
+                    conn.sendall(b'OKAY')
+                    continue
+                if request == 'sync:':
+                    conn.sendall(b'OKAY')
+                    return self._sync(conn, self.files[serial])
+                service, _, command = request.partition(':')
+                if request == 'exec:sh':
+                    conn.sendall(b'OKAY')
+                    return self._interactive(conn, serial)
+                if service == 'shell,v2,raw' and serial in self.shell_v2:
+                    conn.sendall(b'OKAY')
+                    output, status = self._run(serial, command)
+                    if output is not None:
+                        conn.sendall(struct.pack('<BI', 1, len(output)) + output)
+                    if status is not None:
+                        conn.sendall(struct.pack('<BIB', 3, 1, status))
+                    return
+                if service in ('shell', 'exec'):
+                    conn.sendall(b'OKAY')
+                    # A device shell runs the whole script, so the exit status echo follows the output
+                    first, newline, rest = command.partition('\n')
+                    output, status = self._run(serial, first)
+                    if output is not None:
+                        conn.sendall(output)
+                    if newline and status is not None:
+                        marker = BluePhone.ADBClient.EXIT_MARKER
+                        conn.sendall(f"\n{marker}{status}\n".encode())
+                    return
+                return self._fail(conn, f"unknown service {request}")
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _interactive(self, conn, serial):
+        """A long-lived sh that understands InputShell's "{ cmds; } 2>&1; echo SENTINEL $?" batches"""
+        pending = b''
+        while True:
+            while b'\n' not in pending:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                pending += data
+            line, _, pending = pending.partition(b'\n')
+            line = line.decode()
+            if line == 'exit':
+                return
+            match = re.match(r'^\{ (.*); \} 2>&1; echo (\S+) \$\?$', line)
+            output, status = b'', 127
+            for command in match.group(1).split('; '):
+                out, status = self._run(serial, command)
+                output += out
+                if status is None:
+                    # The shell died mid-batch
+                    return conn.sendall(output)
+            conn.sendall(output + f"{match.group(2)} {status}\n".encode())
+
+    def _sync(self, conn, files):
+        held = []
+        count = 0
+        while True:
+            header = recv_exact(conn, 8)
+            tag, length = header[:4], struct.unpack('<I', header[4:])[0]
+            if tag == b'QUIT':
+                return
+            path = recv_exact(conn, length).decode()
+            self.sync_requests.append((tag.decode(), path))
+            reply = self._sync_reply(conn, files, tag, path)
+            held.append(reply)
+            count += 1
+            if reply.startswith(b'FAIL'):
+                # Like adbd, drop the connection and whatever was still queued on it
+                conn.sendall(b''.join(held))
+                return
+            if count >= self.sync_hold:
+                conn.sendall(b''.join(held))
+                held = []
+
+    @staticmethod
+    def _stat(files, path):
+        if path in files:
+            data, mtime, mode = files[path]
+            return mode, len(data), mtime
+        if any(name.startswith(path.rstrip('/') + '/') for name in files):
+            return 0o040755, 0, 0
+        return 0, 0, 0
+
+    def _sync_reply(self, conn, files, tag, path):
+        if tag == b'STAT':
+            return b'STAT' + struct.pack('<III', *self._stat(files, path))
+        if tag == b'LIST':
+            prefix = path.rstrip('/') + '/'
+            names = sorted({name[len(prefix):].split('/')[0] for name in files if name.startswith(prefix)})
+            entries = [b'DENT' + struct.pack('<IIII', *self._stat(files, prefix + name), len(name)) + name.encode()
+                       for name in ['.', '..'] + names]
+            return b''.join(entries) + b'DONE' + bytes(16)
+        if tag == b'RECV':
+            if path in self.unreadable:
+                return b'FAIL' + struct.pack('<I', 17) + b'Permission denied'
+            if path not in files:
+                return b'FAIL' + struct.pack('<I', 14) + b'No such file\0\0'
+            data = files[path][0]
+            chunks = [b'DATA' + struct.pack('<I', len(data[i:i + 65536])) + data[i:i + 65536]
+                      for i in range(0, len(data), 65536)]
+            return b''.join(chunks) + b'DONE' + bytes(4)
+        if tag == b'SEND':
+            remote, _, mode = path.rpartition(',')
+            data = b''
+            while True:
+                header = recv_exact(conn, 8)
+                kind, length = header[:4], struct.unpack('<I', header[4:])[0]
+                if kind == b'DONE':
+                    files[remote] = (data, length, int(mode))
+                    return b'OKAY' + bytes(4)
+                data += recv_exact(conn, length)
+        return b'FAIL' + struct.pack('<I', 7) + b'unknown'
+
+
+class FakeMux:
+    """A usbmuxd on a Unix socket, tunnelling Connect to an in-process lockdownd
+
+    devices maps udid -> lockdown values. Pair records exist for the udids in
+    paired. The fake lockdownd never asks for TLS. attach_network() adds a
+    WiFi connection, which like real usbmuxd gets a DeviceID of its own.
+    """
+    def __init__(self, path, devices=(), paired=None):
+        self.path = path
+        self.devices = dict(devices)
+        self.paired = set(self.devices if paired is None else paired)
+        self.ids = {}
+        self.network = {}
+        self.listeners = []
+        self.connects = 0
+        self.messages = []
+        self.requests = []
+        for udid in self.devices:
+            self._assign(udid)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+        for conn in self.listeners:
+            conn.close()
+
+    def _assign(self, udid, ids=None):
+        ids = self.ids if ids is None else ids
+        ids[udid] = max(list(self.ids.values()) + list(self.network.values()), default=0) + 1
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _recv(self, conn):
+        length, _, _, tag = struct.unpack('<IIII', recv_exact(conn, 16))
+        return tag, plistlib.loads(recv_exact(conn, length - 16))
+
+    def _send(self, conn, message, tag=0):
+        payload = plistlib.dumps(message)
+        conn.sendall(struct.pack('<IIII', 16 + len(payload), 1, 8, tag) + payload)
+
+    def _result(self, conn, tag, number):
+        self._send(conn, {'MessageType': 'Result', 'Number': number}, tag)
+
+    def _attached(self, udid, kind='USB'):
+        device_id = (self.ids if kind == 'USB' else self.network)[udid]
+        return {'MessageType': 'Attached', 'DeviceID': device_id,
+                'Properties': {'SerialNumber': udid, 'DeviceID': device_id, 'ConnectionType': kind}}
+
+    def _entries(self):
+        return ([self._attached(udid) for udid in self.ids]
+                + [self._attached(udid, 'Network') for udid in self.network])
+
+    def attach(self, udid, values=None):
+        self.devices[udid] = values or self.devices.get(udid) or {}
+        self._assign(udid)
+        for conn in self.listeners:
+            self._send(conn, self._attached(udid))
+
+    def detach(self, udid):
+        if udid not in self.network:
+            del self.devices[udid]
+        device_id = self.ids.pop(udid)
+        for conn in self.listeners:
+            self._send(conn, {'MessageType': 'Detached', 'DeviceID': device_id})
+
+    def attach_network(self, udid):
+        self.devices.setdefault(udid, {})
+        self._assign(udid, self.network)
+        for conn in self.listeners:
+            self._send(conn, self._attached(udid, 'Network'))
+
+    def detach_network(self, udid):
+        if udid not in self.ids:
+            del self.devices[udid]
+        device_id = self.network.pop(udid)
+        for conn in self.listeners:
+            self._send(conn, {'MessageType': 'Detached', 'DeviceID': device_id})
+
+    def _handle(self, conn):
+        try:
+            tag, message = self._recv(conn)
+            kind = message['MessageType']
+            self.messages.append(kind)
+            if kind == 'Listen':
+                self._result(conn, tag, 0)
+                for entry in self._entries():
+                    self._send(conn, entry)
+                self.listeners.append(conn)
+                return
+            if kind == 'ListDevices':
+                self._send(conn, {'DeviceList': self._entries()}, tag)
+            elif kind == 'ReadPairRecord':
+                udid = message['PairRecordID']
+                if udid not in self.paired:
+                    self._result(conn, tag, 2)
+                else:
+                    record = {'HostID': f'HOST-{udid}', 'SystemBUID': 'BUID'}
+                    self._send(conn, {'PairRecordData': plistlib.dumps(record)}, tag)
+            elif kind == 'Connect':
+                ids = list(self.ids.items()) + list(self.network.items())
+                udid = next((u for u, i in ids if i == message['DeviceID']), None)
+                if udid is None or message['PortNumber'] != socket.htons(62078):
+                    self._result(conn, tag, 3)
+                else:
+                    self.connects += 1
+                    self._result(conn, tag, 0)
+                    return self._lockdownd(conn, udid)
+            else:
+                self._result(conn, tag, 3)
+            conn.close()
+        except (EOFError, OSError):
+            conn.close()
+
+    def _lockdownd(self, conn, udid):
+        def reply(message):
+            payload = plistlib.dumps(message)
+            conn.sendall(struct.pack('>I', len(payload)) + payload)
+        
+        try:
+            while True:
+                message = plistlib.loads(recv_exact(conn, struct.unpack('>I', recv_exact(conn, 4))[0]))
+                request = message['Request']
+                self.requests.append((udid, request, message.get('Domain'), message.get('Key')))
+                if request == 'QueryType':
+                    reply({'Request': request, 'Type': 'com.apple.mobile.lockdown'})
+                elif request == 'StartSession':
+                    if message.get('HostID') != f'HOST-{udid}':
+                        reply({'Request': request, 'Error': 'InvalidHostID'})
+                    else:
+                        reply({'Request': request, 'SessionID': 'S1', 'EnableSessionSSL': False})
+                elif request == 'GetValue':
+                    values = self.devices.get(udid, {})
+                    if message.get('Domain'):
+                        values = values.get(message['Domain'])
+                    elif message.get('Key'):
+                        values = values.get(message['Key'])
+                    if values is None:
+                        reply({'Request': request, 'Error': 'MissingValue'})
+                    else:
+                        reply({'Request': request, 'Value': values})
+                elif request == 'StopSession':
+                    reply({'Request': request})
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+
+class FakeMDNS:
+    """An mDNS responder on a loopback UDP port
+
+    Point MDNSBrowser at it with interfaces=['lo'], group='127.0.0.1' and
+    port=responder.port. services maps instance names such as
+    'Den._airplay._tcp.local' to dicts with host, port, addresses and txt.
+    A PTR question is answered with the PTR alone, so the browser has to ask
+    for SRV, TXT and A itself, and names are sent with compression pointers.
+    Addresses under retired are announced and then withdrawn with a TTL 0
+    goodbye. questions records every (name, type) asked; with mute set
+    nothing is answered.
+    """
+    A, PTR, TXT, SRV = 1, 12, 16, 33
+
+    def __init__(self, services, ttl=120, mute=False):
+        self.services = services
+        self.ttl = ttl
+        self.mute = mute
+        self.questions = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(9000)
+            except OSError:
+                return
+            count = struct.unpack('!H', data[4:6])[0]
+            offset = 12
+            answers, goodbyes = [], []
+            for _ in range(count):
+                labels, offset = BluePhone.MDNSBrowser.read_name(data, offset)
+                qtype = struct.unpack('!H', data[offset:offset + 2])[0]
+                offset += 4
+                self.questions.append(('.'.join(labels), qtype))
+                self._answer('.'.join(labels).lower(), qtype, answers, goodbyes)
+            if self.mute:
+                continue
+            for records in (answers, goodbyes):
+                if records:
+                    self.sock.sendto(self._packet(records), addr)
+
+    def _answer(self, name, qtype, answers, goodbyes):
+        for instance, service in self.services.items():
+            if qtype == self.PTR and instance.split('.', 1)[1].lower() == name:
+                answers.append((name, self.PTR, self.ttl, instance))
+            elif qtype == self.SRV and instance.lower() == name:
+                answers.append((instance, self.SRV, self.ttl, (service['port'], service['host'])))
+            elif qtype == self.TXT and instance.lower() == name:
+                answers.append((instance, self.TXT, self.ttl, service.get('txt', {})))
+            elif qtype == self.A and service['host'].lower() == name:
+                retired = service.get('retired', [])
+                answers.extend((service['host'], self.A, self.ttl, a) for a in service['addresses'] + retired)
+                goodbyes.extend((service['host'], self.A, 0, a) for a in retired)
+
+    def _packet(self, records):
+        packet = bytearray(struct.pack('!HHHHHH', 0, 0x8400, 0, len(records), 0, 0))
+        offsets = {}
+        
+        def put_name(name):
+            labels = name.split('.')
+            for i in range(len(labels)):
+                suffix = '.'.join(labels[i:]).lower()
+                if suffix in offsets:
+                    packet.extend(struct.pack('!H', 0xc000 | offsets[suffix]))
+                    return
+                offsets[suffix] = len(packet)
+                raw = labels[i].encode()
+                packet.extend(bytes([len(raw)]) + raw)
+            packet.append(0)
+        
+        for owner, rtype, ttl, value in records:
+            put_name(owner)
+            packet.extend(struct.pack('!HHI', rtype, 1, ttl))
+            length_at = len(packet)
+            packet.extend(b'\0\0')
+            if rtype == self.PTR:
+                put_name(value)
+            elif rtype == self.SRV:
+                packet.extend(struct.pack('!HHH', 0, 0, value[0]))
+                put_name(value[1])
+            elif rtype == self.TXT:
+                for key, val in value.items():
+                    item = f'{key}={val}'.encode()
+                    packet.extend(bytes([len(item)]) + item)
+            else:
+                packet.extend(socket.inet_aton(value))
+            struct.pack_into('!H', packet, length_at, len(packet) - length_at - 2)
+        return bytes(packet)
@@ -0,0 +1,78 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import BluePhone
+from tests.fakes import FakeADB, android_access
+
+
+class ShellTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeADB(devices=[('v2', 'device'), ('old', 'device')], shell_v2=['v2'],
+                              handler=self.handle)
+        self.addCleanup(self.server.close)
+        self.android = android_access(self.server)
+
+    def handle(self, serial, command):
+        if command.startswith('exit '):
+            return b'', int(command.split()[1])
+        if command == 'slow':
+            time.sleep(0.5)
+            return b'done\n', 0
+        if command == 'drop':
+            return b'partial', None
+        return f"ran:{command}\n".encode(), 0
+
+    def test_shell_v2_exit_status(self):
+        result = self.android.shell('exit 3', 'v2')
+        self.assertEqual(result.returncode, 3)
+        result = self.android.shell(['echo', 'a b'], 'v2')
+        self.assertEqual((result.returncode, result.stdout), (0, "ran:echo 'a b'\n"))
+
+    def test_legacy_shell_exit_status(self):
+        result = self.android.shell('exit 7', 'old')
+        self.assertEqual((result.returncode, result.stdout), (7, ''))
+        result = self.android.shell('echo hi', 'old')
+        self.assertEqual((result.returncode, result.stdout), (0, 'ran:echo hi\n'))
+
+    def test_async_shell_exit_status(self):
+        async def both():
+            return await asyncio.gather(self.android.async_shell('exit 2', 'v2'),
+                                        self.android.async_shell('exit 5', 'old'))
+        v2, old = asyncio.run(both())
+        self.assertEqual((v2.returncode, old.returncode), (2, 5))
+
+    def test_silent_command_outlives_connect_timeout(self):
+        self.android.adb_client.timeout = 0.1
+        result = self.android.shell('slow', 'v2')
+        self.assertEqual(result.stdout, 'done\n')
+        self.assertEqual(self.server.commands, [('v2', 'slow')])
+
+    def test_broken_stream_is_not_rerun(self):
+        with mock.patch.object(BluePhone, 'run_command') as fallback:
+            self.assertIsNone(self.android.shell('drop', 'v2'))
+        fallback.assert_not_called()
+        self.assertEqual(self.server.commands, [('v2', 'drop')])
+
+    def test_rejected_request_falls_back(self):
+        with mock.patch.object(BluePhone, 'run_command', return_value='fallback') as fallback:
+            self.assertEqual(self.android.shell('echo', 'missing'), 'fallback')
+        fallback.assert_called_once()
+
+
+class SnapshotCacheTest(unittest.TestCase):
+    def test_device_events_drop_the_default_device_entry(self):
+        server = FakeADB()
+        self.addCleanup(server.close)
+        android = android_access(server)
+        android.snapshot_cache.update({None: (0, {}), 'emu1': (0, {}), 'emu2': (0, {})})
+        android._on_device_event('attached', 'android', 'emu3', {})
+        self.assertEqual(sorted(android.snapshot_cache), ['emu1', 'emu2'])
+        android.snapshot_cache[None] = (0, {})
+        android._on_device_event('detached', 'android', 'emu1', {})
+        self.assertEqual(sorted(android.snapshot_cache), ['emu2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
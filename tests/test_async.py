@@ -0,0 +1,71 @@
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import BluePhone
+
+
+def alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class AsyncRunCommandTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.pid_file = os.path.join(tmp.name, 'pid')
+        # The shell starts a grandchild that only a process-group kill reaches
+        self.cmd = ['sh', '-c', f'sleep 30 & echo $! > {self.pid_file}; wait']
+
+    def grandchild(self):
+        with open(self.pid_file) as f:
+            return int(f.read())
+
+    def test_timeout_kills_the_process_group(self):
+        start = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = asyncio.run(BluePhone.async_run_command(self.cmd, timeout=0.5))
+        self.assertIsNone(result)
+        self.assertLess(time.monotonic() - start, 5)
+        pid = self.grandchild()
+        deadline = time.monotonic() + 2
+        while alive(pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(alive(pid))
+
+    def test_cancellation_kills_the_process_group(self):
+        async def cancel():
+            task = asyncio.ensure_future(BluePhone.async_run_command(self.cmd))
+            while not os.path.exists(self.pid_file) or not os.path.getsize(self.pid_file):
+                await asyncio.sleep(0.02)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        
+        asyncio.run(cancel())
+        pid = self.grandchild()
+        deadline = time.monotonic() + 2
+        while alive(pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(alive(pid))
+
+    def test_streams_lines_and_returns_status(self):
+        lines = []
+        code = 'import sys; sys.stdout.write("10%\\r50%\\rdone\\n"); sys.stderr.write("warn\\n"); sys.exit(3)'
+        result = asyncio.run(BluePhone.async_run_command([sys.executable, '-c', code], timeout=10,
+                                                         on_stdout=lines.append))
+        self.assertEqual(lines, ['10%', '50%', 'done'])
+        self.assertEqual((result.returncode, result.stdout, result.stderr), (3, '10%\r50%\rdone\n', 'warn\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+class FakeBackup:
+    """Stands in for idevicebackup2: writes files into <root>/<udid> and reports progress"""
+
+    def __init__(self, files, returncode=0):
+        self.files = files
+        self.returncode = returncode
+        self.commands = []
+
+    async def __call__(self, cmd, timeout=None, on_stdout=None, on_stderr=None, text=True):
+        self.commands.append(cmd)
+        device_dir = os.path.join(cmd[4], cmd[2])
+        os.makedirs(device_dir, exist_ok=True)
+        total = sum(len(data) for data in self.files.values())
+        done = 0
+        for name, data in self.files.items():
+            path = os.path.join(device_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) != len(data):
+                with open(path, 'wb') as f:
+                    f.write(data)
+            done += len(data)
+            on_stdout(f"[====] {done * 100 // total}% ({done} B / {total} B)")
+        on_stdout('Backup Successful.')
+        return subprocess.CompletedProcess(cmd, self.returncode, '', '')
+
+
+class BackupManagerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.manager = BluePhone.BackupManager(mock.Mock(), os.path.join(tmp.name, 'backup'))
+
+    def backup(self, fake, udid='U1'):
+        with mock.patch.object(BluePhone, 'async_run_command', fake), contextlib.redirect_stdout(io.StringIO()):
+            return self.manager.backup(udid)
+
+    def test_full_then_incremental(self):
+        fake = FakeBackup({'Manifest.db': b'm' * 100, 'Info.plist': b'i' * 50, 'aa': b'a' * 1000})
+        run = self.backup(fake)
+        self.assertEqual(fake.commands, [['idevicebackup2', '-u', 'U1', 'backup', self.manager.root]])
+        self.assertTrue(run['success'])
+        self.assertFalse(run['incremental'])
+        self.assertEqual((run['files'], run['total_bytes'], run['bytes_changed']), (3, 1150, 1150))
+        
+        fake.files['bb'] = b'b' * 300
+        run = self.backup(fake)
+        self.assertTrue(run['incremental'])
+        self.assertEqual((run['files'], run['bytes_changed']), (4, 300))
+        self.assertEqual([r['bytes_changed'] for r in self.manager.history('U1')], [1150, 300])
+        self.assertEqual(self.manager.history('U2'), [])
+
+    def test_failed_backup_is_recorded(self):
+        run = self.backup(FakeBackup({'Manifest.db': b'm'}, returncode=1))
+        self.assertFalse(run['success'])
+        self.assertEqual(len(self.manager.history()), 1)
+
+    def test_no_device(self):
+        self.manager.ios.device_ids.return_value = []
+        fake = FakeBackup({})
+        self.assertIsNone(self.backup(fake, udid=None))
+        self.assertEqual(fake.commands, [])
+
+
+class BackupProgressTest(unittest.TestCase):
+    def test_percent_and_sizes(self):
+        progress = BluePhone.BackupProgress()
+        self.assertFalse(progress.feed('Receiving files'))
+        self.assertTrue(progress.feed('[=====     ] 50% (1.5 MB / 3.0 MB)'))
+        self.assertEqual((progress.percent, progress.bytes_done, progress.bytes_total),
+                         (50.0, 1.5 * 1024 ** 2, 3.0 * 1024 ** 2))
+        self.assertIsNotNone(progress.eta)
+
+
+if __name__ == '__main__':
+    unittest.main()
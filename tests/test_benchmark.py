@@ -0,0 +1,32 @@
+import os
+import unittest
+
+import BluePhone
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_runs_operations_against_the_stubs(self):
+        path, probe = os.environ.get('PATH'), BluePhone.tool_probe
+        bench = BluePhone.Benchmark(iterations=2, latency=0, output_size=1024,
+                                    only=r'^(AndroidAccess\.(device_ids|shell|device_info)|iOSAccess\.device_ids)$')
+        report = bench.run()
+        self.assertEqual(sorted(report['results']), ['AndroidAccess.device_ids', 'AndroidAccess.device_info',
+                                                     'AndroidAccess.shell', 'iOSAccess.device_ids'])
+        for stats in report['results'].values():
+            self.assertLessEqual(stats['p50'], stats['max'])
+        self.assertGreater(report['results']['AndroidAccess.shell']['tools'].get('adb', 0), 0)
+        self.assertGreater(report['results']['iOSAccess.device_ids']['subprocesses'], 0)
+        # Everything the run changed is put back
+        self.assertEqual(os.environ.get('PATH'), path)
+        self.assertIs(BluePhone.tool_probe, probe)
+        self.assertFalse(os.path.exists(bench.workdir))
+
+    def test_compare_flags_slower_operations(self):
+        baseline = {'results': {'fast': {'p50': 0.1}, 'noise': {'p50': 0.001}, 'same': {'p50': 0.2}}}
+        report = {'results': {'fast': {'p50': 0.2}, 'noise': {'p50': 0.004}, 'same': {'p50': 0.21},
+                              'new': {'p50': 1.0}}}
+        self.assertEqual(BluePhone.Benchmark.compare(report, baseline), ['fast'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+class ParserTest(unittest.TestCase):
+    def test_burst_raw_flags(self):
+        self.assertTrue(BluePhone.parse_args(['android', 'burst']).raw)
+        self.assertTrue(BluePhone.parse_args(['android', 'burst', '--raw']).raw)
+        self.assertFalse(BluePhone.parse_args(['android', 'burst', '--no-raw']).raw)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.session = BluePhone.CLISession(registry=mock.Mock())
+        self.session.run = mock.Mock(side_effect=self.run_line)
+        self.ran = []
+
+    def run_line(self, args):
+        self.ran.append(args.action)
+        if args.action == 'info':
+            raise RuntimeError('device vanished')
+        return True
+
+    def batch(self, text, keep_going):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.unlink, f.name)
+        return self.session.run_batch(f.name, keep_going=keep_going)
+
+    def test_bad_lines_count_as_failures(self):
+        text = 'android devices\nandroid pull "/sdcard/unterminated\nandroid info\nandroid devices\n'
+        self.assertFalse(self.batch(text, keep_going=True))
+        self.assertEqual(self.ran, ['devices', 'info', 'devices'])
+
+    def test_stops_at_first_failure(self):
+        self.assertFalse(self.batch('android info\nandroid devices\n', keep_going=False))
+        self.assertEqual(self.ran, ['info'])
+
+    def test_missing_file(self):
+        self.assertFalse(self.session.run_batch('/nonexistent/batch.txt', keep_going=True))
+        self.assertEqual(self.ran, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
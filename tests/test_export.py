@@ -0,0 +1,48 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import BluePhone
+
+
+class TreeExporterTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, 'src')
+        self.dest = os.path.join(tmp.name, 'dest')
+        for name in ('a', 'b', 'c', 'd'):
+            os.makedirs(os.path.join(self.source, name))
+            with open(os.path.join(self.source, name, 'file'), 'wb') as f:
+                f.write(name.encode() * 1000)
+
+    def test_export_then_resume(self):
+        exporter = BluePhone.TreeExporter(workers=2)
+        self.assertEqual(exporter.export(self.source, self.dest)['copied'], 4)
+        self.assertEqual(exporter.export(self.source, self.dest)['copied'], 0)
+        with open(os.path.join(self.dest, 'c', 'file'), 'rb') as f:
+            self.assertEqual(f.read(), b'c' * 1000)
+
+    def test_interrupted_export_cancels_queued_copies(self):
+        exporter = BluePhone.TreeExporter(workers=1)
+        copy = exporter._copy
+        started = []
+        release = threading.Event()
+        def failing_copy(source, target, mtime):
+            started.append(source)
+            if len(started) == 1:
+                raise RuntimeError('interrupted')
+            release.wait(5)
+            return copy(source, target, mtime)
+        
+        exporter._copy = failing_copy
+        threading.Timer(0.2, release.set).start()
+        with self.assertRaises(RuntimeError):
+            exporter.export(self.source, self.dest)
+        self.assertLessEqual(len(started), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.dest, BluePhone.TreeExporter.INDEX_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
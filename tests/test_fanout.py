@@ -0,0 +1,33 @@
+import threading
+import time
+import unittest
+
+import BluePhone
+
+
+class FanOutTest(unittest.TestCase):
+    def test_stopping_early_cancels_queued_devices(self):
+        calls = []
+        release = threading.Event()
+        def operation(serial):
+            calls.append(serial)
+            if serial != 'a':
+                release.wait(5)
+            return serial
+        
+        fan_out = BluePhone.DeviceFanOut(object(), max_workers=1)
+        results = fan_out.run(operation, devices=['a', 'b', 'c'])
+        self.assertEqual(next(results).device, 'a')
+        results.close()
+        release.set()
+        time.sleep(0.2)
+        self.assertNotIn('c', calls)
+
+    def test_results_cover_every_device(self):
+        fan_out = BluePhone.DeviceFanOut(object(), max_workers=4)
+        results = list(fan_out.run(lambda serial: serial.upper(), devices=['a', 'b', 'c']))
+        self.assertEqual(sorted(r.value for r in results), ['A', 'B', 'C'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+
+import BluePhone
+from tests.fakes import FakeADB, android_access
+
+
+class InputShellTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeADB(handler=self.handle)
+        self.addCleanup(self.server.close)
+        self.android = android_access(self.server)
+
+    def handle(self, serial, command):
+        if command == 'false':
+            return b'', 1
+        if command == 'spoof':
+            # Looks like the first batch's sentinel, must not end the second batch
+            return f"{BluePhone.InputShell.MARKER}1 0\n".encode(), 0
+        if command == 'die':
+            return b'partial', None
+        return f"ran:{command}\n".encode(), 0
+
+    def run_batches(self, *batches):
+        async def scenario():
+            shell = await BluePhone.InputShell(self.android, 'emu1', timeout=5).open()
+            try:
+                return [await shell.run(batch) for batch in batches]
+            finally:
+                await shell.close()
+        return asyncio.run(scenario())
+
+    def test_batches_share_one_shell(self):
+        results = self.run_batches(['input tap 1 2', 'input swipe 1 2 3 4 100'], ['false'], ['spoof', 'input keyevent 4'])
+        self.assertEqual([status for status, _, _ in results], [0, 1, 0])
+        self.assertEqual(results[0][1], 'ran:input tap 1 2\nran:input swipe 1 2 3 4 100')
+        self.assertEqual(results[1][1], '')
+        self.assertEqual(results[2][1], f"{BluePhone.InputShell.MARKER}1 0\nran:input keyevent 4")
+        self.assertEqual([command for _, command in self.server.commands],
+                         ['input tap 1 2', 'input swipe 1 2 3 4 100', 'false', 'spoof', 'input keyevent 4'])
+
+    def test_closed_shell_raises(self):
+        with self.assertRaises(BluePhone.ADBError):
+            self.run_batches(['input tap 1 2'], ['die'])
+
+
+if __name__ == '__main__':
+    unittest.main()
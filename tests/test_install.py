@@ -0,0 +1,108 @@
+import contextlib
+import io
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+import BluePhone
+
+
+class FakeProbe:
+    def __init__(self, present=()):
+        self.present = set(present)
+        self.forgotten = []
+
+    def which(self, tool):
+        return f'/usr/bin/{tool}' if tool in self.present else None
+
+    def forget(self, tool=None):
+        self.forgotten.append(tool)
+
+    def save(self):
+        pass
+
+
+class FakeRunner:
+    """Records argvs; dpkg-query reports the packages in installed, apt-get install fails when told to"""
+
+    def __init__(self, installed=(), install_fails=False):
+        self.commands = []
+        self.installed = set(installed)
+        self.install_fails = install_fails
+
+    def __call__(self, cmd):
+        self.commands.append(cmd)
+        if cmd[0] == 'dpkg-query':
+            lines = [f"{p} {'installed' if p in self.installed else 'not-installed'}" for p in cmd[4:]]
+            return subprocess.CompletedProcess(cmd, 0, '\n'.join(lines) + '\n', '')
+        if cmd[0] == 'apt-cache':
+            return subprocess.CompletedProcess(cmd, 0, ''.join(f"Package: {p}\nSize: 1048576\n\n" for p in cmd[3:]), '')
+        status = 100 if self.install_fails and cmd[1:3] == ['apt-get', 'install'] else 0
+        return subprocess.CompletedProcess(cmd, status, '', '')
+
+    def apt(self, action):
+        return [cmd for cmd in self.commands if cmd[1:3] == ['apt-get', action]]
+
+
+class InstallPlannerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.stamp = os.path.join(tmp.name, 'update-success-stamp')
+        open(self.stamp, 'w').close()
+
+    def planner(self, runner, present=(), lists_age=7200):
+        os.utime(self.stamp, (time.time() - lists_age,) * 2)
+        planner = BluePhone.InstallPlanner(runner=runner, probe=FakeProbe(present))
+        planner.APT_STAMPS = [self.stamp]
+        return planner
+
+    def ensure(self, planner, features, **kw):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return planner.ensure(features, **kw)
+
+    def test_one_update_and_one_install_for_every_feature(self):
+        runner = FakeRunner(installed={'usbmuxd'})
+        self.assertTrue(self.ensure(self.planner(runner), ['android', 'ios', 'uxplay']))
+        self.assertEqual(len(runner.apt('update')), 1)
+        installs = runner.apt('install')
+        self.assertEqual(len(installs), 1)
+        packages = installs[0][4:]
+        for package in ('adb', 'libimobiledevice-utils', 'cmake', 'libplist-dev', 'avahi-daemon'):
+            self.assertIn(package, packages)
+        self.assertNotIn('usbmuxd', packages)
+        self.assertEqual(len(packages), len(set(packages)))
+        self.assertEqual(len([cmd for cmd in runner.commands if cmd[0] == 'dpkg-query']), 1)
+
+    def test_fresh_lists_skip_the_update(self):
+        runner = FakeRunner()
+        self.assertTrue(self.ensure(self.planner(runner, lists_age=60), ['android']))
+        self.assertEqual(runner.apt('update'), [])
+        self.assertEqual(runner.apt('install'), [['sudo', 'apt-get', 'install', '-y', 'adb']])
+
+    def test_set_up_host_runs_nothing(self):
+        runner = FakeRunner()
+        self.assertTrue(self.ensure(self.planner(runner, present={'adb', 'cmake', 'pkg-config', 'git'}),
+                                    ['android', 'uxplay']))
+        self.assertEqual(runner.commands, [])
+
+    def test_dry_run_executes_nothing(self):
+        runner = FakeRunner()
+        planner = self.planner(runner)
+        self.assertTrue(self.ensure(planner, ['android', 'uxplay'], dry_run=True))
+        self.assertEqual([cmd[0] for cmd in runner.commands], ['dpkg-query', 'apt-cache'])
+        plan = planner.plan(['android'], estimate=True)
+        self.assertEqual(plan['download_bytes'], 1048576)
+        self.assertGreater(plan['estimated_seconds'], planner.UPDATE_SECONDS)
+
+    def test_failed_install_returns_false(self):
+        runner = FakeRunner(install_fails=True)
+        planner = self.planner(runner)
+        self.assertFalse(self.ensure(planner, ['android']))
+        self.assertEqual(planner.probe.forgotten, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
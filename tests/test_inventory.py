@@ -0,0 +1,87 @@
+import csv
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+def snapshot(serial, refresh=False):
+    model, version = {'emu1': ('Pixel 7', '14'), 'emu2': ('Galaxy S23', '13')}[serial]
+    output = '\n'.join([
+        f'{BluePhone.AndroidSnapshot.MARKER}getprop',
+        f'[ro.product.model]: [{model}]',
+        f'[ro.build.version.release]: [{version}]',
+        f'{BluePhone.AndroidSnapshot.MARKER}battery',
+        '  level: 80',
+        f'{BluePhone.AndroidSnapshot.MARKER}display',
+        'Physical size: 1080x2400',
+    ])
+    return BluePhone.AndroidSnapshot.parse(output, serial)
+
+
+class FleetInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.android = mock.Mock(spec=BluePhone.AndroidAccess)
+        self.android.device_ids.return_value = ['emu1', 'emu2']
+        self.android.snapshot.side_effect = snapshot
+        self.ios = mock.Mock(spec=BluePhone.iOSAccess)
+        self.ios.device_ids.return_value = ['U1']
+        self.ios.device_properties.return_value = {'ProductType': 'iPhone15,2', 'ProductVersion': '17.4',
+                                                   'BatteryCurrentCapacity': 64}
+        self.inventory = BluePhone.FleetInventory(':memory:', android=self.android, ios=self.ios)
+        self.addCleanup(self.inventory.close)
+
+    def queried(self):
+        return self.android.snapshot.call_count + self.ios.device_properties.call_count
+
+    def test_first_refresh_queries_everything(self):
+        stats = self.inventory.refresh()
+        self.assertEqual((stats['seen'], stats['queried'], stats['failed'], stats['skipped']), (3, 3, 0, 0))
+        row, = self.inventory.query(platform='android', model='Pixel 7')
+        self.assertEqual((row['device_id'], row['os_version'], row['battery'], row['resolution'], row['state']),
+                         ('emu1', '14', 80, '1080x2400', 'device'))
+        row, = self.inventory.query(platform='ios')
+        self.assertEqual((row['model'], row['os_version'], row['battery'], row['state']),
+                         ('iPhone15,2', '17.4', 64, 'attached'))
+
+    def test_unchanged_devices_are_skipped(self):
+        self.inventory.refresh()
+        stats = self.inventory.refresh()
+        self.assertEqual((stats['queried'], stats['skipped']), (0, 3))
+        self.assertEqual(self.queried(), 3)
+        
+        self.inventory._on_device_event('changed', 'android', 'emu1', {})
+        stats = self.inventory.refresh()
+        self.assertEqual(stats['queried'], 1)
+        self.assertEqual(self.android.snapshot.call_args_list[-1], mock.call('emu1', refresh=True))
+        
+        self.assertEqual(self.inventory.refresh(full=True)['queried'], 3)
+
+    def test_detached_devices_stay_as_absent(self):
+        self.inventory.refresh()
+        self.android.device_ids.return_value = ['emu1']
+        self.inventory.refresh()
+        self.assertEqual(self.inventory.query(platform='android', model='Galaxy S23')[0]['state'], 'absent')
+        self.assertEqual(sorted(row['device_id'] for row in self.inventory.query(present=True)), ['U1', 'emu1'])
+
+    def test_failed_query_is_retried(self):
+        self.ios.device_properties.side_effect = [BluePhone.ADBError('locked'), {'ProductType': 'iPhone15,2'}]
+        self.assertEqual(self.inventory.refresh(platforms=('ios',))['failed'], 1)
+        self.assertIsNone(self.inventory.query(platform='ios')[0]['model'])
+        self.assertEqual(self.inventory.refresh(platforms=('ios',))['queried'], 1)
+        self.assertEqual(self.inventory.query(platform='ios')[0]['model'], 'iPhone15,2')
+
+    def test_export_csv(self):
+        self.inventory.refresh()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'fleet.csv')
+            self.assertEqual(self.inventory.export(path, platform='android'), 2)
+            with open(path, newline='') as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(sorted(row['model'] for row in rows), ['Galaxy S23', 'Pixel 7'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import contextlib
+import io
+import os
+import plistlib
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+from tests.fakes import FakeMux
+
+
+def ios(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return BluePhone.iOSAccess(install=False, **kwargs)
+
+
+class PairTest(unittest.TestCase):
+    def pair(self, pair_status, validate_output):
+        def run_command(cmd, *args, **kwargs):
+            if cmd[1] == 'pair':
+                return subprocess.CompletedProcess(cmd, pair_status, '', '')
+            return subprocess.CompletedProcess(cmd, 0, validate_output, '')
+        
+        access = ios(use_usbmux=False)
+        with mock.patch.object(BluePhone, 'run_command', side_effect=run_command), \
+             mock.patch.object(access, 'ensure_usbmuxd'), mock.patch('time.sleep'), \
+             contextlib.redirect_stdout(io.StringIO()):
+            return access.pair_device()
+
+    def test_validated_pairing(self):
+        self.assertIs(self.pair(0, 'SUCCESS: Validated pairing'), True)
+
+    def test_unvalidated_pairing(self):
+        self.assertIs(self.pair(0, 'ERROR: Device is not paired'), False)
+
+    def test_failed_pairing(self):
+        self.assertIs(self.pair(1, ''), False)
+
+    def test_cli_reports_failure(self):
+        session = BluePhone.CLISession()
+        session._ios = mock.Mock(**{'pair_device.return_value': False})
+        self.assertFalse(session.ios_pair(None))
+
+
+IPHONE = {'DeviceName': 'Test iPhone', 'ProductVersion': '17.4', 'UniqueDeviceID': 'U1',
+          'com.apple.mobile.battery': {'BatteryCurrentCapacity': 77}}
+
+
+class LockdownTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'usbmuxd')
+        self.mux = FakeMux(self.path, {'U1': IPHONE, 'U2': {'DeviceName': 'Unpaired'}}, paired=['U1'])
+        self.addCleanup(self.mux.close)
+        patcher = mock.patch.object(BluePhone.LockdownClient, 'PAIR_RECORDS', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ios = ios(usbmux_path=self.path)
+        self.ios.usbmuxd_ready = True
+        self.addCleanup(self.ios.close_session)
+
+    def tools(self, cmd, *args, **kwargs):
+        self.tool_calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, 'DeviceName: From tools\n', '')
+
+    def properties(self, udid):
+        self.tool_calls = []
+        with mock.patch.object(BluePhone, 'run_command', side_effect=self.tools), \
+             contextlib.redirect_stdout(io.StringIO()):
+            return self.ios.device_properties(udid, refresh=True)
+
+    def test_list_devices(self):
+        client = BluePhone.UsbmuxClient(self.path)
+        self.assertEqual(sorted(client.udids()), ['U1', 'U2'])
+        self.assertEqual(self.ios.device_ids(), client.udids())
+
+    def test_connect_and_get_value(self):
+        client = BluePhone.LockdownClient('U1', BluePhone.UsbmuxClient(self.path))
+        self.addCleanup(client.close)
+        self.assertEqual(client.get_value('DeviceName'), 'Test iPhone')
+        self.assertEqual(client.get_value(domain='com.apple.mobile.battery'), {'BatteryCurrentCapacity': 77})
+        self.assertTrue(client.validate())
+        self.assertEqual(self.mux.connects, 1)
+
+    def test_properties_reuse_one_session(self):
+        first = self.properties('U1')
+        self.assertEqual((first['DeviceName'], first['BatteryCurrentCapacity']), ('Test iPhone', 77))
+        self.properties('U1')
+        self.assertEqual(self.tool_calls, [])
+        self.assertEqual(self.mux.connects, 1)
+
+    def test_unpaired_device_falls_back_without_dropping_usbmuxd(self):
+        self.assertEqual(self.properties('U2')['DeviceName'], 'From tools')
+        self.assertTrue(self.tool_calls)
+        self.assertTrue(self.ios._usbmux_checked)
+        self.assertIsNotNone(self.ios.usbmux)
+        # The refusal is remembered, so the next query goes straight to the tools
+        messages = len(self.mux.messages)
+        self.assertEqual(self.properties('U2')['DeviceName'], 'From tools')
+        self.assertEqual(len(self.mux.messages), messages)
+        # while the paired device keeps using lockdownd
+        self.assertEqual(self.properties('U1')['DeviceName'], 'Test iPhone')
+
+    def test_unreachable_usbmuxd_falls_back(self):
+        access = ios(usbmux_path=os.path.join(os.path.dirname(self.path), 'missing'))
+        access.usbmuxd_ready = True
+        self.ios = access
+        self.assertEqual(self.properties('U1')['DeviceName'], 'From tools')
+        self.assertIsNone(access.usbmux)
+
+
+class DeviceInfoTest(unittest.TestCase):
+    PLAIN = (
+        "DeviceName: Kim's iPhone\n"
+        "ProductVersion: 17.4.1\n"
+        "BatteryCurrentCapacity: 87\n"
+        "PasswordProtected: true\n"
+        "TimeIntervalSince1970: 1700000000.5\n"
+        "NonVolatileRAM:\n"
+        "  auto-boot: true\n"
+        "  Nested:\n"
+        "    Depth: 2\n"
+        "UniqueChipID: 1234\n"
+    )
+
+    def test_parse_plain_output(self):
+        info = BluePhone.parse_ideviceinfo(self.PLAIN)
+        self.assertEqual(info['DeviceName'], "Kim's iPhone")
+        self.assertEqual(info['ProductVersion'], '17.4.1')
+        self.assertEqual((info['BatteryCurrentCapacity'], info['PasswordProtected']), (87, True))
+        self.assertEqual(info['TimeIntervalSince1970'], 1700000000.5)
+        self.assertEqual(info['NonVolatileRAM'], {'auto-boot': True, 'Nested': {'Depth': 2}})
+        self.assertEqual(info['UniqueChipID'], 1234)
+
+    def test_parse_xml_output(self):
+        values = {'DeviceName': 'iPad', 'ProductVersion': '16.0', 'BatteryCurrentCapacity': 40,
+                  'PasswordProtected': False, 'NonVolatileRAM': {'auto-boot': b'true'}}
+        self.assertEqual(BluePhone.parse_ideviceinfo(plistlib.dumps(values).decode()), values)
+        # A broken plist is read as plain text rather than failing
+        self.assertEqual(BluePhone.parse_ideviceinfo('<?xml version="1.0"?>\n<plist><dict>'), {})
+
+    def test_properties_are_merged_and_cached_per_device(self):
+        replies = {None: {'DeviceName': 'Phone'}, 'com.apple.mobile.battery': {'BatteryCurrentCapacity': 55}}
+        calls = []
+        
+        def run_command(cmd, *args, **kwargs):
+            calls.append(cmd)
+            domain = cmd[cmd.index('-q') + 1] if '-q' in cmd else None
+            return subprocess.CompletedProcess(cmd, 0, plistlib.dumps(replies[domain]).decode(), '')
+        
+        access = ios(use_usbmux=False)
+        with mock.patch.object(BluePhone, 'run_command', side_effect=run_command), \
+             mock.patch.object(access, 'ensure_usbmuxd'):
+            self.assertEqual(access.device_properties('U1'), {'DeviceName': 'Phone', 'BatteryCurrentCapacity': 55})
+            self.assertEqual(calls[0], ['ideviceinfo', '-u', 'U1', '-x'])
+            self.assertEqual(len(calls), 2)
+            access.device_properties('U1')
+            self.assertEqual(len(calls), 2)
+            result = access.query(['DeviceName', 'ProductVersion'], udids=['U1', 'U2'])
+            self.assertEqual(len(calls), 4)
+            self.assertEqual(result['U1'], {'DeviceName': 'Phone', 'ProductVersion': None})
+            access.device_properties('U1', refresh=True)
+            self.assertEqual(len(calls), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+class RotatingLogFileTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base = os.path.join(tmp.name, 'android-emu1')
+
+    def test_reopened_file_keeps_its_size(self):
+        log = BluePhone.RotatingLogFile(self.base, max_bytes=100, backups=2)
+        log.write_lines([b'x' * 60])
+        log.close()
+        
+        log = BluePhone.RotatingLogFile(self.base, max_bytes=100, backups=2)
+        log.write_lines([b'y' * 60])
+        log.close()
+        # 120 bytes went to one file across two runs, so it was rotated
+        self.assertFalse(os.path.exists(log.path()))
+        with gzip.open(log.path(1)) as f:
+            self.assertEqual(f.read(), b'x' * 60 + b'y' * 60)
+
+    def test_truncated_file_is_rotated_away(self):
+        log = BluePhone.RotatingLogFile(self.base, max_bytes=1000, backups=2)
+        log.write_lines([b'line\n' * 50])
+        log.close()
+        with open(log.path(), 'r+b') as f:
+            f.truncate(os.path.getsize(log.path()) - 10)
+        
+        log = BluePhone.RotatingLogFile(self.base, max_bytes=1000, backups=2)
+        log.write_lines([b'new\n'])
+        log.close()
+        self.assertTrue(os.path.exists(log.path(1)))
+        with gzip.open(log.path()) as f:
+            self.assertEqual(f.read(), b'new\n')
+
+
+class LogStreamTest(unittest.TestCase):
+    def test_subprocess_stream_is_reaped(self):
+        ios = mock.Mock()
+        ios._udid_command.return_value = [sys.executable, '-c', 'import time; time.sleep(30)']
+        collector = BluePhone.LogCollector(ios=ios)
+        started = []
+        spawn = asyncio.create_subprocess_exec
+        
+        async def capture(*args, **kwargs):
+            started.append(await spawn(*args, **kwargs))
+            return started[-1]
+        
+        async def open_and_close():
+            with mock.patch.object(BluePhone.asyncio, 'create_subprocess_exec', capture):
+                _, close = await collector._open('ios', 'U1')
+            await close()
+        
+        asyncio.run(open_and_close())
+        self.assertIsNotNone(started[0].returncode)
+        with self.assertRaises(ChildProcessError):
+            os.waitpid(started[0].pid, os.WNOHANG)
+
+
+if __name__ == '__main__':
+    unittest.main()
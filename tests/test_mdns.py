@@ -0,0 +1,71 @@
+import contextlib
+import io
+import time
+import unittest
+
+import BluePhone
+from tests.fakes import FakeMDNS
+
+DEN = 'Den._airplay._tcp.local'
+
+
+class BrowserTest(unittest.TestCase):
+    def responder(self, **kw):
+        server = FakeMDNS({DEN: {'host': 'den.local', 'port': 7000, 'addresses': ['127.0.0.5'],
+                                 'txt': {'model': 'AppleTV3,2', 'pw': ''}}}, **kw)
+        self.addCleanup(server.close)
+        return server
+
+    def browser(self, server, timeout=3.0):
+        return BluePhone.MDNSBrowser(['_airplay._tcp.local'], timeout=timeout, settle=0.1, interfaces=['lo'],
+                                     group='127.0.0.1', port=server.port)
+
+    def browse(self, browser):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return browser.browse()
+
+    def test_resolves_ptr_srv_txt_and_a(self):
+        server = self.responder()
+        start = time.monotonic()
+        services = self.browse(self.browser(server))
+        # Done once everything is resolved and the network is quiet, well before the deadline
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(len(services), 1)
+        service = services[0]
+        self.assertEqual((service['name'], service['instance'], service['type'], service['interface']),
+                         (DEN, 'Den', '_airplay._tcp', 'lo'))
+        self.assertEqual((service['host'], service['port'], service['addresses']), ('den.local', 7000, ['127.0.0.5']))
+        self.assertEqual(service['txt'], {'model': 'AppleTV3,2', 'pw': ''})
+        self.assertEqual({qtype for _, qtype in server.questions}, {FakeMDNS.PTR, FakeMDNS.SRV, FakeMDNS.TXT, FakeMDNS.A})
+
+    def test_gives_up_at_the_deadline(self):
+        server = self.responder(mute=True)
+        start = time.monotonic()
+        self.assertEqual(self.browse(self.browser(server, timeout=0.6)), [])
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.55)
+        self.assertLess(elapsed, 1.5)
+        # The unanswered PTR question was retransmitted
+        self.assertGreater(server.questions.count(('_airplay._tcp.local', FakeMDNS.PTR)), 1)
+
+    def test_cached_until_the_shortest_ttl(self):
+        server = self.responder(ttl=1)
+        browser = self.browser(server)
+        self.assertEqual(len(self.browse(browser)), 1)
+        asked = len(server.questions)
+        self.assertEqual(self.browse(browser)[0]['ttl'], 1)
+        self.assertEqual(len(server.questions), asked)
+        
+        time.sleep(1.05)
+        self.assertEqual(len(self.browse(browser)), 1)
+        self.assertGreater(len(server.questions), asked)
+
+    def test_goodbye_drops_the_address(self):
+        server = self.responder()
+        server.services[DEN]['retired'] = ['127.0.0.9']
+        services = self.browse(self.browser(server))
+        self.assertEqual(services[0]['addresses'], ['127.0.0.5'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import threading
+import unittest
+
+import BluePhone
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_stats_while_evicting(self):
+        recorder = BluePhone.DeviceRecorder(None, 'emu1', 4096)
+        ring = recorder.ring
+        ring.append(bytes([ring.SPS, 1]), 0.0)
+        ring.append(bytes([ring.PPS, 1]), 0.0)
+        stop = threading.Event()
+        def feed():
+            t = 0.0
+            while not stop.is_set():
+                t += 0.01
+                ring.append(bytes([ring.IDR]) + bytes(300), t)
+        
+        thread = threading.Thread(target=feed)
+        thread.start()
+        try:
+            for _ in range(20000):
+                self.assertGreaterEqual(recorder.stats()['buffered_seconds'], 0.0)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertGreater(ring.evicted, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+import BluePhone
+from tests.fakes import FakeADB, FakeMux
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.01)
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.server = FakeADB(devices=[('emu1', 'device')])
+        self.addCleanup(self.server.close)
+        self.mux = FakeMux(os.path.join(tmp.name, 'usbmuxd'), {'U1': {}})
+        self.addCleanup(self.mux.close)
+        self.registry = BluePhone.DeviceRegistry(BluePhone.ADBClient(port=self.server.port),
+                                                 BluePhone.UsbmuxClient(self.mux.path), reconnect_delay=0.05)
+        self.events = []
+        self.registry.subscribe(lambda event, platform, device_id, record:
+                                self.events.append((event, platform, device_id, record['state'])))
+        self.registry.start()
+        self.addCleanup(self.registry.stop)
+
+    def test_initial_lists(self):
+        self.assertTrue(self.registry.is_synced('android') and self.registry.is_synced('ios'))
+        self.assertEqual(self.registry.ids('android', 'device'), ['emu1'])
+        self.assertEqual(self.registry.ids('ios'), ['U1'])
+        self.assertEqual(self.registry.get('U1')['properties']['ConnectionType'], 'USB')
+
+    def test_track_devices_changes(self):
+        self.events.clear()
+        self.server.set_devices([('emu1', 'offline'), ('emu2', 'unauthorized')])
+        wait_for(lambda: len(self.events) == 2)
+        self.assertEqual(sorted(self.events), [('attached', 'android', 'emu2', 'unauthorized'),
+                                               ('changed', 'android', 'emu1', 'offline')])
+        self.server.set_devices([('emu2', 'device')])
+        wait_for(lambda: len(self.events) == 4)
+        self.assertEqual(sorted(self.events[2:]), [('changed', 'android', 'emu2', 'device'),
+                                                   ('detached', 'android', 'emu1', 'offline')])
+        self.assertEqual(self.registry.ids('android'), ['emu2'])
+
+    def test_track_devices_reconnects(self):
+        self.events.clear()
+        self.server.drop_trackers()
+        wait_for(lambda: ('attached', 'android', 'emu1', 'device') in self.events)
+        self.assertEqual(self.events[0], ('detached', 'android', 'emu1', 'device'))
+        wait_for(lambda: self.registry.is_synced('android'))
+
+    def test_usbmuxd_listen(self):
+        self.events.clear()
+        self.mux.attach('U2')
+        wait_for(lambda: self.events)
+        self.assertEqual(self.events, [('attached', 'ios', 'U2', 'attached')])
+        self.mux.detach('U1')
+        wait_for(lambda: len(self.events) == 2)
+        self.assertEqual(self.events[1], ('detached', 'ios', 'U1', 'attached'))
+        self.assertEqual(self.registry.ids('ios'), ['U2'])
+
+    def test_usb_and_network_connections_of_one_device(self):
+        self.events.clear()
+        self.mux.attach_network('U1')
+        self.mux.detach_network('U1')
+        self.mux.attach('U2')
+        wait_for(lambda: self.events)
+        # The WiFi connection coming and going leaves the USB device alone
+        self.assertEqual(self.events, [('attached', 'ios', 'U2', 'attached')])
+        self.assertEqual(sorted(self.registry.ids('ios', 'attached')), ['U1', 'U2'])
+        
+        self.mux.attach_network('U1')
+        self.mux.detach('U1')
+        wait_for(lambda: len(self.events) == 2)
+        self.assertEqual(self.events[1], ('changed', 'ios', 'U1', 'network'))
+        self.assertEqual(self.registry.ids('ios', 'attached'), ['U2'])
+        self.assertEqual(self.registry.get('U1')['properties']['ConnectionType'], 'Network')
+        self.mux.detach_network('U1')
+        wait_for(lambda: len(self.events) == 3)
+        self.assertEqual(self.events[2], ('detached', 'ios', 'U1', 'network'))
+
+
+class NoDaemonTest(unittest.TestCase):
+    def test_start_does_not_wait_for_missing_daemons(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        registry = BluePhone.DeviceRegistry(BluePhone.ADBClient(port=port),
+                                            BluePhone.UsbmuxClient('/nonexistent/usbmuxd'), reconnect_delay=0.05)
+        start = time.monotonic()
+        registry.start(sync_timeout=5.0)
+        self.addCleanup(registry.stop)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertTrue(registry.is_synced('android') and registry.is_synced('ios'))
+        self.assertEqual(registry.devices(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+from tests.fakes import FakeADB, android_access
+
+
+def screencap(pixel_format, pixels, width=2, height=1):
+    return struct.pack('<IIII', width, height, pixel_format, 1) + pixels
+
+
+class ScreenFrameTest(unittest.TestCase):
+    PIXELS = bytes([1, 2, 3, 4, 5, 6, 7, 8])
+
+    def test_pixel_formats(self):
+        frame = BluePhone.ScreenFrame.from_screencap(screencap(1, self.PIXELS))
+        self.assertEqual(frame.pixels, self.PIXELS)
+        frame = BluePhone.ScreenFrame.from_screencap(screencap(2, self.PIXELS))
+        self.assertEqual(frame.pixels, bytes([1, 2, 3, 255, 5, 6, 7, 255]))
+        frame = BluePhone.ScreenFrame.from_screencap(screencap(5, self.PIXELS))
+        self.assertEqual(frame.pixels, bytes([3, 2, 1, 4, 7, 6, 5, 8]))
+        self.assertTrue(frame.to_png().startswith(BluePhone.PNG_SIGNATURE))
+
+    def test_unsupported_format(self):
+        self.assertIsNone(BluePhone.ScreenFrame.from_screencap(screencap(4, self.PIXELS)))
+        self.assertIsNone(BluePhone.ScreenFrame(2, 1, 4, self.PIXELS).to_png())
+
+
+class ScreenshotTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeADB(handler=self.handle)
+        self.addCleanup(self.server.close)
+        self.android = android_access(self.server)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output = os.path.join(tmp.name, 'shot.png')
+        self.replies = {}
+
+    def handle(self, serial, command):
+        return self.replies.get(command, (b'', 1))
+
+    def test_unsupported_raw_format_falls_back_to_png(self):
+        png = BluePhone.encode_png(1, 1, bytes(4))
+        self.replies = {'screencap': (screencap(4, bytes(8)), 0), 'screencap -p': (png, 0)}
+        self.assertTrue(self.android.screenshot(self.output, raw=True))
+        with open(self.output, 'rb') as f:
+            self.assertEqual(f.read(), png)
+
+    def test_failed_temp_file_screencap_is_not_pulled(self):
+        with mock.patch.object(self.android, 'pull') as pull:
+            self.assertFalse(self.android.screenshot(self.output))
+        pull.assert_not_called()
+        self.assertIn(('emu1', 'screencap -p /sdcard/screenshot.png'), self.server.commands)
+
+
+if __name__ == '__main__':
+    unittest.main()
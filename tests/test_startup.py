@@ -0,0 +1,32 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+class ProfileStartupTest(unittest.TestCase):
+    def test_profile_installs_nothing_and_keeps_the_user_cache(self):
+        with tempfile.TemporaryDirectory() as home:
+            cache_file = os.path.join(home, 'tools.json')
+            with open(cache_file, 'w') as f:
+                f.write('{"path": "x", "tools": {}}')
+            probe = BluePhone.ToolProbe(cache_file)
+            with mock.patch.object(BluePhone, 'tool_probe', probe), \
+                 mock.patch.object(BluePhone.InstallPlanner, 'ensure') as ensure, \
+                 mock.patch.object(BluePhone, 'run_command') as run_command, \
+                 contextlib.redirect_stdout(io.StringIO()):
+                result = BluePhone.profile_startup(runs=2)
+                self.assertIs(BluePhone.tool_probe, probe)
+            with open(cache_file) as f:
+                self.assertEqual(f.read(), '{"path": "x", "tools": {}}')
+        ensure.assert_not_called()
+        run_command.assert_not_called()
+        self.assertEqual((len(result['cold']), len(result['warm'])), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
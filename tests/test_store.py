@@ -0,0 +1,97 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+def reference_ends(store, data):
+    """The original per-byte gear hash loop, which every fast path must agree with"""
+    ends = []
+    start = 0
+    while start < len(data):
+        end = min(start + store.max_size, len(data))
+        cut = end
+        h = 0
+        for i in range(start + store.min_size, end):
+            h = ((h << 1) + store.GEAR[data[i]]) & 0xFFFFFFFFFFFFFFFF
+            if not h & store.mask:
+                cut = i + 1
+                break
+        ends.append(cut)
+        start = cut
+    return ends
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        rng = random.Random(7)
+        self.samples = [b'', b'x', bytes(5000), os.urandom(60000), bytes(rng.choice(b'ab') for _ in range(30000))]
+
+    def store(self, *sizes):
+        return BluePhone.ChunkStore(os.path.join(self.tmp, 'store'), *sizes)
+
+    def check_boundaries(self):
+        for sizes in [(64, 256, 1024), (16, 64, 200), (1000, 4096, 9000)]:
+            store = self.store(*sizes)
+            for data in self.samples:
+                expected = reference_ends(store, data)
+                self.assertEqual(store._ends(data), expected)
+                for read_size in (7, 1000, 65536):
+                    store.READ_SIZE = read_size
+                    ends = []
+                    for chunk in store.chunk_file(io.BytesIO(data)):
+                        ends.append(len(chunk) + (ends[-1] if ends else 0))
+                    self.assertEqual(ends, expected)
+
+    @unittest.skipIf(BluePhone.np is None, 'numpy not installed')
+    def test_vectorized_boundaries_match_gear_hash(self):
+        self.check_boundaries()
+
+    def test_pure_python_boundaries_match_gear_hash(self):
+        with mock.patch.object(BluePhone, 'np', None):
+            self.check_boundaries()
+
+    def test_streamed_ingest_and_restore(self):
+        source = os.path.join(self.tmp, 'src')
+        os.makedirs(os.path.join(source, 'sub'))
+        big = os.urandom(3 * 1024 * 1024 + 17)
+        for name, data in (('big.bin', big), ('sub/copy.bin', big), ('small.txt', b'hello')):
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(data)
+        
+        store = self.store()
+        store.READ_SIZE = 100000
+        stats = store.ingest_tree('snap', source)
+        self.assertEqual(stats['files'], 3)
+        self.assertEqual(stats['logical_bytes'], 2 * len(big) + 5)
+        self.assertLess(stats['stored_bytes'], len(big) + 1000)
+        
+        dest = os.path.join(self.tmp, 'dest')
+        self.assertEqual(store.restore('snap', dest, link='copy'), 3)
+        with open(os.path.join(dest, 'sub', 'copy.bin'), 'rb') as f:
+            self.assertEqual(f.read(), big)
+
+    def test_hardlinks_keep_each_files_metadata(self):
+        store = self.store()
+        store.put_bytes('snap', 'a', b'same', mtime=1000000, mode=0o644)
+        store.put_bytes('snap', 'b', b'same', mtime=1000000, mode=0o644)
+        store.put_bytes('snap', 'c', b'same', mtime=2000000, mode=0o600)
+        dest = os.path.join(self.tmp, 'dest')
+        store.restore('snap', dest)
+        
+        a, b, c = (os.stat(os.path.join(dest, name)) for name in 'abc')
+        self.assertEqual(a.st_ino, b.st_ino)
+        self.assertNotEqual(a.st_ino, c.st_ino)
+        self.assertEqual((a.st_mode & 0o7777, a.st_mtime), (0o644, 1000000))
+        self.assertEqual((c.st_mode & 0o7777, c.st_mtime), (0o600, 2000000))
+
+
+if __name__ == '__main__':
+    unittest.main()
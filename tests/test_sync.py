@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+
+import BluePhone
+from tests.fakes import FakeADB, android_access
+
+
+class SyncSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeADB()
+        self.addCleanup(self.server.close)
+        self.server.files['emu1'].update({
+            f'/sdcard/f{i}': (bytes([i]) * (1000 * i), 1600000000 + i, 0o100644) for i in range(4)})
+        self.server.files['emu1']['/sdcard/big'] = (os.urandom(200000), 1600000100, 0o100600)
+        # With sync_hold set, a client waiting for each reply stalls until this timeout
+        self.client = BluePhone.ADBClient(port=self.server.port, timeout=2.0)
+        self.addCleanup(self.client.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def test_stat_list_recv_send(self):
+        session = self.client.sync('emu1')
+        self.assertEqual(session.stat('/sdcard/f1'), (0o100644, 1000, 1600000001))
+        self.assertEqual(session.stat('/sdcard')[0], 0o040755)
+        self.assertEqual(session.stat('/missing')[0], 0)
+        names = {name: size for name, _, size, _ in session.list('/sdcard')}
+        self.assertEqual(names, {'f0': 0, 'f1': 1000, 'f2': 2000, 'f3': 3000, 'big': 200000})
+        
+        local = os.path.join(self.tmp, 'big')
+        self.assertEqual(session.pull('/sdcard/big', local), 200000)
+        with open(local, 'rb') as f:
+            self.assertEqual(f.read(), self.server.files['emu1']['/sdcard/big'][0])
+        os.utime(local, (1234567, 1234567))
+        os.chmod(local, 0o640)
+        self.assertEqual(session.push(local, '/sdcard/copy'), 200000)
+        data, mtime, mode = self.server.files['emu1']['/sdcard/copy']
+        self.assertEqual((len(data), mtime, mode), (200000, 1234567, 0o100640))
+        with self.assertRaises(BluePhone.ADBError):
+            session.pull('/sdcard/none', os.path.join(self.tmp, 'none'))
+
+    def test_pull_many_is_pipelined(self):
+        self.server.sync_hold = 4
+        session = self.client.sync('emu1')
+        transfers = [(f'/sdcard/f{i}', os.path.join(self.tmp, f'f{i}')) for i in range(4)]
+        done = list(session.pull_many(transfers, window=4))
+        self.assertEqual([size for _, _, size in done], [0, 1000, 2000, 3000])
+        with open(os.path.join(self.tmp, 'f3'), 'rb') as f:
+            self.assertEqual(f.read(), b'\x03' * 3000)
+
+    def test_failed_recv_leaves_no_file(self):
+        local = os.path.join(self.tmp, 'f1')
+        with open(local, 'wb') as f:
+            f.write(b'previous')
+        self.server.unreadable.add('/sdcard/f1')
+        with self.assertRaises(BluePhone.ADBSyncFailed):
+            self.client.sync('emu1').pull('/sdcard/f1', local)
+        self.assertEqual(os.listdir(self.tmp), ['f1'])
+        with open(local, 'rb') as f:
+            self.assertEqual(f.read(), b'previous')
+        
+        with self.assertRaises(BluePhone.ADBSyncFailed):
+            self.client.pull('/sdcard/none', os.path.join(self.tmp, 'none'), 'emu1')
+        self.assertEqual(os.listdir(self.tmp), ['f1'])
+
+    def test_push_many_is_pipelined(self):
+        transfers = []
+        for i in range(4):
+            local = os.path.join(self.tmp, f'up{i}')
+            with open(local, 'wb') as f:
+                f.write(b'u' * (i + 1))
+            transfers.append((local, f'/sdcard/up{i}'))
+        self.server.sync_hold = 4
+        done = list(self.client.sync('emu1').push_many(transfers, window=4))
+        self.assertEqual([size for _, _, size in done], [1, 2, 3, 4])
+        self.assertEqual(self.server.files['emu1']['/sdcard/up3'][0], b'uuuu')
+
+
+class FileSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeADB()
+        self.addCleanup(self.server.close)
+        self.android = android_access(self.server)
+        self.sync = BluePhone.FileSync(self.android)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.local = os.path.join(tmp.name, 'local')
+        os.makedirs(os.path.join(self.local, 'sub'))
+        for name in ('a', 'b', 'sub/c'):
+            self.write(name, name.encode())
+
+    def write(self, name, data, mtime=1600000000):
+        path = os.path.join(self.local, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def sent(self):
+        return sorted(path for kind, path in self.server.sync_requests if kind == 'SEND')
+
+    def test_push_only_changed_files(self):
+        result = self.sync.push(self.local, '/sdcard/dst', 'emu1')
+        self.assertEqual((result['transferred'], result['skipped']), (3, 0))
+        self.assertEqual(self.server.files['emu1']['/sdcard/dst/sub/c'][0], b'sub/c')
+        
+        self.server.sync_requests.clear()
+        self.write('a', b'a longer a')
+        self.write('b', b'b', mtime=1700000000)
+        result = self.sync.push(self.local, '/sdcard/dst', 'emu1')
+        self.assertEqual((result['transferred'], result['skipped']), (2, 1))
+        self.assertEqual(self.sent(), ['/sdcard/dst/a,33188', '/sdcard/dst/b,33188'])
+
+    def test_pull_only_changed_files(self):
+        files = self.server.files['emu1']
+        files.update({'/sdcard/src/x': (b'xx', 1600000000, 0o100644),
+                      '/sdcard/src/deep/y': (b'yyy', 1600000001, 0o100644)})
+        dest = os.path.join(self.local, 'pulled')
+        result = self.sync.pull('/sdcard/src', dest, 'emu1')
+        self.assertEqual((result['transferred'], result['skipped'], result['bytes']), (2, 0, 5))
+        self.assertEqual(os.stat(os.path.join(dest, 'deep', 'y')).st_mtime, 1600000001)
+        
+        files['/sdcard/src/x'] = (b'xx', 1600000005, 0o100644)
+        result = self.sync.pull('/sdcard/src', dest, 'emu1')
+        self.assertEqual((result['transferred'], result['skipped']), (1, 1))
+
+    def test_pull_continues_after_unreadable_file(self):
+        files = self.server.files['emu1']
+        files.update({f'/sdcard/src/{name}': (name.encode(), 1600000000, 0o100644) for name in 'abcd'})
+        self.server.unreadable.add('/sdcard/src/b')
+        dest = os.path.join(self.local, 'pulled')
+        result = self.sync.pull('/sdcard/src', dest, 'emu1')
+        self.assertEqual(result['failed'], ['/sdcard/src/b'])
+        self.assertEqual((result['transferred'], result['bytes']), (3, 3))
+        self.assertEqual(sorted(os.listdir(dest)), ['a', 'c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import sys
+import unittest
+from unittest import mock
+
+import BluePhone
+from tests.fakes import FakeADB, android_access
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        BluePhone.command_tracer.clear()
+        self.addCleanup(BluePhone.command_tracer.clear)
+
+    def test_run_command_feeds_input(self):
+        result = BluePhone.run_command([sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read())'],
+                                       text=False, input=b'frames')
+        self.assertEqual(result.stdout, b'frames')
+        entry = BluePhone.command_tracer.snapshot()[-1]
+        self.assertEqual((entry['returncode'], entry['stdout_bytes'], entry['mode']), (0, 6, 'sync'))
+        self.assertEqual(entry['caller'], 'TracerTest.test_run_command_feeds_input')
+
+    def test_subprocess_stream_is_recorded_on_close(self):
+        server = FakeADB()
+        self.addCleanup(server.close)
+        android = android_access(server)
+        android.adb_client = None
+        script = [sys.executable, '-c', 'print("h264")']
+        with mock.patch.object(android, 'adb_command', return_value=script):
+            stream = android.open_stream(['screenrecord', '-'])
+        self.assertEqual(BluePhone.command_tracer.snapshot(), [])
+        while stream.read():
+            pass
+        stream.close()
+        stream.close()
+        records = BluePhone.command_tracer.snapshot()
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['argv'], records[0]['returncode'], records[0]['stdout_bytes'], records[0]['mode']),
+                         (script, 0, 5, 'stream'))
+        self.assertEqual(records[0]['caller'], 'TracerTest.test_subprocess_stream_is_recorded_on_close')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+class FakeRunner:
+    """Records commands and fakes the files cmake would leave in the build tree"""
+
+    def __init__(self, fail=()):
+        self.commands = []
+        self.fail = set(fail)
+
+    def __call__(self, cmd, cwd=None):
+        self.commands.append(cmd)
+        if cmd[0] in self.fail:
+            return subprocess.CompletedProcess(cmd, 1, '', 'failed')
+        if cmd[:2] == ['cmake', '-S']:
+            build_dir = cmd[cmd.index('-B') + 1]
+            os.makedirs(build_dir, exist_ok=True)
+            open(os.path.join(build_dir, 'CMakeCache.txt'), 'w').close()
+        elif cmd[:2] == ['cmake', '--build']:
+            open(os.path.join(cmd[2], 'uxplay'), 'w').close()
+        elif cmd[:2] == ['git', 'clone']:
+            os.makedirs(cmd[3])
+            with open(os.path.join(cmd[3], 'CMakeLists.txt'), 'w') as f:
+                f.write('project(uxplay)\n')
+        return subprocess.CompletedProcess(cmd, 0, '', '')
+
+    def steps(self):
+        names = {('cmake', '-S'): 'configure', ('cmake', '--build'): 'build', ('git', 'clone'): 'clone'}
+        return [names.get(tuple(cmd[:2]), cmd[0]) for cmd in self.commands]
+
+
+class UxPlayBuilderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = os.path.join(self.tmp.name, 'UxPlay')
+        patcher = mock.patch.object(BluePhone, 'tool_probe')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def builder(self, runner):
+        return BluePhone.UxPlayBuilder(self.source, repo='repo', ccache=False, runner=runner, install=False)
+
+    def plain_tree(self):
+        os.makedirs(os.path.join(self.source, 'lib'))
+        for name in ('CMakeLists.txt', 'uxplay.cpp', os.path.join('lib', 'raop.c')):
+            with open(os.path.join(self.source, name), 'w') as f:
+                f.write(name + '\n')
+
+    def test_unchanged_tree_is_up_to_date(self):
+        self.plain_tree()
+        runner = FakeRunner()
+        self.assertTrue(self.builder(runner).build())
+        self.assertEqual(runner.steps(), ['configure', 'build'])
+        
+        runner.commands.clear()
+        self.assertTrue(self.builder(runner).build())
+        self.assertEqual(runner.commands, [])
+        self.assertEqual([run['result'] for run in self.builder(runner).history()], ['built', 'up-to-date'])
+
+    def test_option_change_reconfigures(self):
+        self.plain_tree()
+        runner = FakeRunner()
+        self.assertTrue(self.builder(runner).build())
+        
+        runner.commands.clear()
+        builder = self.builder(runner)
+        builder.ccache = '/usr/bin/ccache'
+        self.assertTrue(builder.build())
+        self.assertEqual(runner.steps(), ['configure', 'build'])
+
+    def test_fingerprint_change_rebuilds_without_configure(self):
+        self.plain_tree()
+        runner = FakeRunner()
+        self.assertTrue(self.builder(runner).build())
+        
+        with open(os.path.join(self.source, 'lib', 'raop.c'), 'a') as f:
+            f.write('/* changed */\n')
+        runner.commands.clear()
+        self.assertTrue(self.builder(runner).build())
+        self.assertEqual(runner.steps(), ['build'])
+
+    def test_failed_clone_leaves_nothing_and_is_retried(self):
+        failing = FakeRunner(fail=['git'])
+        self.assertFalse(self.builder(failing).build())
+        self.assertFalse(os.path.exists(self.source))
+        
+        runner = FakeRunner()
+        self.assertTrue(self.builder(runner).build())
+        self.assertEqual(runner.steps(), ['clone', 'configure', 'build'])
+
+    def test_leftover_build_dir_is_cloned_over(self):
+        # What an earlier failed clone used to leave behind
+        os.makedirs(os.path.join(self.source, 'build'))
+        with open(os.path.join(self.source, 'build', 'bluephone-builds.jsonl'), 'w') as f:
+            f.write('{}\n')
+        runner = FakeRunner()
+        self.assertTrue(self.builder(runner).build())
+        self.assertEqual(runner.steps(), ['clone', 'configure', 'build'])
+
+    def test_unrelated_directory_is_not_touched(self):
+        os.makedirs(self.source)
+        open(os.path.join(self.source, 'notes.txt'), 'w').close()
+        runner = FakeRunner()
+        self.assertFalse(self.builder(runner).build())
+        self.assertEqual(runner.commands, [])
+        self.assertTrue(os.path.exists(os.path.join(self.source, 'notes.txt')))
+
+
+if __name__ == '__main__':
+    unittest.main()
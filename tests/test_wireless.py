@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+import BluePhone
+
+
+class FakeHostClient:
+    """Answers the host: requests WirelessADB sends to the adb server
+
+    Addresses in refused never connect; the ones in warmup report 'offline'
+    for that many get-state calls after connecting, like adbd coming up.
+    """
+
+    def __init__(self, refused=(), warmup=None):
+        self.refused = set(refused)
+        self.warmup = dict(warmup or {})
+        self.devices = {}
+        self.requests = []
+
+    async def async_host_query(self, request):
+        self.requests.append(request)
+        kind, _, address = request.partition(':')[2].partition(':')
+        if request.startswith('host-serial:'):
+            address = request.split(':', 1)[1].rsplit(':', 1)[0]
+            if self.warmup.get(address):
+                self.warmup[address] -= 1
+                return 'offline'
+            return self.devices.get(address, 'unknown')
+        if kind == 'connect':
+            if address in self.refused:
+                return f'failed to connect to {address}: Connection refused'
+            self.devices[address] = 'device'
+            return f'connected to {address}'
+        if kind == 'disconnect':
+            self.devices.pop(address, None)
+            return ''
+        if request == 'host:devices':
+            return ''.join(f"{address}\t{state}\n" for address, state in self.devices.items())
+        raise BluePhone.ADBError(f'unknown request {request}')
+
+
+class WirelessADBTest(unittest.TestCase):
+    def manager(self, client, addresses, **kw):
+        android = mock.Mock()
+        android.adb_server.return_value = client
+        manager = BluePhone.WirelessADB(android, addresses, **kw)
+        manager.BACKOFF = (0.01, 0.02)
+        return manager
+
+    def test_connects_concurrently_and_waits_for_readiness(self):
+        client = FakeHostClient(refused={'10.0.0.3:5555'}, warmup={'10.0.0.2:5555': 2})
+        manager = self.manager(client, ['10.0.0.1', '10.0.0.2:5555', '10.0.0.3', '10.0.0.1:5555'],
+                               connect_timeout=0.3)
+        stats = manager.connect_all()
+        self.assertEqual(list(stats), ['10.0.0.1:5555', '10.0.0.2:5555', '10.0.0.3:5555'])
+        self.assertEqual([(s['state'], s['attempts']) for s in stats.values()],
+                         [('device', 1), ('device', 3), ('failed', stats['10.0.0.3:5555']['attempts'])])
+        self.assertGreater(stats['10.0.0.3:5555']['attempts'], 1)
+        self.assertIn('Connection refused', stats['10.0.0.3:5555']['error'])
+        self.assertIsNotNone(stats['10.0.0.2:5555']['latency'])
+
+    def test_check_reconnects_dropped_devices(self):
+        client = FakeHostClient()
+        manager = self.manager(client, ['10.0.0.1', '10.0.0.2'])
+        
+        async def scenario():
+            await manager.async_connect_all()
+            client.devices['10.0.0.1:5555'] = 'offline'
+            with contextlib.redirect_stdout(io.StringIO()):
+                dropped = await manager.check()
+            await asyncio.gather(*manager.reconnecting.values())
+            return dropped
+        
+        self.assertEqual(asyncio.run(scenario()), ['10.0.0.1:5555'])
+        self.assertIn('host:disconnect:10.0.0.1:5555', client.requests)
+        stats = manager.stats['10.0.0.1:5555']
+        self.assertEqual((stats['state'], stats['drops'], stats['connects']), ('device', 1, 2))
+        self.assertEqual(manager.stats['10.0.0.2:5555']['drops'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()